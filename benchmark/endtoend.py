@@ -0,0 +1,337 @@
+#!/usr/bin/env python
+"""End to end benchmark of the camera to recorder to disk path, needing
+no camera hardware.
+
+For each camera count, starts that many camera.py processes using the
+fake picamera in benchmark/fakecamera, each bound to its own loopback
+address, and one recorder.py writing to a temporary folder.  This
+process acts as a headless monitor, fetching a still from every camera
+each --still-interval seconds and subscribing to their MJPEG feeds, and
+collects everyone's published metrics.  After --warmup seconds it
+measures for --duration seconds and reports:
+
+    video sent and written to disk, in Mbit/s over all cameras
+    video messages lost on the way to the recorder or dropped by it
+    capture to recorder, camera send and recorder write latency, mean
+    and 95th percentile
+    still round trip time and MJPEG frames received per camera
+    CPU use and resident memory of the camera and recorder processes
+
+With --relay the recorder takes the cameras' video and events through
+relay.py rather than from each camera.  Without --source an H.264 file
+and a JPEG are generated with ffmpeg.
+Run from the repository root:
+
+    python -m benchmark.endtoend --cameras 1 2 4 --duration 30
+"""
+
+from __future__ import print_function
+
+import os
+import sys
+import zmq
+import json
+import time
+import shutil
+import signal
+import argparse
+import tempfile
+import subprocess
+
+import config
+from data.stillserver import StillClient
+from tools.stattail import percentile_bound
+
+REPO_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+FAKE_CAMERA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fakecamera')
+CLOCK_TICKS = os.sysconf('SC_CLK_TCK')
+
+
+def generate_sources(ffmpeg, folder, fps, resolution, seconds=10):
+    """Makes an H.264 test pattern, with headers on every keyframe and no
+    B-frames like the Pi's encoder, and a JPEG still."""
+    h264 = os.path.join(folder, 'sample.h264')
+    still = os.path.join(folder, 'sample.jpg')
+    size = '%ix%i' % resolution
+    subprocess.check_call([ffmpeg, '-v', 'error', '-y', '-f', 'lavfi',
+                           '-i', 'testsrc=size=%s:rate=%s' % (size, fps), '-t', str(seconds),
+                           '-c:v', 'libx264', '-pix_fmt', 'yuv420p', '-profile:v', 'main', '-b:v', '1M',
+                           '-x264-params', 'keyint=%i:bframes=0:repeat-headers=1' % (fps * 2), '-f', 'h264', h264])
+    subprocess.check_call([ffmpeg, '-v', 'error', '-y', '-f', 'lavfi',
+                           '-i', 'testsrc=size=480x320:rate=1', '-frames:v', '1', still])
+    return h264, still
+
+
+def write_config(folder, name, settings):
+    with open(os.path.join(folder, name), 'w') as f:
+        json.dump(settings, f, indent=2)
+
+
+def process_usage(pid):
+    """Returns the CPU seconds used by a process and its resident memory in bytes."""
+    with open('/proc/%i/stat' % pid) as f:
+        fields = f.read().rsplit(')', 1)[1].split()
+    cpu = (int(fields[11]) + int(fields[12])) / float(CLOCK_TICKS)
+    rss = 0
+    with open('/proc/%i/status' % pid) as f:
+        for line in f:
+            if line.startswith('VmRSS:'):
+                rss = int(line.split()[1]) * 1024
+    return cpu, rss
+
+
+def folder_size(folder):
+    return sum(os.path.getsize(os.path.join(path, name))
+               for path, dirs, names in os.walk(folder) for name in names if name.endswith('.ts'))
+
+
+def metric_values(snapshots, name):
+    """Returns every sample of the named metric across the snapshots."""
+    return [sample for snapshot in snapshots.values() for sample in snapshot['metrics']
+            if sample['name'] == name]
+
+
+def counter_total(snapshots, name):
+    return sum(sample['value'] for sample in metric_values(snapshots, name))
+
+
+def latency_text(snapshots, name):
+    samples = metric_values(snapshots, name)
+    count = sum(sample['count'] for sample in samples)
+    if not count:
+        return 'n/a'
+    merged = {'count': count, 'buckets': []}
+    if samples:
+        merged['buckets'] = [(bound, sum(sample['buckets'][i][1] for sample in samples))
+                             for i, (bound, _) in enumerate(samples[0]['buckets'])]
+    bound = percentile_bound(merged, 0.95)
+    return '%.2fms/%s' % (1000 * sum(sample['sum'] for sample in samples) / count,
+                          '<=%gms' % (1000 * bound) if bound is not None else '>max')
+
+
+class Run(object):
+    """One benchmark run with a given number of cameras."""
+
+    def __init__(self, args, cameras, h264, still):
+        self.args = args
+        self.cameras = cameras
+        self.h264 = h264
+        self.still = still
+        self.folder = tempfile.mkdtemp(prefix='pimonitor-bench-')
+        self.addresses = ['127.0.0.%i' % (10 + i) for i in range(cameras)]
+        self.camera_processes = []
+        self.recorder_process = None
+        self.relay_process = None
+
+        config_dir = os.path.join(REPO_DIR, 'config')
+        self.network_config = config.load_from_file(os.path.join(config_dir, 'network.json'))
+        self.camera_config = config.load_from_file(os.path.join(config_dir, 'camera.json'))
+        self.motion_config = config.load_from_file(os.path.join(config_dir, 'motion.json'))
+        self.recorder_config = config.load_from_file(os.path.join(config_dir, 'recorder.json'))
+
+    def start_process(self, script, config_dir, env=None):
+        log = open(os.path.join(config_dir, 'output.log'), 'w')
+        return subprocess.Popen([sys.executable, os.path.join(REPO_DIR, script), '--config-dir', config_dir],
+                                cwd=REPO_DIR, env=env, stdout=log, stderr=subprocess.STDOUT,
+                                preexec_fn=lambda: signal.signal(signal.SIGINT, signal.SIG_DFL))
+
+    def start(self):
+        env = dict(os.environ)
+        env['PYTHONPATH'] = os.pathsep.join([FAKE_CAMERA_DIR, REPO_DIR, env.get('PYTHONPATH', '')])
+        env['FAKE_PICAMERA_H264'] = self.h264
+        env['FAKE_PICAMERA_JPEG'] = self.still
+
+        for i, address in enumerate(self.addresses):
+            config_dir = os.path.join(self.folder, 'camera%i' % i)
+            os.mkdir(config_dir)
+            camera_config = dict(self.camera_config, hostname='fakecam%i' % i, bind_address=address,
+                                 framerate=self.args.fps, adaptive_bitrate=0, metrics_interval=1,
+                                 resolution_x=self.args.resolution[0], resolution_y=self.args.resolution[1])
+            write_config(config_dir, 'camera.json', camera_config)
+            write_config(config_dir, 'network.json', self.network_config)
+            write_config(config_dir, 'motion.json', self.motion_config)
+            self.camera_processes.append(self.start_process('camera.py', config_dir, env))
+
+        if self.args.relay:
+            config_dir = os.path.join(self.folder, 'relay')
+            os.mkdir(config_dir)
+            relay_config = config.load_from_file(os.path.join(REPO_DIR, 'config', 'relay.json'))
+            write_config(config_dir, 'relay.json', dict(relay_config, camera_ip_addrs=self.addresses,
+                                                        bind_address='127.0.0.1', metrics_interval=1))
+            write_config(config_dir, 'network.json', self.network_config)
+            self.relay_process = self.start_process('relay.py', config_dir)
+
+        config_dir = os.path.join(self.folder, 'recorder')
+        os.mkdir(config_dir)
+        recorder_config = dict(self.recorder_config, camera_ip_addrs=self.addresses,
+                               relay_addr='127.0.0.1' if self.args.relay else None,
+                               recording_folder=os.path.join(self.folder, 'recordings'),
+                               event_store=os.path.join(self.folder, 'events.db'), event_log=None,
+                               metrics_interval=1, metrics_textfile='', trigger_mode=0, ffmpeg=self.args.ffmpeg)
+        write_config(config_dir, 'recorder.json', recorder_config)
+        write_config(config_dir, 'network.json', self.network_config)
+        write_config(config_dir, 'camera.json', dict(self.camera_config, framerate=self.args.fps))
+        self.recorder_process = self.start_process('recorder.py', config_dir)
+
+    def stop(self):
+        processes = self.camera_processes + [self.relay_process, self.recorder_process]
+        for process in processes:
+            if process is not None and process.poll() is None:
+                process.send_signal(signal.SIGINT)
+        deadline = time.time() + 10
+        for process in processes:
+            if process is None:
+                continue
+            while process.poll() is None and time.time() < deadline:
+                time.sleep(0.1)
+            if process.poll() is None:
+                process.kill()
+                process.wait()
+
+    def usage(self):
+        cameras = [process_usage(process.pid) for process in self.camera_processes]
+        recorder = process_usage(self.recorder_process.pid)
+        return (sum(cpu for cpu, rss in cameras), max(rss for cpu, rss in cameras)), recorder
+
+    def measure(self):
+        context = zmq.Context()
+        poller = zmq.Poller()
+
+        stats = context.socket(zmq.SUB)
+        stats.setsockopt(zmq.SUBSCRIBE, '')
+        for address in self.addresses:
+            stats.connect('tcp://%s:%i' % (address, self.network_config['camera_stats_port']))
+        stats.connect('tcp://127.0.0.1:%i' % self.network_config['recorder_stats_port'])
+        if self.args.relay:
+            stats.connect('tcp://127.0.0.1:%i' % self.network_config['relay_stats_port'])
+        poller.register(stats, zmq.POLLIN)
+
+        clients = {}
+        mjpeg_frames = {}
+        for address in self.addresses:
+            jpegsocket = context.socket(zmq.DEALER)
+            jpegsocket.connect('tcp://%s:%i' % (address, self.network_config['jpeg_router_port']))
+            clients[jpegsocket] = StillClient(jpegsocket, self.network_config['still_credit'], address)
+            poller.register(jpegsocket, zmq.POLLIN)
+
+            mjpegsocket = context.socket(zmq.SUB)
+            mjpegsocket.setsockopt(zmq.CONFLATE, 1)
+            mjpegsocket.setsockopt(zmq.SUBSCRIBE, '')
+            mjpegsocket.connect('tcp://%s:%i' % (address, self.network_config['mjpeg_pub_port']))
+            mjpeg_frames[mjpegsocket] = 0
+            poller.register(mjpegsocket, zmq.POLLIN)
+
+        snapshots = {}
+        round_trips = []
+        start = time.time()
+        measure_start = start + self.args.warmup
+        end = measure_start + self.args.duration
+        next_still = start
+        begin = None
+        try:
+            while time.time() < end:
+                now = time.time()
+                if begin is None and now >= measure_start:
+                    begin = (now, dict(snapshots), folder_size(self.folder), self.usage(), dict(mjpeg_frames))
+                    round_trips = []
+                if now >= next_still:
+                    next_still = now + self.args.still_interval
+                    for client in clients.values():
+                        client.fetch((480, 320))
+
+                for sock, status in poller.poll(100):
+                    if sock is stats:
+                        host, payload = sock.recv_multipart()
+                        snapshots[host] = json.loads(payload)
+                    elif sock in clients:
+                        if clients[sock].handle(sock.recv_multipart()) is not None:
+                            round_trips.append(time.time() - clients[sock].fetched_at)
+                    else:
+                        sock.recv()
+                        mjpeg_frames[sock] += 1
+
+            finish = (time.time(), snapshots, folder_size(self.folder), self.usage(), mjpeg_frames)
+        finally:
+            context.destroy(linger=0)
+        return begin, finish, round_trips
+
+    def report(self, begin, finish, round_trips):
+        (start, start_snapshots, start_size, start_usage, start_mjpeg) = begin
+        (end, end_snapshots, end_size, end_usage, end_mjpeg) = finish
+        elapsed = end - start
+
+        def delta(name):
+            return counter_total(end_snapshots, name) - counter_total(start_snapshots, name)
+
+        received = delta('ingest_received_total')
+        # Messages dropped by the cameras show up as lost at the recorder.
+        dropped = delta('ingest_dropped_messages_total') + delta('video_lost_messages_total')
+        (camera_cpu_start, _), (recorder_cpu_start, _) = start_usage
+        (camera_cpu_end, camera_rss), (recorder_cpu_end, recorder_rss) = end_usage
+        mjpeg = sum(end_mjpeg[sock] - start_mjpeg.get(sock, 0) for sock in end_mjpeg)
+
+        print('%7i %9.2f %9.2f %7.2f%% %18s %18s %18s %9s %7.1f %9.1f%% %7.1f %9.1f%% %7.1f' % (
+              self.cameras,
+              delta('video_sent_bytes_total') * 8 / elapsed / 1e6,
+              (end_size - start_size) * 8 / elapsed / 1e6,
+              100.0 * dropped / max(received + dropped, 1),
+              latency_text(end_snapshots, 'video_latency_seconds'),
+              latency_text(end_snapshots, 'video_send_seconds'),
+              latency_text(end_snapshots, 'ingest_write_seconds'),
+              '%.1fms' % (1000 * sum(round_trips) / len(round_trips)) if round_trips else 'n/a',
+              mjpeg / elapsed / self.cameras,
+              100 * (camera_cpu_end - camera_cpu_start) / elapsed / self.cameras,
+              camera_rss / 1e6,
+              100 * (recorder_cpu_end - recorder_cpu_start) / elapsed,
+              recorder_rss / 1e6))
+        sys.stdout.flush()
+
+    def cleanup(self):
+        if self.args.keep:
+            print('Kept run folder %s.' % self.folder)
+        else:
+            shutil.rmtree(self.folder, ignore_errors=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='End to end benchmark with fake cameras.')
+    parser.add_argument('--cameras', type=int, nargs='+', default=[1, 2, 4], help='camera counts to run')
+    parser.add_argument('--duration', type=float, default=30, help='seconds measured per run')
+    parser.add_argument('--warmup', type=float, default=5, help='seconds before measuring')
+    parser.add_argument('--fps', type=int, default=15)
+    parser.add_argument('--resolution', type=int, nargs=2, default=[1280, 720])
+    parser.add_argument('--still-interval', type=float, default=1.0, help='seconds between still fetches')
+    parser.add_argument('--source', help='H.264 file to replay, generated if not given')
+    parser.add_argument('--still', help='JPEG to serve as stills and MJPEG frames')
+    parser.add_argument('--ffmpeg', default='ffmpeg', help='ffmpeg used to generate the sources')
+    parser.add_argument('--relay', action='store_true', help='record through a relay')
+    parser.add_argument('--keep', action='store_true', help='keep run folders, with logs and recordings')
+    args = parser.parse_args()
+
+    source_folder = tempfile.mkdtemp(prefix='pimonitor-bench-source-')
+    try:
+        h264, still = args.source, args.still
+        if h264 is None or still is None:
+            generated = generate_sources(args.ffmpeg, source_folder, args.fps, tuple(args.resolution))
+            h264, still = h264 or generated[0], still or generated[1]
+
+        print('Replaying %s at %i fps, %.0fs per run after %.0fs warm up.' % (h264, args.fps, args.duration,
+                                                                              args.warmup))
+        print('%7s %9s %9s %8s %18s %18s %18s %9s %7s %10s %7s %10s %7s' % (
+              'cameras', 'sent Mb/s', 'disk Mb/s', 'dropped', 'latency mean/p95', 'send mean/p95', 'write mean/p95',
+              'still rtt', 'mjpeg/s', 'camera cpu', 'cam MB', 'recorder', 'rec MB'))
+        for cameras in args.cameras:
+            run = Run(args, cameras, h264, still)
+            try:
+                run.start()
+                begin, finish, round_trips = run.measure()
+                run.report(begin, finish, round_trips)
+            finally:
+                run.stop()
+                run.cleanup()
+    finally:
+        shutil.rmtree(source_folder, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
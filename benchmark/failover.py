@@ -0,0 +1,237 @@
+#!/usr/bin/env python
+"""Failover benchmark of a cluster of recorders sharing the cameras,
+needing no camera hardware.
+
+Starts --cameras camera.py processes using the fake picamera and
+--recorders recorder.py processes, each bound to its own loopback
+address and listing the others in cluster_peers.  The recorders'
+published metrics show which of them is receiving each camera's video.
+Once every camera has been recorded for --warmup seconds the recorder
+with the most cameras is killed with SIGKILL, and after --duration
+seconds it is started again.  For each change it reports:
+
+    the cameras moved and how long each went unrecorded
+    the seconds in which a camera was recorded by two recorders at once
+
+Without --source an H.264 file and a JPEG are generated with ffmpeg.
+Run from the repository root:
+
+    python -m benchmark.failover --cameras 4 --recorders 3
+"""
+
+from __future__ import print_function
+
+import os
+import zmq
+import json
+import time
+import shutil
+import signal
+import argparse
+import tempfile
+
+from benchmark.endtoend import Run, REPO_DIR, FAKE_CAMERA_DIR, generate_sources, write_config
+
+
+class FailoverRun(Run):
+    """Fake cameras recorded by a cluster of recorders."""
+
+    def __init__(self, args, h264, still):
+        super(FailoverRun, self).__init__(args, args.cameras, h264, still)
+        self.recorder_addresses = ['127.0.0.%i' % (20 + i) for i in range(args.recorders)]
+        self.recorder_processes = {}
+
+    def start(self):
+        env = dict(os.environ)
+        env['PYTHONPATH'] = os.pathsep.join([FAKE_CAMERA_DIR, REPO_DIR, env.get('PYTHONPATH', '')])
+        env['FAKE_PICAMERA_H264'] = self.h264
+        env['FAKE_PICAMERA_JPEG'] = self.still
+
+        for i, address in enumerate(self.addresses):
+            config_dir = os.path.join(self.folder, 'camera%i' % i)
+            os.mkdir(config_dir)
+            camera_config = dict(self.camera_config, hostname='fakecam%i' % i, bind_address=address,
+                                 framerate=self.args.fps, adaptive_bitrate=0, metrics_interval=1,
+                                 resolution_x=self.args.resolution[0], resolution_y=self.args.resolution[1])
+            write_config(config_dir, 'camera.json', camera_config)
+            write_config(config_dir, 'network.json', self.network_config)
+            write_config(config_dir, 'motion.json', self.motion_config)
+            self.camera_processes.append(self.start_process('camera.py', config_dir, env))
+
+        for i, address in enumerate(self.recorder_addresses):
+            config_dir = os.path.join(self.folder, 'recorder%i' % i)
+            os.mkdir(config_dir)
+            recorder_config = dict(self.recorder_config, camera_ip_addrs=self.addresses, relay_addr=None,
+                                   recorder_name='recorder%i' % i, bind_address=address,
+                                   cluster_peers=[peer for peer in self.recorder_addresses if peer != address],
+                                   heartbeat_interval=self.args.heartbeat, heartbeat_timeout=self.args.timeout,
+                                   recording_folder=os.path.join(config_dir, 'recordings'),
+                                   event_store=os.path.join(config_dir, 'events.db'), event_log=None,
+                                   metrics_interval=1, metrics_textfile='', trigger_mode=0,
+                                   ffmpeg=self.args.ffmpeg)
+            write_config(config_dir, 'recorder.json', recorder_config)
+            write_config(config_dir, 'network.json', self.network_config)
+            write_config(config_dir, 'camera.json', dict(self.camera_config, framerate=self.args.fps))
+            self.start_recorder(i)
+
+    def start_recorder(self, i):
+        config_dir = os.path.join(self.folder, 'recorder%i' % i)
+        self.recorder_processes[i] = self.start_process('recorder.py', config_dir)
+
+    def kill_recorder(self, i):
+        process = self.recorder_processes.pop(i)
+        process.kill()
+        process.wait()
+
+    def stop(self):
+        processes = self.camera_processes + list(self.recorder_processes.values())
+        for process in processes:
+            if process.poll() is None:
+                process.send_signal(signal.SIGINT)
+        deadline = time.time() + 10
+        for process in processes:
+            while process.poll() is None and time.time() < deadline:
+                time.sleep(0.1)
+            if process.poll() is None:
+                process.kill()
+                process.wait()
+
+    def measure(self):
+        """Follows which recorders are receiving each camera, killing and
+        restarting one of them along the way."""
+        context = zmq.Context()
+        stats = context.socket(zmq.SUB)
+        stats.setsockopt(zmq.SUBSCRIBE, '')
+        for address in self.recorder_addresses:
+            stats.connect('tcp://%s:%i' % (address, self.network_config['recorder_stats_port']))
+
+        received = {}
+        # Recorder names receiving each camera, and when each was last seen to.
+        recording = {}
+        history = []
+        start = time.time()
+        stable_since = None
+        killed = None
+        killed_at = None
+        restarted_at = None
+        try:
+            while time.time() < start + self.args.limit:
+                if stats.poll(100):
+                    host, payload = stats.recv_multipart()
+                    now = time.time()
+                    for sample in json.loads(payload)['metrics']:
+                        if sample['name'] != 'ingest_received_total':
+                            continue
+                        camera = sample['labels']['camera']
+                        previous = received.get((host, camera), sample['value'])
+                        received[(host, camera)] = sample['value']
+                        if sample['value'] > previous:
+                            recording.setdefault(camera, {})[host] = now
+
+                now = time.time()
+                # Metrics arrive every second, so allow a little over that.
+                current = dict((camera, sorted(host for host, seen in hosts.items() if now - seen < 1.5))
+                               for camera, hosts in recording.items())
+                if not history or history[-1][1] != current:
+                    history.append((now, current))
+
+                if killed is None:
+                    if len(current) < self.cameras or any(len(hosts) != 1 for hosts in current.values()):
+                        stable_since = None
+                    elif stable_since is None:
+                        stable_since = now
+                    elif now >= stable_since + self.args.warmup:
+                        owned = [sum(1 for hosts in current.values() if 'recorder%i' % i in hosts)
+                                 for i in range(self.args.recorders)]
+                        killed = owned.index(max(owned))
+                        print('Killing recorder%i, recording %s.' % (killed, ', '.join(
+                            sorted(camera for camera, hosts in current.items() if 'recorder%i' % killed in hosts))))
+                        self.kill_recorder(killed)
+                        killed_at = now
+                elif restarted_at is None and now >= killed_at + self.args.duration:
+                    print('Restarting recorder%i.' % killed)
+                    self.start_recorder(killed)
+                    restarted_at = now
+                elif restarted_at is not None and now >= restarted_at + self.args.duration:
+                    break
+        finally:
+            context.destroy(linger=0)
+        return history, killed, killed_at, restarted_at
+
+    def report(self, history, killed, killed_at, restarted_at):
+        if killed_at is None:
+            print('The cameras were never all recorded once, nothing was killed.')
+            return
+        name = 'recorder%i' % killed
+        self.report_change('After the kill', history, killed_at, restarted_at or history[-1][0], name)
+        if restarted_at is not None:
+            self.report_change('After the restart', history, restarted_at, history[-1][0], None)
+
+    def report_change(self, title, history, begin, end, dead):
+        """Reports the gaps and double recording between begin and end."""
+        print('%s:' % title)
+        before = [state for when, state in history if when <= begin][-1]
+        during = [(when, state) for when, state in history if begin < when <= end]
+        for camera in sorted(before):
+            owners = before[camera]
+            gap_start = None
+            gaps = 0.0
+            doubled = 0.0
+            moves = []
+            previous_time, previous = begin, owners
+            for when, state in during + [(end, None)]:
+                hosts = [host for host in previous if host != dead]
+                if not hosts:
+                    gaps += when - previous_time
+                    if gap_start is None:
+                        gap_start = previous_time
+                elif len(hosts) > 1:
+                    doubled += when - previous_time
+                if state is None:
+                    break
+                if state.get(camera, []) != previous:
+                    moves.append('%+.1fs %s' % (when - begin, ','.join(state.get(camera, [])) or '-'))
+                previous_time, previous = when, state.get(camera, [])
+            print('  %-10s %-22s unrecorded %5.1fs  recorded twice %5.1fs  %s' % (
+                  camera, ','.join(owners), gaps, doubled, '; '.join(moves) or 'unchanged'))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Recorder failover benchmark with fake cameras.')
+    parser.add_argument('--cameras', type=int, default=4)
+    parser.add_argument('--recorders', type=int, default=3)
+    parser.add_argument('--warmup', type=float, default=5, help='seconds of steady recording before the kill')
+    parser.add_argument('--duration', type=float, default=15, help='seconds watched after the kill and restart')
+    parser.add_argument('--limit', type=float, default=120, help='seconds before giving up')
+    parser.add_argument('--heartbeat', type=float, default=1, help='recorder heartbeat interval')
+    parser.add_argument('--timeout', type=float, default=3, help='recorder heartbeat timeout')
+    parser.add_argument('--fps', type=int, default=15)
+    parser.add_argument('--resolution', type=int, nargs=2, default=[640, 480])
+    parser.add_argument('--source', help='H.264 file to replay, generated if not given')
+    parser.add_argument('--still', help='JPEG to serve as stills and MJPEG frames')
+    parser.add_argument('--ffmpeg', default='ffmpeg', help='ffmpeg used to generate the sources')
+    parser.add_argument('--keep', action='store_true', help='keep the run folder, with logs and recordings')
+    args = parser.parse_args()
+
+    source_folder = tempfile.mkdtemp(prefix='pimonitor-bench-source-')
+    try:
+        h264, still = args.source, args.still
+        if h264 is None or still is None:
+            generated = generate_sources(args.ffmpeg, source_folder, args.fps, tuple(args.resolution))
+            h264, still = h264 or generated[0], still or generated[1]
+
+        print('%i cameras, %i recorders, heartbeat every %gs, timeout %gs.' % (
+              args.cameras, args.recorders, args.heartbeat, args.timeout))
+        run = FailoverRun(args, h264, still)
+        try:
+            run.start()
+            run.report(*run.measure())
+        finally:
+            run.stop()
+            run.cleanup()
+    finally:
+        shutil.rmtree(source_folder, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
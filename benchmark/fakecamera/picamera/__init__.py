@@ -0,0 +1,170 @@
+#!/usr/bin/env python
+"""Stand-in for the parts of picamera used by camera.py, so that the
+camera can be run without camera hardware.  Put the folder holding this
+package first on PYTHONPATH to use it.
+
+Video recordings replay the access units of the H.264 file named by the
+FAKE_PICAMERA_H264 environment variable at the camera's framerate,
+looping at the end, along with synthetic motion vector arrays for any
+motion output.  JPEG captures and MJPEG recordings return the JPEG file
+named by FAKE_PICAMERA_JPEG, or a placeholder if it is not set.  The
+replayed stream ignores resolution, bitrate and key frame requests.
+"""
+
+import os
+import time
+import logging
+import threading
+
+log = logging.getLogger(__name__)
+
+H264_ENV = 'FAKE_PICAMERA_H264'
+JPEG_ENV = 'FAKE_PICAMERA_JPEG'
+
+# Start and end of image markers only; enough to stand in for a JPEG on the wire.
+PLACEHOLDER_JPEG = b'\xff\xd8\xff\xd9'
+
+_access_units = None
+_motion_frames = {}
+
+
+def access_units():
+    """Returns the access units of the source H.264 file, read once."""
+    global _access_units
+    if _access_units is None:
+        from tools.h264publish import access_units as read_access_units
+        filename = os.environ.get(H264_ENV)
+        if not filename:
+            raise PiCameraError('Set %s to the H.264 file to replay.' % H264_ENV)
+        _access_units = list(read_access_units(filename))
+        log.info('Loaded %i access units from %s.', len(_access_units), filename)
+    return _access_units
+
+
+def jpeg():
+    filename = os.environ.get(JPEG_ENV)
+    if not filename:
+        return PLACEHOLDER_JPEG
+    with open(filename, 'rb') as f:
+        return f.read()
+
+
+def motion_frames(resolution):
+    if resolution not in _motion_frames:
+        from benchmark.motionkernel import synthetic_motion_frames
+        _motion_frames[resolution] = [a.tobytes() for a in synthetic_motion_frames(resolution, 300)]
+    return _motion_frames[resolution]
+
+
+class PiCameraError(Exception):
+    pass
+
+
+class PiVideoFrame(object):
+
+    def __init__(self, index=0, complete=False, timestamp=None):
+        self.index = index
+        self.complete = complete
+        self.timestamp = timestamp
+
+
+class FakePort(object):
+    """Stands in for an MMAL port, holding the parameters set on it."""
+
+    def __init__(self):
+        self.params = {}
+
+
+class FakeRecording(threading.Thread):
+    """Writes frames to an output at the camera's framerate."""
+
+    def __init__(self, camera, output, format, motion_output):
+        super(FakeRecording, self).__init__()
+        self.daemon = True
+        self.camera = camera
+        self.output = output
+        self.format = format
+        self.motion_output = motion_output
+        self.output_port = FakePort()
+        self.stopping = threading.Event()
+
+    def stop(self):
+        self.stopping.set()
+        self.join()
+
+    def run(self):
+        if self.format == 'h264':
+            frames = access_units()
+        else:
+            frames = [jpeg()]
+        motion = motion_frames(tuple(self.camera.resolution)) if self.motion_output is not None else None
+
+        interval = 1.0 / self.camera.framerate
+        next_frame = time.time()
+        index = 0
+        while not self.stopping.is_set():
+            delay = next_frame - time.time()
+            if delay > 0:
+                time.sleep(delay)
+            next_frame += interval
+
+            if self.format == 'h264':
+                self.camera.frame = PiVideoFrame(index, True, self.camera.timestamp)
+            self.output.write(frames[index % len(frames)])
+            if motion is not None:
+                self.motion_output.write(motion[index % len(motion)])
+            index += 1
+
+        if hasattr(self.output, 'flush'):
+            self.output.flush()
+
+
+class PiCamera(object):
+
+    def __init__(self):
+        self.resolution = (1280, 720)
+        self.framerate = 30
+        self.vflip = False
+        self.hflip = False
+        self.annotate_text = ''
+        self.frame = PiVideoFrame()
+        self._encoders = {}
+        self._started = time.time()
+
+    @property
+    def timestamp(self):
+        """Microseconds on the camera's clock."""
+        return int((time.time() - self._started) * 1e6)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, tb):
+        self.close()
+
+    def close(self):
+        for splitter_port in list(self._encoders):
+            self.stop_recording(splitter_port=splitter_port)
+
+    def start_recording(self, output, format=None, resize=None, splitter_port=1, motion_output=None, **options):
+        if splitter_port in self._encoders:
+            raise PiCameraError('The camera is already recording on port %i.' % splitter_port)
+        recording = FakeRecording(self, output, format or 'h264', motion_output)
+        self._encoders[splitter_port] = recording
+        recording.start()
+
+    def stop_recording(self, splitter_port=1):
+        self._encoders.pop(splitter_port).stop()
+
+    def request_key_frame(self, splitter_port=1):
+        pass
+
+    def capture(self, output, format=None, use_video_port=False, resize=None, splitter_port=0, **options):
+        time.sleep(1.0 / self.framerate)
+        output.write(jpeg())
+
+    def capture_continuous(self, output, format=None, use_video_port=False, resize=None, splitter_port=0,
+                           **options):
+        while True:
+            self.capture(output, format, use_video_port, resize, splitter_port)
+            yield output
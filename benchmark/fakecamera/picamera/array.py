@@ -0,0 +1,33 @@
+#!/usr/bin/env python
+
+import numpy as np
+
+MOTION_DTYPE = np.dtype([('x', 'i1'), ('y', 'i1'), ('sad', 'u2')])
+
+
+class PiMotionAnalysis(object):
+    """Hands each motion vector array written to it to analyse()."""
+
+    def __init__(self, camera, size=None):
+        self.camera = camera
+        self.size = size
+        self.shape = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, tb):
+        pass
+
+    def write(self, b):
+        if self.shape is None:
+            width, height = self.size or self.camera.resolution
+            self.shape = ((height + 15) // 16, (width + 15) // 16 + 1)
+        self.analyse(np.frombuffer(b, dtype=MOTION_DTYPE).reshape(self.shape))
+        return len(b)
+
+    def flush(self):
+        pass
+
+    def analyse(self, array):
+        raise NotImplementedError
@@ -0,0 +1,7 @@
+#!/usr/bin/env python
+
+MMAL_PARAMETER_VIDEO_BIT_RATE = 0x10001
+
+
+def mmal_port_parameter_set_uint32(port, parameter, value):
+    port.params[parameter] = value
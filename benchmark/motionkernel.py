@@ -0,0 +1,98 @@
+#!/usr/bin/env python
+"""Benchmark of the motion vector kernels, needing no camera.
+
+Feeds synthetic motion arrays shaped like picamera's (one record of x,
+y and sad per 16x16 macroblock, plus the extra column) through the
+original float kernel and MotionKernel, checks that they agree on every
+frame and reports frames/sec and, where tracemalloc is available, the
+peak temporary memory allocated per frame.
+
+Run from the repository root:  python -m benchmark.motionkernel [frames] [width height]
+"""
+
+from __future__ import print_function
+
+import sys
+import time
+import numpy as np
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+from motion.kernel import MotionKernel, BLOCK_SIZE
+
+MOTION_DTYPE = np.dtype([('x', 'i1'), ('y', 'i1'), ('sad', 'u2')])
+
+
+def motion_shape(resolution):
+    """Returns the shape of picamera's motion array for a resolution."""
+    width, height = resolution
+    return ((height + BLOCK_SIZE - 1) // BLOCK_SIZE, (width + BLOCK_SIZE - 1) // BLOCK_SIZE + 1)
+
+
+def synthetic_motion_frames(resolution, count, seed=0, noise=8, speed=40):
+    """Returns count motion arrays with low level noise everywhere and a
+    square of fast moving blocks which drifts across the frame."""
+    rnd = np.random.RandomState(seed)
+    shape = motion_shape(resolution)
+    size = max(shape[0] // 4, 1)
+    frames = []
+    for i in range(count):
+        a = np.zeros(shape, dtype=MOTION_DTYPE)
+        a['x'] = rnd.randint(-noise, noise + 1, shape)
+        a['y'] = rnd.randint(-noise, noise + 1, shape)
+        a['sad'] = rnd.randint(0, 1024, shape)
+        if i % 3:
+            row = (i // 3) % max(shape[0] - size, 1)
+            col = (i * 2) % max(shape[1] - size, 1)
+            a['x'][row:row + size, col:col + size] = rnd.randint(speed, 128, (size, size))
+            a['y'][row:row + size, col:col + size] = rnd.randint(-128, -speed, (size, size))
+        frames.append(a)
+    return frames
+
+
+def legacy_count(a, magnitude_threshold):
+    """The original analyse() kernel."""
+    magnitude_series = np.sqrt(np.square(a['x'].astype(np.float64)) +
+                               np.square(a['y'].astype(np.float64))).clip(0, 255).astype(np.uint8)
+    return (magnitude_series > magnitude_threshold).sum()
+
+
+def measure(name, count, frames):
+    start = time.time()
+    results = [count(a) for a in frames]
+    elapsed = max(time.time() - start, 1e-9)
+
+    peak = 'n/a'
+    if tracemalloc is not None:
+        count(frames[0])
+        tracemalloc.start()
+        count(frames[0])
+        peak = '%i' % tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+
+    print('%-12s %10.1f frames/s %12s peak bytes/frame' % (name, len(frames) / elapsed, peak))
+    return results
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+    resolution = (int(sys.argv[2]), int(sys.argv[3])) if len(sys.argv) > 3 else (1920, 1080)
+    magnitude_threshold = 60
+
+    frames = synthetic_motion_frames(resolution, count)
+    print('%i frames of %s motion vectors.' % (count, 'x'.join(map(str, frames[0].shape))))
+
+    kernel = MotionKernel(magnitude_threshold)
+    legacy = measure('legacy', lambda a: legacy_count(a, magnitude_threshold), frames)
+    integer = measure('integer', kernel.count, frames)
+    assert legacy == integer, 'Kernels disagree.'
+
+    masked = MotionKernel(magnitude_threshold, exclude_regions=[[0, 0, resolution[0] // 2, resolution[1]]])
+    measure('integer+roi', masked.count, frames)
+
+
+if __name__ == '__main__':
+    main()
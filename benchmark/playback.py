@@ -0,0 +1,217 @@
+#!/usr/bin/env python
+"""Benchmark of the recorder's playback service with many concurrent
+viewers, needing no camera hardware.
+
+Writes --minutes of recordings of one camera from an H.264 file, in
+segments of --segment seconds, and starts a recorder.py with no cameras
+serving them.  For each viewer count this process plays back clips of
+--clip seconds from random times, each viewer starting another clip as
+soon as one ends and taking chunks as fast as they arrive, for
+--duration seconds.  It reports:
+
+    playback throughput, in MB/s and in real time streams
+    clips played and the mean time to the first chunk of a clip
+    CPU use and peak resident memory of the recorder
+
+Without --source an H.264 file is generated with ffmpeg.  Run from the
+repository root:
+
+    python -m benchmark.playback --viewers 1 4 16 --duration 10
+"""
+
+from __future__ import print_function
+
+import os
+import sys
+import zmq
+import time
+import random
+import shutil
+import signal
+import argparse
+import tempfile
+import subprocess
+
+import config
+from data.h264 import NalSplitter, AccessUnitSplitter
+from recording.segmenter import SegmentWriter, SegmentFinaliser
+from recording.playback import PlaybackClient, END
+from benchmark.endtoend import REPO_DIR, generate_sources, write_config, process_usage, folder_size
+
+HOST = 'fakecam0'
+
+
+def access_units(h264):
+    """Returns the access units of an H.264 file."""
+    with open(h264, 'rb') as f:
+        data = f.read()
+    nal_splitter = NalSplitter()
+    au_splitter = AccessUnitSplitter()
+    units = []
+    for unit in nal_splitter.feed(data) + nal_splitter.flush():
+        au = au_splitter.feed(unit)
+        if au:
+            units.append(b''.join(au))
+    au = au_splitter.flush()
+    if au:
+        units.append(b''.join(au))
+    return units
+
+
+def write_recordings(folder, h264, fps, minutes, segment):
+    """Records minutes of the looped H.264 file, ending now, and returns
+    the time it starts."""
+    units = access_units(h264)
+    frames = int(minutes * 60 * fps)
+    start = time.time() - frames / float(fps)
+    finaliser = SegmentFinaliser()
+    finaliser.start()
+    writer = SegmentWriter(HOST, folder, segment, fps, finaliser)
+    for i in range(frames):
+        timestamp = start + i / float(fps)
+        writer.write(units[i % len(units)], now=timestamp, captured=timestamp)
+    writer.close()
+    finaliser.stop()
+    return start
+
+
+class Viewer(object):
+    """Plays back random clips one after another."""
+
+    def __init__(self, context, address, credit):
+        self.socket = context.socket(zmq.DEALER)
+        self.socket.connect(address)
+        self.client = PlaybackClient(self.socket, credit)
+        self.requested = None
+        self.first_chunks = []
+        self.clips = 0
+
+    def play(self, start, clip):
+        self.requested = time.time()
+        self.client.play(HOST, start, clip)
+
+    def handle(self):
+        chunk = self.client.handle(self.socket.recv_multipart())
+        if chunk is not None and self.requested is not None:
+            self.first_chunks.append(time.time() - self.requested)
+            self.requested = None
+        if self.client.finished:
+            if self.client.status != END:
+                print('Playback failed with flags %i.' % self.client.status)
+            self.clips += 1
+        return len(chunk or b'')
+
+
+def measure(args, network_config, pid, start, viewers):
+    context = zmq.Context()
+    address = 'tcp://127.0.0.1:%i' % network_config['playback_port']
+    poller = zmq.Poller()
+    sockets = {}
+    for i in range(viewers):
+        viewer = Viewer(context, address, args.credit)
+        sockets[viewer.socket] = viewer
+        poller.register(viewer.socket, zmq.POLLIN)
+
+    latest = start + args.minutes * 60 - args.clip
+
+    def play(viewer):
+        viewer.play(random.uniform(start, latest), args.clip)
+
+    received = 0
+    rss_max = 0
+    next_usage = 0
+    began = time.time()
+    cpu_start, rss = process_usage(pid)
+    for viewer in sockets.values():
+        play(viewer)
+    try:
+        while time.time() < began + args.duration:
+            for sock, status in poller.poll(100):
+                viewer = sockets[sock]
+                received += viewer.handle()
+                if viewer.client.finished:
+                    play(viewer)
+            if time.time() >= next_usage:
+                next_usage = time.time() + 0.5
+                rss_max = max(rss_max, process_usage(pid)[1])
+        elapsed = time.time() - began
+        cpu_end, rss = process_usage(pid)
+    finally:
+        # Free the streams for the next run.
+        for viewer in sockets.values():
+            viewer.client.stop()
+        context.destroy(linger=1000)
+
+    first_chunks = [t for viewer in sockets.values() for t in viewer.first_chunks]
+    return (received / elapsed, sum(viewer.clips for viewer in sockets.values()),
+            sum(first_chunks) / len(first_chunks) if first_chunks else 0.0,
+            100 * (cpu_end - cpu_start) / elapsed, max(rss_max, rss))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Playback benchmark with many concurrent viewers.')
+    parser.add_argument('--viewers', type=int, nargs='+', default=[1, 4, 16], help='viewer counts to run')
+    parser.add_argument('--duration', type=float, default=10, help='seconds measured per run')
+    parser.add_argument('--minutes', type=float, default=10, help='minutes of recordings to play back from')
+    parser.add_argument('--segment', type=float, default=60, help='seconds per segment')
+    parser.add_argument('--clip', type=float, default=60, help='seconds per clip played')
+    parser.add_argument('--credit', type=int, default=8, help='chunks in flight per viewer')
+    parser.add_argument('--fps', type=int, default=15)
+    parser.add_argument('--resolution', type=int, nargs=2, default=[1280, 720])
+    parser.add_argument('--source', help='H.264 file to record, generated if not given')
+    parser.add_argument('--ffmpeg', default='ffmpeg', help='ffmpeg used to generate the source')
+    parser.add_argument('--keep', action='store_true', help='keep the run folder, with logs and recordings')
+    args = parser.parse_args()
+
+    folder = tempfile.mkdtemp(prefix='pimonitor-bench-')
+    recorder = None
+    try:
+        h264 = args.source or generate_sources(args.ffmpeg, folder, args.fps, tuple(args.resolution))[0]
+        recording_folder = os.path.join(folder, 'recordings')
+        start = write_recordings(recording_folder, h264, args.fps, args.minutes, args.segment)
+        bitrate = folder_size(recording_folder) / (args.minutes * 60)
+
+        config_dir = os.path.join(REPO_DIR, 'config')
+        network_config = config.load_from_file(os.path.join(config_dir, 'network.json'))
+        recorder_config = config.load_from_file(os.path.join(config_dir, 'recorder.json'))
+        camera_config = config.load_from_file(os.path.join(config_dir, 'camera.json'))
+        recorder_dir = os.path.join(folder, 'recorder')
+        os.mkdir(recorder_dir)
+        write_config(recorder_dir, 'recorder.json', dict(recorder_config, camera_ip_addrs=[], relay_addr=None,
+                                                         cluster_peers=[], bind_address='127.0.0.1',
+                                                         recording_folder=recording_folder,
+                                                         event_store=os.path.join(folder, 'events.db'),
+                                                         event_log=None, metrics_textfile='',
+                                                         playback_max_streams=max(args.viewers)))
+        write_config(recorder_dir, 'network.json', network_config)
+        write_config(recorder_dir, 'camera.json', camera_config)
+        log = open(os.path.join(recorder_dir, 'output.log'), 'w')
+        recorder = subprocess.Popen([sys.executable, os.path.join(REPO_DIR, 'recorder.py'),
+                                     '--config-dir', recorder_dir],
+                                    cwd=REPO_DIR, stdout=log, stderr=subprocess.STDOUT,
+                                    preexec_fn=lambda: signal.signal(signal.SIGINT, signal.SIG_DFL))
+        time.sleep(2)
+
+        print('%.0f minutes recorded at %.2f Mbit/s, %.0fs clips, %gs per run.' % (
+              args.minutes, bitrate * 8 / 1e6, args.clip, args.duration))
+        print('%7s %9s %10s %6s %12s %9s %7s' % (
+              'viewers', 'MB/s', 'real time', 'clips', 'first chunk', 'recorder', 'rec MB'))
+        for viewers in args.viewers:
+            throughput, clips, first_chunk, cpu, rss = measure(args, network_config, recorder.pid, start, viewers)
+            print('%7i %9.1f %9.0fx %6i %10.1fms %8.1f%% %7.1f' % (
+                  viewers, throughput / 1e6, throughput / bitrate, clips, 1000 * first_chunk, cpu, rss / 1e6))
+            sys.stdout.flush()
+            # Let the recorder catch up with the last run's requests.
+            time.sleep(2)
+    finally:
+        if recorder is not None:
+            recorder.send_signal(signal.SIGINT)
+            recorder.wait()
+        if args.keep:
+            print('Kept run folder %s.' % folder)
+        else:
+            shutil.rmtree(folder, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
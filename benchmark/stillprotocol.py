@@ -0,0 +1,154 @@
+#!/usr/bin/env python
+"""Loopback benchmark of the JPEG still transfer protocols.
+
+Runs a StillServer over TCP on localhost, serving a fixed still from a
+stand-in cache, and fetches it repeatedly with the original NEW/NEXT/
+ENDACK protocol and with the pipelined credit protocol.  Reports stills
+per second and the mean and worst time from request to complete image.
+
+Network round trip time can be simulated with --rtt, which holds every
+client message back for that many milliseconds before it is sent.
+
+Run from the repository root:  python -m benchmark.stillprotocol
+"""
+
+from __future__ import print_function
+
+import os
+import time
+import argparse
+import threading
+import collections
+
+import zmq
+
+from data.stillserver import StillServer, StillClient
+
+
+class FixedStillCache(object):
+    """Stands in for the camera's StillCache, always holding jpeg."""
+
+    def __init__(self, jpeg):
+        self.jpeg = jpeg
+
+    def get(self, resize, requester):
+        return self.jpeg
+
+    def completed(self):
+        return []
+
+
+def serve(context, address, jpeg, net_frame_size, chunk_size, stopping):
+    socket = context.socket(zmq.ROUTER)
+    socket.bind(address)
+    server = StillServer(socket, FixedStillCache(jpeg), net_frame_size, chunk_size)
+    while not stopping.is_set():
+        if socket.poll(100):
+            server.handle(socket.recv_multipart())
+    socket.close()
+
+
+class DelayedSocket(object):
+    """Wraps a client socket, holding each outgoing message back for delay seconds."""
+
+    def __init__(self, socket, delay):
+        self.socket = socket
+        self.delay = delay
+        self.outgoing = collections.deque()
+
+    def send(self, data):
+        self.outgoing.append((time.time() + self.delay, data))
+        self.flush()
+
+    def flush(self):
+        now = time.time()
+        while self.outgoing and self.outgoing[0][0] <= now:
+            self.socket.send(self.outgoing.popleft()[1])
+
+    def recv(self):
+        return self.wait(self.socket.recv)
+
+    def recv_multipart(self):
+        return self.wait(self.socket.recv_multipart)
+
+    def wait(self, receive):
+        while not self.socket.poll(1 if self.outgoing else 1000):
+            self.flush()
+        return receive()
+
+
+def fetch_legacy(socket, resize):
+    data = []
+    socket.send('NEW %i %i' % resize)
+    while True:
+        chunk = socket.recv()
+        if not chunk:
+            break
+        data.append(chunk)
+        socket.send('NEXT')
+    socket.send('ENDACK')
+    socket.recv()
+    return b''.join(data)
+
+
+def fetch_credit(client, socket, resize):
+    client.fetch(resize)
+    while True:
+        jpeg = client.handle(socket.recv_multipart())
+        if jpeg is not None:
+            return jpeg
+
+
+def measure(name, fetch, count):
+    times = []
+    start = time.time()
+    for _ in range(count):
+        requested = time.time()
+        jpeg = fetch()
+        times.append(time.time() - requested)
+    elapsed = max(time.time() - start, 1e-9)
+    print('%-24s %8.1f stills/s %9.2f ms mean %9.2f ms max %8i bytes' % (
+          name, count / elapsed, 1000 * sum(times) / len(times), 1000 * max(times), len(jpeg)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the JPEG still transfer protocols.')
+    parser.add_argument('--count', type=int, default=200, help='stills fetched per protocol')
+    parser.add_argument('--size', type=int, default=60000, help='size of the still in bytes')
+    parser.add_argument('--rtt', type=float, default=0.0, help='simulated round trip time in ms')
+    parser.add_argument('--frame-size', type=int, default=1490, help='legacy chunk size')
+    parser.add_argument('--chunk-size', type=int, default=16384, help='pipelined chunk size')
+    parser.add_argument('--credit', type=int, default=4, help='pipelined chunks in flight')
+    args = parser.parse_args()
+
+    context = zmq.Context()
+    address = 'tcp://127.0.0.1:5899'
+    stopping = threading.Event()
+    server = threading.Thread(target=serve, args=(context, address, os.urandom(args.size),
+                                                  args.frame_size, args.chunk_size, stopping))
+    server.start()
+
+    try:
+        print('%i byte still, %.1f ms simulated round trip.' % (args.size, args.rtt))
+        resize = (480, 320)
+
+        req = context.socket(zmq.REQ)
+        req.connect(address)
+        legacy = DelayedSocket(req, args.rtt / 1000.0)
+        measure('NEW/NEXT/ENDACK', lambda: fetch_legacy(legacy, resize), args.count)
+        req.close()
+
+        dealer = context.socket(zmq.DEALER)
+        dealer.connect(address)
+        delayed = DelayedSocket(dealer, args.rtt / 1000.0)
+        client = StillClient(delayed, args.credit)
+        measure('FETCH/CREDIT', lambda: fetch_credit(client, delayed, resize), args.count)
+        dealer.close()
+    finally:
+        stopping.set()
+        server.join()
+        context.term()
+
+
+if __name__ == '__main__':
+    main()
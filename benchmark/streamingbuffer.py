@@ -0,0 +1,158 @@
+#!/usr/bin/env python
+"""Microbenchmark of the H.264 output path buffering.
+
+Feeds encoder-sized writes through the original cStringIO based
+StreamingBuffer, the bytearray ring buffer and ZeroMqOutput, draining
+net_frame_size chunks exactly as the camera does.  Reports throughput,
+the number of freshly allocated chunk buffers handed to the socket and,
+where tracemalloc is available, peak heap usage over the run.
+
+Run from the repository root:  python -m benchmark.streamingbuffer
+"""
+
+from __future__ import print_function
+
+import os
+import sys
+import time
+import random
+
+try:
+    from cStringIO import StringIO
+except ImportError:
+    from io import BytesIO as StringIO
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+from data.streamingbuffer import StreamingBuffer
+from data.zmqoutput import ZeroMqOutput
+
+
+class LegacyStreamingBuffer(object):
+    """The original StreamingBuffer, kept here for comparison."""
+
+    def __init__(self):
+        self.buf = StringIO()
+        self.available = 0
+        self.size = 0
+        self.write_fp = 0
+
+    def read(self, size=None):
+        if size is None or size > self.available:
+            size = self.available
+        size = max(size, 0)
+
+        result = self.buf.read(size)
+        self.available -= size
+
+        if len(result) < size:
+            self.buf.seek(0)
+            result += self.buf.read(size - len(result))
+
+        return result
+
+    def write(self, data):
+        if self.size < self.available + len(data):
+            new_buf = StringIO()
+            new_buf.write(self.read())
+            self.write_fp = self.available = new_buf.tell()
+            read_fp = 0
+            while self.size <= self.available + len(data):
+                self.size = max(self.size, 1024) * 2
+            new_buf.write(b'0' * (self.size - self.write_fp))
+            self.buf = new_buf
+        else:
+            read_fp = self.buf.tell()
+
+        self.buf.seek(self.write_fp)
+        written = self.size - self.write_fp
+        self.buf.write(data[:written])
+        self.write_fp += len(data)
+        self.available += len(data)
+        if written < len(data):
+            self.write_fp -= self.size
+            self.buf.seek(0)
+            self.buf.write(data[written:])
+        self.buf.seek(read_fp)
+
+
+class CountingSocket(object):
+    """Stands in for the PUB socket and tallies what it is given."""
+
+    def __init__(self):
+        self.chunks = 0
+        self.allocated = 0
+        self.nbytes = 0
+
+    def send_multipart(self, parts, copy=True):
+        chunk = parts[-1]
+        self.chunks += 1
+        self.nbytes += len(chunk)
+        if not isinstance(chunk, memoryview):
+            self.allocated += 1
+
+
+def encoder_writes(count, seed=0):
+    """Returns a list of buffers shaped like picamera encoder output at
+    1Mbit/s: mostly small P frames with a large IDR every 30 writes."""
+    rnd = random.Random(seed)
+    pool = os.urandom(256 * 1024)
+    writes = []
+    for i in range(count):
+        size = 60000 if i % 30 == 0 else rnd.randint(2000, 12000)
+        start = rnd.randint(0, len(pool) - size)
+        writes.append(pool[start:start + size])
+    return writes
+
+
+def drain_buffer(buffer_class, writes, framesize):
+    sock = CountingSocket()
+    buf = buffer_class()
+    for data in writes:
+        buf.write(data)
+        while buf.available >= framesize:
+            sock.send_multipart([b'', buf.read(framesize)])
+    return sock
+
+
+def drain_output(writes, framesize):
+    sock = CountingSocket()
+    output = ZeroMqOutput(sock, b'bench', framesize)
+    for data in writes:
+        output.write(data)
+    return sock
+
+
+def measure(name, func, *args):
+    if tracemalloc is not None:
+        tracemalloc.start()
+    start = time.time()
+    sock = func(*args)
+    elapsed = max(time.time() - start, 1e-9)
+    peak = None
+    if tracemalloc is not None:
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+
+    print('%-24s %9.1f MB/s %9i chunks %9i allocated %12s peak bytes' % (
+          name, sock.nbytes / elapsed / 1e6, sock.chunks, sock.allocated,
+          'n/a' if peak is None else '%i' % peak))
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+    framesize = int(sys.argv[2]) if len(sys.argv) > 2 else 1490
+    writes = encoder_writes(count)
+    print('%i encoder writes, %i bytes, %i byte chunks.' % (
+          len(writes), sum(len(w) for w in writes), framesize))
+
+    measure('legacy StreamingBuffer', drain_buffer, LegacyStreamingBuffer, writes, framesize)
+    measure('ring StreamingBuffer', drain_buffer, StreamingBuffer, writes, framesize)
+    measure('ZeroMqOutput', drain_output, writes, framesize)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,122 +1,184 @@
 #!/usr/bin/env python
 
 # General modules
-import io
 import os
 import sys
 import zmq
 import picamera
 import socket
+import time
 import datetime
 import logging
+import argparse
+import functools
 
 # Project modules
 import config
 from motion.motiondetection import VectorThresholdMotionDetect
-from data.zmqoutput import ZeroMqOutput
+from data.zmqoutput import ZeroMqOutput, NalZeroMqOutput, MjpegZeroMqOutput
+from data.events import encode_episode, encode_bitrate, encode_activity, BITRATE, ACTIVITY
+from data.bitratecontrol import BitrateController, PiCameraEncoder
+from metrics.export import MetricsExporter
+from data.stillcapture import StillCache
+from data.stillserver import StillServer
 
 log = logging.getLogger(__name__)
 hostname = socket.gethostname()
 
-def stills_event_loop(jpegsocket, camera, net_frame_size, hostname, annotation, annotation_strftime):
-    """This function handles any incoming requests for JPEG stills.
-    Any clients requesting stills receive back chunks of the file
-    and must send continuation requests.
+def stills_event_loop(jpegsocket, still_server, camera, hostname, annotation, annotation_strftime,
+                      bitrate_controller=None):
+    """This function handles any incoming requests for JPEG stills,
+    which are answered by the still server, and keeps the annotation
+    and any adaptive bitrate up to date.
     """
 
     poller = zmq.Poller()
     poller.register(jpegsocket, zmq.POLLIN)
-
-    jpeg_requests = {}
+    poller.register(still_server.still_cache.notify, zmq.POLLIN)
 
     while True:
         socks = dict(poller.poll(100))
         if jpegsocket in socks and socks[jpegsocket] == zmq.POLLIN:
-            address, empty, req = jpegsocket.recv_multipart()
-
-            req = req.split(' ')
-
-            if req[0] == 'NEW':
-                log.info('Request for JPEG still received from %s.', address)
-                if address in jpeg_requests:
-                    jpeg_requests[address].close()
-                    del jpeg_requests[address]
-
-                # Create new stream and capture image to memory.
-                jpeg_requests[address] = io.BytesIO()
-                imgdim = None if len(req) == 1 else map(int, req[1:])
-                camera.capture(jpeg_requests[address], resize=imgdim, format='jpeg', use_video_port=True)
-                jpeg_requests[address].seek(0)
-                data = jpeg_requests[address].read(net_frame_size)
-
-            elif req[0] == 'NEXT':
-                # Check for still in progress and send next frame.
-                log.debug('Next frame requested by %s.', address)
-                data = jpeg_requests[address].read(net_frame_size)
-
-            elif req[0] == 'ENDACK':
-                # Transfer is complete and file acknowledged.
-                log.info('JPEG still transfer to %s acknowledged complete.', address)
-                data = b''
-        
-            jpegsocket.send_multipart([address, b'', data])
+            parts = jpegsocket.recv_multipart()
+            try:
+                still_server.handle(parts)
+            except (IndexError, ValueError) as e:
+                log.warning('Ignoring malformed still request from %r: %s', parts[0], e)
+
+        if still_server.still_cache.notify in socks:
+            still_server.completed()
 
         annotation_data = {'hostname': hostname, 'datetime': datetime.datetime.now().strftime(annotation_strftime)}
         camera.annotate_text = annotation % annotation_data
 
+        if bitrate_controller is not None:
+            bitrate_controller.update(time.time())
+
+
+def create_video_output(videosocket, camera, network_config):
+    """Create the output which publishes the encoder's H.264 stream
+    using the framing selected in the network configuration.
+    """
+    if network_config['video_framing'] == 'nal':
+        return NalZeroMqOutput(videosocket, hostname,
+                               network_config['nal_batch_size'],
+                               camera,
+                               network_config['gop_cache_size'])
+
+    return ZeroMqOutput(videosocket, hostname, network_config['net_frame_size'])
 
-def motion_event_handler(eventsocket):
+
+def motion_event_handler(eventsocket, event, episode):
     """Handle motion event using specified event socket.
     """
-    log.info('Motion event detected.')
-    eventsocket.send_multipart([hostname, 'MOTION', datetime.datetime.now().isoformat()])
+    log.info('Motion event detected: %s, %i peak blocks over %.1fs.', event, episode.peak_blocks, episode.duration)
+    eventsocket.send_multipart([hostname, event, encode_episode(episode)])
 
 
-def main():
-    log.info('Starting camera feed server on %s.', hostname)
-    
+def activity_event_handler(eventsocket, summary):
+    """Publish a summary of recent motion activity using specified event socket.
+    """
+    eventsocket.send_multipart([hostname, ACTIVITY, encode_activity(summary)])
+
+
+def bitrate_event_handler(eventsocket, bitrate, previous, send_rate):
+    """Report a change of video bitrate using specified event socket.
+    """
+    eventsocket.send_multipart([hostname, BITRATE, encode_bitrate(time.time(), bitrate, previous, send_rate)])
+
+
+def main(config_dir=None):
+    global hostname
+
     module_dir = os.path.dirname(__file__) 
+    config_dir = config_dir or os.path.join(module_dir, 'config')
     
-    motion_config = config.load_from_file(os.path.join(module_dir, 'config/motion.json'))
-    camera_config = config.load_from_file(os.path.join(module_dir, 'config/camera.json'))
-    network_config = config.load_from_file(os.path.join(module_dir, 'config/network.json'))
+    motion_config = config.load_from_file(os.path.join(config_dir, 'motion.json'))
+    camera_config = config.load_from_file(os.path.join(config_dir, 'camera.json'))
+    network_config = config.load_from_file(os.path.join(config_dir, 'network.json'))
+
+    if camera_config['hostname']:
+        hostname = str(camera_config['hostname'])
+    log.info('Starting camera feed server on %s.', hostname)
     
     magnitude_threshold = motion_config['magnitude_threshold']
     block_threshold = motion_config['block_threshold']
 
     bitrate = camera_config['bitrate']
+    adaptive_bitrate = camera_config['adaptive_bitrate'] and network_config['video_framing'] == 'nal'
     framerate = camera_config['framerate']
     resolution = camera_config['resolution_x'], camera_config['resolution_y']
     vflip = True if camera_config['vflip'] else False
     hflip = True if camera_config['hflip'] else False
     annotation = camera_config['annotation']
     annotation_strftime = camera_config['annotation_strftime']
+    still_splitter_ports = camera_config['still_splitter_ports']
+    still_max_age = camera_config['still_max_age']
+    mjpeg_fps = camera_config['mjpeg_fps']
+    mjpeg_resolution = camera_config['mjpeg_resolution_x'], camera_config['mjpeg_resolution_y']
+    mjpeg_quality = camera_config['mjpeg_quality']
+    mjpeg_splitter_port = camera_config['mjpeg_splitter_port']
 
     net_frame_size = network_config['net_frame_size']
+    still_chunk_size = network_config['still_chunk_size']
+    video_framing = network_config['video_framing']
     eventport = network_config['event_pub_port']
     videoport = network_config['h264_pub_port']
     jpegport = network_config['jpeg_router_port']
+    mjpegport = network_config['mjpeg_pub_port']
+    bind_address = camera_config['bind_address']
     
     context = zmq.Context()
+    metrics_exporter = MetricsExporter(context, hostname,
+                                       camera_config['metrics_interval'],
+                                       network_config['camera_stats_port'],
+                                       camera_config['metrics_textfile'],
+                                       bind_address=bind_address)
+    metrics_exporter.start()
+
     log.info('Binding event publish socket to port %i.', eventport)
     eventsocket = context.socket(zmq.PUB)
-    eventsocket.bind('tcp://*:%s' % eventport)
+    eventsocket.bind('tcp://%s:%s' % (bind_address, eventport))
     
-    log.info('Binding video publish socket to port %i.', videoport)
-    videosocket = context.socket(zmq.PUB)
-    videosocket.bind('tcp://*:%s' % videoport)
+    if video_framing == 'nal':
+        # XPUB lets the video output see new subscribers so that it
+        # can replay the current GOP to them.
+        log.info('Binding NAL framed video publish socket to port %i.', videoport)
+        videosocket = context.socket(zmq.XPUB)
+        videosocket.setsockopt(zmq.XPUB_VERBOSE, 1)
+        if adaptive_bitrate:
+            # Refuse messages a subscriber cannot take, so that the
+            # bitrate controller can see it.  This holds them back from
+            # every subscriber, so it is off unless asked for.
+            videosocket.setsockopt(zmq.XPUB_NODROP, 1)
+    else:
+        log.info('Binding video publish socket to port %i.', videoport)
+        videosocket = context.socket(zmq.PUB)
+    videosocket.bind('tcp://%s:%s' % (bind_address, videoport))
 
     log.info('Binding JPEG router socket to port %i.', jpegport)
     jpegsocket = context.socket(zmq.ROUTER)
-    jpegsocket.bind('tcp://*:%s' % jpegport)
+    jpegsocket.bind('tcp://%s:%s' % (bind_address, jpegport))
+
+    log.info('Binding MJPEG publish socket to port %i.', mjpegport)
+    mjpegsocket = context.socket(zmq.PUB)
+    # Keep slow subscribers to the newest frames rather than a backlog.
+    mjpegsocket.setsockopt(zmq.SNDHWM, 2)
+    mjpegsocket.bind('tcp://%s:%s' % (bind_address, mjpegport))
 
     with picamera.PiCamera() as camera, \
-         ZeroMqOutput(videosocket, hostname, net_frame_size) as video_output, \
+         create_video_output(videosocket, camera, network_config) as video_output, \
          VectorThresholdMotionDetect(motion_event_handler, 
                                      magnitude_threshold,
                                      block_threshold,
                                      eventsocket,
-                                     camera) as motion_detector:
+                                     camera,
+                                     include_regions=motion_config['include_regions'],
+                                     exclude_regions=motion_config['exclude_regions'],
+                                     block_threshold_end=motion_config['block_threshold_end'],
+                                     min_gap=motion_config['episode_min_gap'],
+                                     activity_callback=activity_event_handler,
+                                     activity_interval=motion_config['activity_interval']) as motion_detector:
 
         log.info('Starting camera video capture.')
         camera.resolution = resolution
@@ -128,11 +190,33 @@ def main():
                                format='h264', 
                                inline_headers=True,
                                bitrate=bitrate)
-        
+
+        if mjpeg_fps:
+            log.info('Starting MJPEG feed at %s, %i fps.', mjpeg_resolution, mjpeg_fps)
+            camera.start_recording(MjpegZeroMqOutput(mjpegsocket, mjpeg_fps),
+                                   format='mjpeg',
+                                   splitter_port=mjpeg_splitter_port,
+                                   resize=mjpeg_resolution,
+                                   quality=mjpeg_quality)
+
+        still_cache = StillCache(camera, context, still_splitter_ports, still_max_age)
+        still_server = StillServer(jpegsocket, still_cache, net_frame_size, still_chunk_size)
+
+        bitrate_controller = None
+        if adaptive_bitrate:
+            bitrate_controller = BitrateController(PiCameraEncoder(camera), video_output, bitrate,
+                                                   camera_config['min_bitrate'], bitrate,
+                                                   camera_config['bitrate_interval'],
+                                                   event_callback=functools.partial(bitrate_event_handler, eventsocket))
         try:
             log.info('Entering JPEG still event loop.')
-            stills_event_loop(jpegsocket, camera, net_frame_size, hostname, annotation, annotation_strftime)
+            stills_event_loop(jpegsocket, still_server, camera, hostname, annotation, annotation_strftime,
+                              bitrate_controller)
         finally:
+            metrics_exporter.stop()
+            still_cache.close()
+            if mjpeg_fps:
+                camera.stop_recording(splitter_port=mjpeg_splitter_port)
             camera.stop_recording()
 
 
@@ -147,7 +231,11 @@ if __name__ == '__main__':
     ch.setFormatter(formatter)
     root.addHandler(ch)
 
+    parser = argparse.ArgumentParser(description='Camera feed server.')
+    parser.add_argument('--config-dir', help='folder holding the configuration files')
+    args = parser.parse_args()
+
     # Start main execution
-    main()
+    main(args.config_dir)
 
 
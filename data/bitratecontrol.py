@@ -0,0 +1,111 @@
+#!/usr/bin/env python
+
+import logging
+
+log = logging.getLogger(__name__)
+
+
+class PiCameraEncoder(object):
+    """Changes the bitrate of a running picamera H.264 recording.
+
+    picamera has no public call for this, so the bitrate parameter is
+    set on the MMAL encoder's output port, found through picamera's
+    internals.  If a picamera version lays these out differently
+    set_bitrate() returns False and the bitrate is left alone.  A key
+    frame is requested straight after a change, so the new bitrate
+    starts with a new GOP.  Anything with set_bitrate(bitrate) can stand
+    in for this, for example to drive the controller without a camera.
+    """
+
+    def __init__(self, camera, splitter_port=1):
+        self.camera = camera
+        self.splitter_port = splitter_port
+        self.supported = True
+
+    def set_bitrate(self, bitrate):
+        if not self.supported:
+            return False
+        try:
+            from picamera import mmal
+            port = self.camera._encoders[self.splitter_port].output_port
+        except (ImportError, AttributeError, KeyError) as e:
+            log.warning('Unable to change the bitrate with this picamera, leaving it as it is: %s', e)
+            self.supported = False
+            return False
+        port = getattr(port, '_port', port)
+        mmal.mmal_port_parameter_set_uint32(port, mmal.MMAL_PARAMETER_VIDEO_BIT_RATE, bitrate)
+        self.camera.request_key_frame(splitter_port=self.splitter_port)
+        return True
+
+
+class BitrateController(object):
+    """Adapts the encoder bitrate to what the video subscribers can take.
+
+    The video output's sent_bytes and dropped_messages counters count
+    the bytes it sends and the messages it has to drop because a
+    subscriber is at its high water mark.  Every
+    interval seconds update() cuts the bitrate by the decrease factor if
+    anything was dropped, or raises it by the increase factor after
+    stable_intervals intervals without a drop, within min_bitrate and
+    max_bitrate.  Each change is passed to
+    event_callback(bitrate, previous, send_rate).
+
+    update() is called from the camera's main loop rather than the
+    encoder's thread.
+    """
+
+    def __init__(self, encoder, output, bitrate, min_bitrate, max_bitrate, interval=5.0,
+                 decrease=0.7, increase=1.1, stable_intervals=6, event_callback=None):
+        self.encoder = encoder
+        self.output = output
+        self.bitrate = bitrate
+        self.min_bitrate = min_bitrate
+        self.max_bitrate = max_bitrate
+        self.interval = interval
+        self.decrease = decrease
+        self.increase = increase
+        self.stable_intervals = stable_intervals
+        self.event_callback = event_callback
+        self.stable = 0
+        self.last_check = None
+        self.last_sent = 0
+        self.last_dropped = 0
+
+    def update(self, now):
+        if self.last_check is None:
+            self.last_check = now
+            self.last_sent = self.output.sent_bytes.value
+            self.last_dropped = self.output.dropped_messages.value
+            return
+        if now < self.last_check + self.interval:
+            return
+
+        sent = self.output.sent_bytes.value - self.last_sent
+        dropped = self.output.dropped_messages.value - self.last_dropped
+        send_rate = int(sent * 8 / (now - self.last_check))
+        self.last_check = now
+        self.last_sent += sent
+        self.last_dropped += dropped
+
+        bitrate = self.bitrate
+        if dropped:
+            self.stable = 0
+            bitrate = max(self.min_bitrate, int(round(self.bitrate * self.decrease)))
+            log.info('%i video messages dropped at %i bit/s sent.', dropped, send_rate)
+        else:
+            self.stable += 1
+            if self.stable >= self.stable_intervals:
+                self.stable = 0
+                bitrate = min(self.max_bitrate, int(round(self.bitrate * self.increase)))
+
+        if bitrate != self.bitrate:
+            self.set_bitrate(bitrate, send_rate)
+
+    def set_bitrate(self, bitrate, send_rate):
+        if self.encoder.set_bitrate(bitrate) is False:
+            return
+        log.info('Changed video bitrate from %i to %i.', self.bitrate, bitrate)
+        previous = self.bitrate
+        self.bitrate = bitrate
+        if self.event_callback is not None:
+            self.event_callback(bitrate, previous, send_rate)
@@ -0,0 +1,116 @@
+#!/usr/bin/env python
+
+import struct
+
+MOTION = 'MOTION'
+MOTION_START = 'MOTION_START'
+MOTION_END = 'MOTION_END'
+BITRATE = 'BITRATE'
+ACTIVITY = 'ACTIVITY'
+
+EPISODE_VERSION = 1
+
+# Version, start and end times, peak block count, frames with motion and
+# the bounding box of active blocks as first row, first column, last row
+# and last column.
+EPISODE = struct.Struct('!BddHIBBBB')
+
+# Time of the change, new and previous bitrate and the measured send rate.
+BITRATE_CHANGE = struct.Struct('!dIII')
+
+ACTIVITY_VERSION = 1
+
+# Rows and columns of the grid motion activity is summarised on.
+ACTIVITY_GRID = 8
+
+# Version, start time and length of the period, frames analysed, peak
+# block count and the activity of each grid cell, row by row.
+ACTIVITY_SUMMARY = struct.Struct('!BdfHH%iB' % (ACTIVITY_GRID * ACTIVITY_GRID))
+
+
+class MotionEpisode(object):
+    """Summary of a period of motion seen by a camera."""
+
+    def __init__(self, start, end=None, peak_blocks=0, frames=0, bbox=None):
+        self.start = start
+        self.end = start if end is None else end
+        self.peak_blocks = peak_blocks
+        self.frames = frames
+        self.bbox = bbox
+
+    @property
+    def duration(self):
+        return self.end - self.start
+
+    def include(self, bbox):
+        """Grows the bounding box to take in bbox."""
+        if self.bbox is None:
+            self.bbox = bbox
+        else:
+            self.bbox = (min(self.bbox[0], bbox[0]), min(self.bbox[1], bbox[1]),
+                         max(self.bbox[2], bbox[2]), max(self.bbox[3], bbox[3]))
+
+
+class ActivitySummary(object):
+    """Summary of the motion seen by a camera over a short period.
+
+    Each grid cell holds the fraction of its blocks over the threshold,
+    averaged over the frames of the period, scaled to 0-255.
+    """
+
+    def __init__(self, start, duration, frames, peak_blocks, grid):
+        self.start = start
+        self.duration = duration
+        self.frames = frames
+        self.peak_blocks = peak_blocks
+        self.grid = grid
+
+
+def encode_episode(episode):
+    """Packs an episode into the payload of a motion event."""
+    bbox = episode.bbox or (0, 0, 0, 0)
+    return EPISODE.pack(EPISODE_VERSION, episode.start, episode.end,
+                        min(episode.peak_blocks, 0xffff), episode.frames,
+                        *[min(value, 0xff) for value in bbox])
+
+
+def decode_episode(payload):
+    """Unpacks the payload of a motion event into a MotionEpisode."""
+    version, start, end, peak_blocks, frames, row0, col0, row1, col1 = EPISODE.unpack(payload)
+    return MotionEpisode(start, end, peak_blocks, frames, (row0, col0, row1, col1))
+
+
+def encode_bitrate(timestamp, bitrate, previous, send_rate):
+    """Packs a change of encoder bitrate into the payload of an event."""
+    return BITRATE_CHANGE.pack(timestamp, bitrate, previous, send_rate)
+
+
+def decode_bitrate(payload):
+    """Returns (timestamp, bitrate, previous, send_rate) from a bitrate event."""
+    return BITRATE_CHANGE.unpack(payload)
+
+
+def encode_activity(summary):
+    """Packs an activity summary into the payload of an event."""
+    return ACTIVITY_SUMMARY.pack(ACTIVITY_VERSION, summary.start, summary.duration, summary.frames,
+                                 min(summary.peak_blocks, 0xffff), *summary.grid)
+
+
+def decode_activity(payload):
+    """Unpacks the payload of an activity event into an ActivitySummary."""
+    fields = ACTIVITY_SUMMARY.unpack(payload)
+    return ActivitySummary(fields[1], fields[2], fields[3], fields[4], fields[5:])
+
+
+def event_time(event, payload):
+    """Returns the time carried in the payload of a structured event, or
+    None for events whose payload is an ISO format time."""
+    if event == MOTION_START:
+        return decode_episode(payload).start
+    if event == MOTION_END:
+        return decode_episode(payload).end
+    if event == BITRATE:
+        return decode_bitrate(payload)[0]
+    if event == ACTIVITY:
+        return decode_activity(payload).start
+    return None
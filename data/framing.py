@@ -0,0 +1,150 @@
+#!/usr/bin/env python
+
+import struct
+
+from h264 import NAL_IDR, NAL_SPS, nal_type_mask
+
+# Message flags carried in the framing header of NAL aligned video.
+FLAG_SPS = 0x01       # Message starts with a sequence parameter set.
+FLAG_IDR = 0x02       # Message holds (part of) an IDR picture.
+FLAG_REPLAY = 0x04    # Message is a repeat from the GOP cache.
+
+# Flags and NAL type mask of the original NAL framing,
+# [hostname, header, payload].
+HEADER = struct.Struct('!BI')
+
+# Video messages are [header, payload].  The header starts with the
+# magic and version byte, whose top bit can never begin a hostname so
+# the original framings can still be told apart.  Then come the flags,
+# the camera's stream id, the message's sequence number and its capture
+# time in microseconds after the capture time of the GOP's keyframe.
+VIDEO_MAGIC = 0x80
+VIDEO_VERSION = 1
+VIDEO_HEADER = struct.Struct('!BBHII')
+# Messages starting a GOP add the capture time of its keyframe and the
+# camera's hostname, so they need not be sent with every message.
+KEYFRAME_HEADER = struct.Struct('!d')
+
+
+def pack_video_header(flags, stream_id, sequence, offset, gop_time=None, host=None):
+    """Packs the header sent ahead of a NAL aligned payload."""
+    header = VIDEO_HEADER.pack(VIDEO_MAGIC | VIDEO_VERSION, flags, stream_id, sequence, offset)
+    if flags & FLAG_SPS:
+        header += KEYFRAME_HEADER.pack(gop_time) + host
+    return header
+
+
+def set_stream_id(header, stream_id):
+    """Returns a copy of a video header with its stream id replaced."""
+    return header[:2] + struct.pack('!H', stream_id) + header[4:]
+
+
+def mark_replay(header):
+    """Returns a copy of a video header with FLAG_REPLAY set."""
+    header = bytearray(header)
+    header[1] |= FLAG_REPLAY
+    return bytes(header)
+
+
+def flags_for_mask(nal_mask):
+    """Returns the keyframe flags for a payload holding the NAL types in nal_mask."""
+    flags = 0
+    if nal_mask & (1 << NAL_SPS):
+        flags |= FLAG_SPS
+    if nal_mask & (1 << NAL_IDR):
+        flags |= FLAG_IDR
+    return flags
+
+
+class VideoMessage(object):
+    """A video message split into its header fields and payload.
+
+    host is only known for messages starting a GOP, and gop_time with
+    it.  Messages in the original framings carry the host on every
+    message but no stream id, sequence number or capture time, which are
+    None, as are the flags of fixed size chunks.
+    """
+
+    def __init__(self, payload, host=None, flags=None, stream_id=None, sequence=None, offset=0,
+                 gop_time=None):
+        self.payload = payload
+        self.host = host
+        self.flags = flags
+        self.stream_id = stream_id
+        self.sequence = sequence
+        self.offset = offset
+        self.gop_time = gop_time
+
+
+def parse_video_message(parts):
+    """Splits a video message into a VideoMessage.  Raises ValueError
+    for a malformed message or a header version this does not
+    understand."""
+    if len(parts) == 3:
+        host, header, payload = parts
+        if len(header) != HEADER.size:
+            raise ValueError('Video header of %i bytes, expected %i.' % (len(header), HEADER.size))
+        flags, nal_mask = HEADER.unpack(header)
+        return VideoMessage(payload, host, flags)
+
+    header, payload = parts
+    if not header or not ord(header[:1]) & VIDEO_MAGIC:
+        # Fixed size chunk, sent with the hostname.
+        return VideoMessage(payload, header)
+    if len(header) < VIDEO_HEADER.size:
+        raise ValueError('Video header of %i bytes is too short.' % len(header))
+
+    version, flags, stream_id, sequence, offset = VIDEO_HEADER.unpack_from(header)
+    if version != VIDEO_MAGIC | VIDEO_VERSION:
+        raise ValueError('Unsupported video header version %i.' % (version & ~VIDEO_MAGIC))
+
+    message = VideoMessage(payload, None, flags, stream_id, sequence, offset)
+    if flags & FLAG_SPS:
+        if len(header) < VIDEO_HEADER.size + KEYFRAME_HEADER.size:
+            raise ValueError('Keyframe video header of %i bytes is too short.' % len(header))
+        message.gop_time, = KEYFRAME_HEADER.unpack_from(header, VIDEO_HEADER.size)
+        message.host = header[VIDEO_HEADER.size + KEYFRAME_HEADER.size:]
+    return message
+
+
+def is_gop_start(data, flags):
+    """True if a message payload starts a new GOP of the live stream.
+
+    Fixed size chunks carry no flags, so they are searched for an SPS.
+    """
+    if flags is None:
+        return bool(nal_type_mask(data) & (1 << NAL_SPS))
+    return bool(flags & FLAG_SPS) and not flags & FLAG_REPLAY
+
+
+class GopCache(object):
+    """Holds the messages published since the last SPS, so that a new
+    subscriber can be sent a complete group of pictures and start
+    decoding straight away.
+
+    If the GOP outgrows max_size the cache is emptied until the next SPS
+    rather than hold on to an incomplete GOP.
+    """
+
+    def __init__(self, max_size=2 * 1024 * 1024):
+        self.max_size = max_size
+        self.messages = []
+        self.size = 0
+
+    def add(self, flags, header, payload):
+        if flags & FLAG_SPS:
+            self.messages = []
+            self.size = 0
+        elif not self.messages:
+            return
+
+        self.size += len(payload)
+        if self.size > self.max_size:
+            self.messages = []
+            self.size = 0
+        else:
+            self.messages.append((header, payload))
+
+    def replay(self):
+        """Returns the cached (header, payload) pairs marked as replayed."""
+        return [(mark_replay(header), payload) for header, payload in self.messages]
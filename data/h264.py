@@ -0,0 +1,133 @@
+#!/usr/bin/env python
+
+START_CODE = b'\x00\x00\x01'
+
+# NAL unit types used by the Pi's encoder.
+NAL_SLICE = 1
+NAL_IDR = 5
+NAL_SEI = 6
+NAL_SPS = 7
+NAL_PPS = 8
+NAL_AUD = 9
+
+
+def nal_header_offset(unit):
+    """Returns the offset of the header byte of a NAL unit which begins
+    with a three or four byte start code."""
+    return 4 if unit[2:3] == b'\x00' else 3
+
+
+def nal_type(unit):
+    """Returns the type of a NAL unit which begins with its start code,
+    or 0, unspecified, if there is nothing after the start code."""
+    offset = nal_header_offset(unit)
+    header = unit[offset:offset + 1]
+    return ord(header) & 0x1f if header else 0
+
+
+def nal_type_mask(data):
+    """Returns a bitmask with bit n set for every NAL unit of type n
+    found in the Annex-B data."""
+    mask = 0
+    find = data.find
+    pos = find(START_CODE)
+    while pos >= 0:
+        header = data[pos + 3:pos + 4]
+        if header:
+            mask |= 1 << (ord(header) & 0x1f)
+        pos = find(START_CODE, pos + 3)
+    return mask
+
+
+class NalSplitter(object):
+    """Incrementally splits an Annex-B byte stream into NAL units.
+
+    feed() returns the units completed by the new data, each with its
+    leading start code.  The last unit seen is held back until the next
+    start code arrives or flush() is called, as until then it may still
+    be growing.  Any bytes before the first start code are discarded,
+    apart from the last few, which may be the start of a start code
+    split across two feeds.
+    """
+
+    def __init__(self):
+        self.pending = b''
+        self.leading = b''
+
+    def feed(self, data):
+        units = []
+        if self.pending:
+            data = self.pending + data
+            begin = 0
+            pos = data.find(START_CODE, max(4, len(self.pending) - 2))
+        else:
+            data = self.leading + data
+            pos = data.find(START_CODE)
+            if pos < 0:
+                self.leading = data[-len(START_CODE):]
+                return units
+            self.leading = b''
+            begin = pos - 1 if pos and data[pos - 1:pos] == b'\x00' else pos
+            pos = data.find(START_CODE, pos + 3)
+
+        while pos >= 0:
+            # A zero byte before the start code belongs to the next unit.
+            start = pos - 1 if data[pos - 1:pos] == b'\x00' and pos - 1 > begin else pos
+            units.append(data[begin:start])
+            begin = start
+            pos = data.find(START_CODE, pos + 3)
+
+        self.pending = data[begin:]
+        return units
+
+    def flush(self):
+        """Returns the held back unit, treating it as complete."""
+        units = [self.pending] if self.pending else []
+        self.pending = b''
+        self.leading = b''
+        return units
+
+
+def is_picture_start(unit):
+    """Returns True if unit is a slice which starts a new picture, that
+    is one whose first_mb_in_slice is zero."""
+    offset = nal_header_offset(unit)
+    header = unit[offset:offset + 2]
+    return len(header) == 2 and (ord(header[0:1]) & 0x1f) in (NAL_SLICE, NAL_IDR) and \
+        bool(ord(header[1:2]) & 0x80)
+
+
+class AccessUnitSplitter(object):
+    """Groups complete NAL units into access units, one coded picture
+    and the parameter sets and SEI preceding it.
+
+    feed() returns the access unit completed by the new unit as a list
+    of units, or None if the current access unit is still open.
+    """
+
+    def __init__(self):
+        self.units = []
+        self.has_picture = False
+
+    def feed(self, unit):
+        unit_type = nal_type(unit)
+        completed = None
+        if self.has_picture and (NAL_SEI <= unit_type <= NAL_AUD or is_picture_start(unit)):
+            completed = self.flush()
+
+        self.units.append(unit)
+        if unit_type in (NAL_SLICE, NAL_IDR):
+            self.has_picture = True
+        return completed
+
+    def flush(self):
+        """Returns the open access unit, which may be empty."""
+        units = self.units
+        self.units = []
+        self.has_picture = False
+        return units
+
+
+def is_keyframe(units):
+    """Returns True if the access unit holds an IDR picture."""
+    return any(nal_type(unit) == NAL_IDR for unit in units)
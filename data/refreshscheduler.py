@@ -0,0 +1,77 @@
+#!/usr/bin/env python
+
+import heapq
+
+
+class RefreshScheduler(object):
+    """Decides when to next fetch a still from each camera.
+
+    Each camera has one due time, kept in a heap.  Once a camera's still
+    arrives its next fetch is due idle_delay after the last request, or
+    motion_delay while the camera is reporting motion.  Motion lasts
+    from a motion start event until motion_hold seconds after it ends,
+    or motion_hold seconds after a single motion event from an older
+    camera, and brings the next fetch forward straight away.  A fetch
+    which has not completed after timeout seconds is made again.
+
+    Rescheduled cameras are pushed again rather than moved, and entries
+    which no longer match the camera's due time are skipped.
+    """
+
+    def __init__(self, names, idle_delay, motion_delay, motion_hold, timeout, now=0):
+        self.idle_delay = idle_delay
+        self.motion_delay = motion_delay
+        self.motion_hold = motion_hold
+        self.timeout = timeout
+        self.due = dict.fromkeys(names, now)
+        self.heap = [(now, name) for name in names]
+        heapq.heapify(self.heap)
+        self.requested = {}
+        self.motion_until = dict.fromkeys(names, 0)
+
+    def schedule(self, name, due):
+        self.due[name] = due
+        heapq.heappush(self.heap, (due, name))
+
+    def delay(self, name, now):
+        return self.motion_delay if now < self.motion_until[name] else self.idle_delay
+
+    def pop_due(self, now):
+        """Returns the cameras to fetch a still from now."""
+        names = []
+        while self.heap and self.heap[0][0] <= now:
+            due, name = heapq.heappop(self.heap)
+            if due != self.due[name]:
+                continue
+            self.requested[name] = now
+            self.schedule(name, now + self.timeout)
+            names.append(name)
+        return names
+
+    def next_timeout(self, now):
+        """Returns the milliseconds until the next fetch is due."""
+        while self.heap and self.heap[0][0] != self.due[self.heap[0][1]]:
+            heapq.heappop(self.heap)
+        if not self.heap:
+            return None
+        return max(self.heap[0][0] - now, 0) * 1000
+
+    def completed(self, name, now):
+        """Schedules the next fetch once a still has arrived."""
+        requested = self.requested.pop(name, now)
+        self.schedule(name, max(requested + self.delay(name, now), now))
+
+    def hurry(self, name, now):
+        if name not in self.requested and self.due[name] > now:
+            self.schedule(name, now)
+
+    def motion_start(self, name, now):
+        self.motion_until[name] = float('inf')
+        self.hurry(name, now)
+
+    def motion_end(self, name, now):
+        self.motion_until[name] = now + self.motion_hold
+
+    def motion(self, name, now):
+        self.motion_until[name] = now + self.motion_hold
+        self.hurry(name, now)
@@ -0,0 +1,255 @@
+#!/usr/bin/env python
+
+import time
+import struct
+import logging
+import collections
+
+from framing import GopCache, parse_video_message, set_stream_id, FLAG_SPS, FLAG_REPLAY
+from metrics.registry import counter, gauge
+
+log = logging.getLogger(__name__)
+
+
+class Consumer(object):
+    """A downstream consumer of a relay, known by its ROUTER identity."""
+
+    def __init__(self, identity, name, window, now):
+        self.identity = identity
+        self.name = name
+        self.window = window
+        self.last_seen = now
+        self.sent = 0
+        self.acked = 0
+        # Send times of the messages not yet acknowledged, oldest first.
+        self.in_flight = collections.deque()
+        # Streams being skipped to their next keyframe.
+        self.skipping = set()
+        self.lag_messages = gauge('relay_consumer_lag_messages', consumer=name)
+        self.lag_seconds = gauge('relay_consumer_lag_seconds', consumer=name)
+        self.dropped = counter('relay_consumer_dropped_messages_total', consumer=name)
+
+    @property
+    def lag(self):
+        return self.sent - self.acked
+
+    def ack(self, count, now):
+        count = min(count, self.sent)
+        while self.in_flight and self.acked < count:
+            self.in_flight.popleft()
+            self.acked += 1
+        self.acked = count
+        self.last_seen = now
+        self.update_lag(now)
+
+    def update_lag(self, now):
+        self.lag_messages.set(self.lag)
+        self.lag_seconds.set(now - self.in_flight[0] if self.in_flight else 0.0)
+
+
+class RelayStream(object):
+    """One camera's video stream as the relay passes it on."""
+
+    def __init__(self, relay_id, upstream_id, cachesize):
+        self.relay_id = relay_id
+        self.upstream_id = upstream_id
+        self.cache = GopCache(cachesize)
+
+
+class Relay(object):
+    """Passes camera video on to any number of consumers, each camera's
+    stream being received once.
+
+    Video messages from each camera are given a stream id unique within
+    the relay, kept in a GOP cache for the camera, and sent to every
+    consumer on the ROUTER socket as [header, payload].  Consumers use
+    RelaySubscriber: 'HELLO <name> <window>' registers a consumer, which
+    is sent the cached GOP of every camera straight away, and
+    'ACK <count>' gives the number of messages it has received so far.
+    At most window messages are sent ahead of the last acknowledgement;
+    beyond that a consumer misses the rest of each GOP, and picks up
+    again at the next keyframe.  Consumers which are not heard from for
+    timeout seconds are forgotten, and are told to say HELLO again with
+    'RESET' if they come back.
+
+    The lag of each consumer, in messages and in seconds since the
+    oldest message it has not acknowledged, is kept in metrics labelled
+    with its name.
+
+    Only the 'nal' video framing carries the stream ids and sequence
+    numbers the relay needs.  Video in the older framings is counted
+    and dropped, with a warning the first time for each camera.
+    """
+
+    def __init__(self, socket, cachesize=2 * 1024 * 1024, timeout=10):
+        self.socket = socket
+        self.cachesize = cachesize
+        self.timeout = timeout
+        self.consumers = {}
+        self.streams = {}
+        self.next_stream_id = 0
+        self.received = counter('relay_received_messages_total')
+        self.unframed = counter('relay_unframed_messages_total')
+        self.unframed_hosts = set()
+
+    def publish(self, source, parts, now=None):
+        """Relays a video message received from the camera socket source."""
+        now = time.time() if now is None else now
+        try:
+            message = parse_video_message(parts)
+        except (ValueError, struct.error) as e:
+            log.warning('Ignoring video message: %s', e)
+            return
+        if message.stream_id is None:
+            # Only versioned headers carry what the relay needs.
+            if message.host not in self.unframed_hosts:
+                log.warning('Dropping video from %s, which does not use the nal video framing.', message.host)
+                self.unframed_hosts.add(message.host)
+            self.unframed.inc()
+            return
+
+        self.received.inc()
+        stream = self.stream(source, message.stream_id)
+        header = set_stream_id(parts[0], stream.relay_id)
+        payload = parts[1]
+        stream.cache.add(message.flags, header, payload)
+        for consumer in self.consumers.values():
+            self.send(consumer, stream.relay_id, message.flags, header, payload, now)
+
+    def stream(self, source, upstream_id):
+        stream = self.streams.get(source)
+        if stream is None or stream.upstream_id != upstream_id:
+            stream = RelayStream(self.next_stream_id, upstream_id, self.cachesize)
+            self.next_stream_id = (self.next_stream_id + 1) & 0xffff
+            self.streams[source] = stream
+        return stream
+
+    def send(self, consumer, stream_id, flags, header, payload, now):
+        if stream_id in consumer.skipping:
+            if not flags & FLAG_SPS or flags & FLAG_REPLAY:
+                consumer.dropped.inc()
+                return
+            consumer.skipping.discard(stream_id)
+
+        if consumer.lag >= consumer.window:
+            if not consumer.skipping:
+                log.warning('Consumer %s is %i messages behind, skipping to the next keyframe.',
+                            consumer.name, consumer.lag)
+            consumer.skipping.add(stream_id)
+            consumer.dropped.inc()
+            return
+
+        self.socket.send_multipart([consumer.identity, header, payload], copy=False)
+        consumer.sent += 1
+        consumer.in_flight.append(now)
+
+    def handle(self, parts, now=None):
+        """Handles a message from a consumer on the ROUTER socket.
+        Malformed messages are logged and ignored."""
+        now = time.time() if now is None else now
+        if len(parts) != 2:
+            log.warning('Ignoring malformed consumer message of %i parts.', len(parts))
+            return
+        identity, request = parts
+        try:
+            self.handle_request(identity, request.split(' '), now)
+        except (IndexError, ValueError) as e:
+            log.warning('Ignoring malformed consumer message from %r: %s', identity, e)
+
+    def handle_request(self, identity, req, now):
+        consumer = self.consumers.get(identity)
+
+        if req[0] == 'HELLO':
+            log.info('Relaying video to %s.', req[1])
+            consumer = Consumer(identity, req[1], int(req[2]), now)
+            self.consumers[identity] = consumer
+            for stream in self.streams.values():
+                for header, payload in stream.cache.replay():
+                    self.send(consumer, stream.relay_id, ord(header[1:2]), header, payload, now)
+
+        elif req[0] == 'ACK':
+            if consumer is None:
+                self.socket.send_multipart([identity, b'RESET'])
+            else:
+                consumer.ack(int(req[1]), now)
+
+        elif req[0] == 'BYE' and consumer is not None:
+            log.info('%s has stopped receiving video.', consumer.name)
+            self.remove(consumer, now)
+
+    def expire(self, now):
+        """Forgets consumers which have gone quiet."""
+        for consumer in list(self.consumers.values()):
+            if now > consumer.last_seen + self.timeout:
+                log.warning('Nothing heard from %s for %is, no longer relaying to it.',
+                            consumer.name, self.timeout)
+                self.remove(consumer, now)
+            else:
+                consumer.update_lag(now)
+
+    def remove(self, consumer, now):
+        del self.consumers[consumer.identity]
+        consumer.in_flight.clear()
+        consumer.sent = consumer.acked
+        consumer.update_lag(now)
+
+
+class RelaySubscriber(object):
+    """Receives camera video from a Relay over a DEALER socket.
+
+    Each message received on the socket is passed to handle(), which
+    returns the [header, payload] of a video message or None.  Receipt
+    is acknowledged every window / 4 messages, and tick() should be
+    called at least every heartbeat seconds to acknowledge the rest and
+    to say HELLO again if the relay has gone quiet for timeout seconds.
+    """
+
+    def __init__(self, socket, name, window=256, heartbeat=2.0, timeout=10):
+        self.socket = socket
+        self.name = name
+        self.window = window
+        self.heartbeat = heartbeat
+        self.timeout = timeout
+        self.received = 0
+        self.acked = 0
+        self.last_ack = 0
+        self.last_received = 0
+        self.hello()
+
+    def hello(self, now=None):
+        now = time.time() if now is None else now
+        self.received = 0
+        self.acked = 0
+        self.last_ack = now
+        self.last_received = now
+        self.socket.send('HELLO %s %i' % (self.name, self.window))
+
+    def ack(self, now):
+        self.socket.send('ACK %i' % self.received)
+        self.acked = self.received
+        self.last_ack = now
+
+    def handle(self, parts, now=None):
+        now = time.time() if now is None else now
+        self.last_received = now
+        if len(parts) == 1:
+            if parts[0] == b'RESET':
+                log.info('Relay has forgotten %s, saying hello again.', self.name)
+                self.hello(now)
+            return None
+
+        self.received += 1
+        if self.received - self.acked >= max(self.window // 4, 1):
+            self.ack(now)
+        return parts
+
+    def tick(self, now=None):
+        now = time.time() if now is None else now
+        if now > self.last_received + self.timeout:
+            log.warning('Nothing from the relay for %is, saying hello again.', self.timeout)
+            self.hello(now)
+        elif now >= self.last_ack + self.heartbeat:
+            self.ack(now)
+
+    def close(self):
+        self.socket.send('BYE')
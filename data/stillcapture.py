@@ -0,0 +1,172 @@
+#!/usr/bin/env python
+
+import io
+import time
+import zmq
+import logging
+import threading
+import collections
+
+from metrics.registry import histogram
+
+log = logging.getLogger(__name__)
+
+NOTIFY_ADDRESS = 'inproc://stillcapture'
+
+
+class StillCapture(threading.Thread):
+    """Captures JPEG stills at one resolution on demand.
+
+    The JPEG encoder is kept open on its own splitter port between
+    captures by capture_continuous(), so each still costs one encoded
+    frame rather than a fresh encoder setup.  A capture is taken each
+    time request() is called, and a message is pushed to the still
+    cache's notification socket when it completes.
+    """
+
+    def __init__(self, camera, context, resize, splitter_port):
+        super(StillCapture, self).__init__()
+        self.daemon = True
+        self.camera = camera
+        self.context = context
+        self.resize = resize
+        self.splitter_port = splitter_port
+        self.wanted = threading.Event()
+        self.stopping = False
+        self.latest = (0, 0, None)    # Capture count, time and JPEG data
+        self.capture_time = histogram('still_capture_seconds',
+                                      size='%ix%i' % resize if resize else 'full')
+
+    def request(self):
+        self.wanted.set()
+
+    def stop(self):
+        self.stopping = True
+        self.wanted.set()
+        self.join()
+
+    def wait_for_request(self):
+        while not self.wanted.wait(0.5):
+            pass
+        self.wanted.clear()
+        return not self.stopping
+
+    def run(self):
+        notify = self.context.socket(zmq.PUSH)
+        notify.connect(NOTIFY_ADDRESS)
+        stream = io.BytesIO()
+        log.info('Starting still capture at %s on splitter port %i.', self.resize or 'full size', self.splitter_port)
+        try:
+            if not self.wait_for_request():
+                return
+            requested = time.time()
+            for _ in self.camera.capture_continuous(stream, format='jpeg', use_video_port=True,
+                                                    resize=self.resize, splitter_port=self.splitter_port):
+                self.latest = (self.latest[0] + 1, time.time(), stream.getvalue())
+                self.capture_time.observe(self.latest[1] - requested)
+                notify.send(b'')
+                stream.seek(0)
+                stream.truncate()
+                if not self.wait_for_request():
+                    break
+                requested = time.time()
+        except Exception:
+            log.exception('Still capture at %s failed.', self.resize or 'full size')
+            self.latest = (self.latest[0] + 1, time.time(), None)
+            notify.send(b'')
+        finally:
+            notify.close()
+            log.info('Stopped still capture on splitter port %i.', self.splitter_port)
+
+
+class StillCache(object):
+    """Shares JPEG stills between everyone asking for the same resolution.
+
+    get() returns the last still at the requested size if it is newer
+    than max_age, otherwise it asks for a capture and the requester is
+    put on a waiting list.  Captures run on StillCapture threads, one
+    per resolution and splitter port; when the ports run out the least
+    recently used resolution gives up its port.  The notify socket is
+    readable when captures complete, after which completed() returns
+    the waiting requesters with their stills.
+    """
+
+    def __init__(self, camera, context, splitter_ports, max_age=1.0):
+        self.camera = camera
+        self.context = context
+        self.max_age = max_age
+        self.notify = context.socket(zmq.PULL)
+        self.notify.bind(NOTIFY_ADDRESS)
+        self.free_ports = list(splitter_ports)
+        self.captures = collections.OrderedDict()
+        self.waiting = {}
+        self.deferred = []
+
+    def get(self, resize, requester, now=None):
+        now = time.time() if now is None else now
+        resize = tuple(resize) if resize else None
+
+        capture = self.captures.pop(resize, None)
+        if capture is not None and not capture.is_alive():
+            self.free_ports.append(capture.splitter_port)
+            capture = None
+        if capture is None:
+            capture = self.start_capture(resize)
+            if capture is None:
+                log.warning('No splitter port free for a still at %s, deferring.', resize)
+                self.deferred.append((resize, requester))
+                return None
+        self.captures[resize] = capture
+
+        count, captured_at, jpeg = capture.latest
+        if jpeg is not None and now - captured_at <= self.max_age:
+            return jpeg
+
+        if resize not in self.waiting:
+            self.waiting[resize] = (count, [])
+            capture.request()
+        self.waiting[resize][1].append(requester)
+        return None
+
+    def start_capture(self, resize):
+        if not self.free_ports:
+            idle = [key for key in self.captures if key not in self.waiting]
+            if not idle:
+                return None
+            evicted = self.captures.pop(idle[0])
+            evicted.stop()
+            self.free_ports.append(evicted.splitter_port)
+
+        capture = StillCapture(self.camera, self.context, resize, self.free_ports.pop(0))
+        capture.start()
+        return capture
+
+    def completed(self):
+        """Returns (requester, jpeg) for every request answered by the
+        captures which have completed.  jpeg is None if a capture failed."""
+        while True:
+            try:
+                self.notify.recv(zmq.NOBLOCK)
+            except zmq.Again:
+                break
+
+        results = []
+        for resize, (requested_count, requesters) in list(self.waiting.items()):
+            count, captured_at, jpeg = self.captures[resize].latest
+            if count > requested_count:
+                del self.waiting[resize]
+                results += [(requester, jpeg) for requester in requesters]
+
+        deferred = self.deferred
+        self.deferred = []
+        for resize, requester in deferred:
+            jpeg = self.get(resize, requester)
+            if jpeg is not None:
+                results.append((requester, jpeg))
+        return results
+
+    def close(self):
+        for capture in self.captures.values():
+            capture.stop()
+        self.captures.clear()
+        self.notify.close()
@@ -0,0 +1,209 @@
+#!/usr/bin/env python
+
+import time
+import struct
+import logging
+
+from metrics.registry import counter, histogram
+
+log = logging.getLogger(__name__)
+
+# Transfer id, total size of the still and offset of the chunk.
+CHUNK_HEADER = struct.Struct('!III')
+
+
+class Transfer(object):
+    """A still being sent to one client.  transfer_id is None for
+    clients using the original request per chunk protocol."""
+
+    def __init__(self, transfer_id=None, credit=0):
+        self.transfer_id = transfer_id
+        self.credit = credit
+        self.view = None
+        self.offset = 0
+
+
+class StillServer(object):
+    """Answers requests for JPEG stills on the camera's ROUTER socket.
+
+    REQ clients use the original protocol: 'NEW [w h]' starts a still
+    and each request, 'NEXT' after the first, is answered with the next
+    net_frame_size chunk until an empty chunk marks the end, which the
+    client acknowledges with 'ENDACK'.
+
+    DEALER clients send 'FETCH <id> <credit> [w h]' and are then sent
+    [header, chunk] messages of up to chunk_size bytes, at most credit
+    chunks ahead of the client.  The header holds the transfer id, the
+    size of the still and the chunk's offset.  'CREDIT <id> <n>' lets n
+    more chunks be sent.  A new FETCH replaces any transfer in progress.
+
+    Chunks are sent as views of the cached still, without copying.
+    """
+
+    def __init__(self, socket, still_cache, net_frame_size, chunk_size=16384):
+        self.socket = socket
+        self.still_cache = still_cache
+        self.net_frame_size = net_frame_size
+        self.chunk_size = chunk_size
+        self.transfers = {}
+        self.legacy_requests = counter('still_requests_total', protocol='legacy')
+        self.credit_requests = counter('still_requests_total', protocol='credit')
+        self.sent_bytes = counter('still_sent_bytes_total')
+
+    def handle(self, parts):
+        """Handles a message received on the ROUTER socket."""
+        if len(parts) == 3 and not parts[1]:
+            address, empty, req = parts
+            self.handle_legacy(address, req.split(' '))
+        elif len(parts) == 2:
+            address, req = parts
+            self.handle_credit(address, req.split(' '))
+        else:
+            log.warning('Ignoring malformed still request of %i parts.', len(parts))
+
+    def handle_legacy(self, address, req):
+        if req[0] == 'NEW':
+            log.info('Request for JPEG still received from %s.', address)
+            self.legacy_requests.inc()
+            self.transfers[address] = Transfer()
+            self.request(address, req[1:])
+
+        elif req[0] == 'NEXT':
+            # Check for still in progress and send next frame.
+            log.debug('Next frame requested by %s.', address)
+            transfer = self.transfers.get(address)
+            if transfer is not None and transfer.view is not None:
+                self.send_legacy(address, transfer)
+
+        elif req[0] == 'ENDACK':
+            # Transfer is complete and file acknowledged.
+            log.info('JPEG still transfer to %s acknowledged complete.', address)
+            self.transfers.pop(address, None)
+            self.socket.send_multipart([address, b'', b''])
+
+    def handle_credit(self, address, req):
+        if req[0] == 'FETCH':
+            log.info('Pipelined request for JPEG still received from %s.', address)
+            self.credit_requests.inc()
+            self.transfers[address] = Transfer(int(req[1]), int(req[2]))
+            self.request(address, req[3:])
+
+        elif req[0] == 'CREDIT':
+            transfer = self.transfers.get(address)
+            if transfer is not None and transfer.transfer_id == int(req[1]):
+                transfer.credit += int(req[2])
+                self.send_credit(address, transfer)
+
+    def request(self, address, dims):
+        resize = None
+        if dims:
+            try:
+                resize = tuple(int(dim) for dim in dims)
+            except ValueError:
+                resize = ()
+            if len(resize) != 2 or min(resize) <= 0:
+                # Answered with an empty still, so the client is not left waiting.
+                log.warning('Ignoring still request from %r for size %s.', address, ' '.join(dims))
+                self.start(address, None)
+                return
+
+        jpeg = self.still_cache.get(resize, address)
+        if jpeg is not None:
+            self.start(address, jpeg)
+
+    def completed(self):
+        """Starts the transfers waiting on stills which have been captured."""
+        for address, jpeg in self.still_cache.completed():
+            self.start(address, jpeg)
+
+    def start(self, address, jpeg):
+        transfer = self.transfers.get(address)
+        if transfer is None or transfer.view is not None:
+            return
+        if jpeg is None:
+            log.warning('No JPEG still available for %s.', address)
+        transfer.view = memoryview(jpeg or b'')
+
+        if transfer.transfer_id is None:
+            self.send_legacy(address, transfer)
+        else:
+            self.send_credit(address, transfer)
+
+    def send_legacy(self, address, transfer):
+        chunk = transfer.view[transfer.offset:transfer.offset + self.net_frame_size]
+        transfer.offset += len(chunk)
+        self.sent_bytes.inc(len(chunk))
+        self.socket.send_multipart([address, b'', chunk], copy=False)
+
+    def send_credit(self, address, transfer):
+        if transfer.view is None:
+            return
+
+        total = len(transfer.view)
+        while transfer.credit > 0:
+            chunk = transfer.view[transfer.offset:transfer.offset + self.chunk_size]
+            header = CHUNK_HEADER.pack(transfer.transfer_id, total, transfer.offset)
+            self.socket.send_multipart([address, header, chunk], copy=False)
+            self.sent_bytes.inc(len(chunk))
+            transfer.offset += len(chunk)
+            transfer.credit -= 1
+            if transfer.offset >= total:
+                log.debug('JPEG still transfer %i to %s complete.', transfer.transfer_id, address)
+                del self.transfers[address]
+                break
+
+
+class StillClient(object):
+    """Fetches stills from a camera over a DEALER socket using the
+    pipelined protocol of StillServer.
+
+    fetch() starts a transfer, and each message received on the socket
+    is passed to handle(), which returns the still once it is complete.
+    A credit is returned for every chunk received, so credit chunks
+    are kept in flight.  The time from fetch() to the complete still is
+    recorded against the camera name.
+    """
+
+    def __init__(self, socket, credit=4, name=''):
+        self.socket = socket
+        self.credit = credit
+        self.round_trip = histogram('still_round_trip_seconds', camera=name)
+        self.fetched_at = None
+        self.transfer_id = 0
+        self.buffer = None
+        self.received = 0
+        self.in_progress = False
+
+    def fetch(self, resize=None):
+        self.transfer_id = (self.transfer_id + 1) & 0xffffffff
+        self.buffer = None
+        self.received = 0
+        self.in_progress = True
+        self.fetched_at = time.time()
+        dims = '' if resize is None else ' %i %i' % tuple(resize)
+        self.socket.send('FETCH %i %i%s' % (self.transfer_id, self.credit, dims))
+
+    def handle(self, parts):
+        """Raises ValueError for a message which is not a chunk."""
+        header, chunk = parts
+        if len(header) != CHUNK_HEADER.size:
+            raise ValueError('Still chunk header of %i bytes, expected %i.' % (len(header), CHUNK_HEADER.size))
+        transfer_id, total, offset = CHUNK_HEADER.unpack(header)
+        if not self.in_progress or transfer_id != self.transfer_id:
+            # Left over from a transfer which has been replaced.
+            return None
+
+        if self.buffer is None:
+            self.buffer = bytearray(total)
+        self.buffer[offset:offset + len(chunk)] = chunk
+        self.received += len(chunk)
+
+        if self.received >= total:
+            self.in_progress = False
+            self.round_trip.observe(time.time() - self.fetched_at)
+            jpeg = self.buffer
+            self.buffer = None
+            return jpeg
+
+        self.socket.send('CREDIT %i 1' % transfer_id)
+        return None
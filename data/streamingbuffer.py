@@ -1,52 +1,102 @@
 #!/usr/bin/env python
 
-from cStringIO import StringIO
 
 class StreamingBuffer(object):
-    def __init__(self):
-        self.buf = StringIO()
+    """Ring buffer of bytes backed by a single bytearray.
+
+    Writes copy the incoming data into the ring once.  Readers may
+    either take a copy with read(), fill a buffer of their own with
+    readinto(), or look at the pending bytes in place with peek() and
+    then discard them with skip().  The ring only grows (doubling) when
+    a write would overflow it, and only the live bytes are moved.
+    """
+
+    def __init__(self, size=4096):
+        self.size = max(int(size), 16)
+        self.buf = bytearray(self.size)
+        self.view = memoryview(self.buf)
         self.available = 0    # Bytes available for reading
-        self.size = 0
+        self.read_fp = 0
         self.write_fp = 0
 
-    def read(self, size = None):
-        """Reads size bytes from buffer"""
+    def __len__(self):
+        return self.available
+
+    def peek(self, size=None):
+        """Returns up to size pending bytes as a list of one or two
+        memoryviews into the ring, without consuming them.  The views
+        are only valid until the next write."""
         if size is None or size > self.available:
             size = self.available
         size = max(size, 0)
 
-        result = self.buf.read(size)
+        first = min(size, self.size - self.read_fp)
+        views = [self.view[self.read_fp:self.read_fp + first]]
+        if first < size:
+            views.append(self.view[0:size - first])
+        return views
+
+    def skip(self, size):
+        """Discards up to size bytes from the front of the buffer."""
+        size = max(min(size, self.available), 0)
+        self.read_fp = (self.read_fp + size) % self.size
         self.available -= size
+        if not self.available:
+            # Rewind so that the next frame is contiguous.
+            self.read_fp = self.write_fp = 0
+        return size
 
-        if len(result) < size:
-            self.buf.seek(0)
-            result += self.buf.read(size - len(result))
+    def readinto(self, b):
+        """Reads bytes from buffer into the writable buffer b and
+        returns the number of bytes copied."""
+        target = memoryview(b)
+        copied = 0
+        for view in self.peek(len(target)):
+            target[copied:copied + len(view)] = view
+            copied += len(view)
+        return self.skip(copied)
 
-        return result
+    def read(self, size=None):
+        """Reads size bytes from buffer"""
+        if size is None or size > self.available:
+            size = self.available
+        size = max(size, 0)
 
+        end = self.read_fp + size
+        if end <= self.size:
+            result = self.view[self.read_fp:end].tobytes()
+        else:
+            result = self.view[self.read_fp:].tobytes() + self.view[:end - self.size].tobytes()
+        self.skip(size)
+        return result
 
     def write(self, data):
         """Appends data to buffer"""
-        if self.size < self.available + len(data):
-            # Expand buffer
-            new_buf = StringIO()
-            new_buf.write(self.read())
-            self.write_fp = self.available = new_buf.tell()
-            read_fp = 0
-            while self.size <= self.available + len(data):
-                self.size = max(self.size, 1024) * 2
-            new_buf.write('0' * (self.size - self.write_fp))
-            self.buf = new_buf
-        else:
-            read_fp = self.buf.tell()
-
-        self.buf.seek(self.write_fp)
-        written = self.size - self.write_fp
-        self.buf.write(data[:written])
-        self.write_fp += len(data)
-        self.available += len(data)
-        if written < len(data):
-            self.write_fp -= self.size
-            self.buf.seek(0)
-            self.buf.write(data[written:])
-        self.buf.seek(read_fp)
+        data = memoryview(data)
+        length = len(data)
+        if self.size < self.available + length:
+            self._expand(self.available + length)
+
+        first = min(length, self.size - self.write_fp)
+        self.view[self.write_fp:self.write_fp + first] = data[:first]
+        if first < length:
+            self.view[0:length - first] = data[first:]
+        self.write_fp = (self.write_fp + length) % self.size
+        self.available += length
+
+    def _expand(self, needed):
+        """Grows the ring to hold at least needed bytes, moving the live
+        bytes to the start of the new storage."""
+        size = self.size
+        while size < needed:
+            size *= 2
+
+        new_buf = bytearray(size)
+        available = self.available
+        self.readinto(new_buf)
+        self.buf = new_buf
+        self.view = memoryview(new_buf)
+        self.size = size
+        self.read_fp = 0
+        self.write_fp = available % size
+        self.available = available
@@ -1,15 +1,26 @@
 #!/usr/bin/env python
 
 import zmq
+import time
 import io
+import random
+import logging
 from streamingbuffer import StreamingBuffer
+from h264 import NalSplitter, nal_type, NAL_SPS
+from framing import GopCache, pack_video_header, flags_for_mask, FLAG_SPS
+from metrics.registry import counter, gauge, histogram
+
+log = logging.getLogger(__name__)
 
 class ZeroMqOutput(object):
     def __init__(self, socket, hostname, framesize=4096):
         self.socket = socket
         self.hostname = hostname
         self.framesize = framesize
-        self.buffer = StreamingBuffer()
+        self.buffer = StreamingBuffer(framesize)
+        self.sent_bytes = counter('video_sent_bytes_total', camera=hostname)
+        self.write_latency = histogram('video_write_seconds', camera=hostname)
+        gauge('video_buffer_bytes', camera=hostname).set_function(lambda: self.buffer.available)
 
     def __enter__(self):
         return self
@@ -17,16 +28,217 @@ class ZeroMqOutput(object):
     def __exit__(self, type, value, tb):
         self.socket.send_multipart([self.hostname, ''])
 
+    def send_frame(self, frame):
+        # Frames are views of encoder output which is never modified
+        # after being handed to us, so ZMQ may hold on to them.
+        self.socket.send_multipart([self.hostname, frame], copy=False)
+
     def write(self, s):
-        # Add the incoming data to the buffer
-        self.buffer.write(s)
+        start = time.time()
+        view = memoryview(s)
+        length = len(view)
+        framesize = self.framesize
+        offset = 0
+        self.sent_bytes.inc(length)
+
+        if self.buffer.available:
+            # Top up the frame left over from the previous write.
+            offset = min(framesize - self.buffer.available, length)
+            self.buffer.write(view[:offset])
+            if self.buffer.available < framesize:
+                self.write_latency.observe(time.time() - start)
+                return
+            self.send_frame(self.buffer.read(framesize))
+
+        # Send whole frames straight out of the incoming data.
+        send_multipart = self.socket.send_multipart
+        hostname = self.hostname
+        while length - offset >= framesize:
+            send_multipart([hostname, view[offset:offset + framesize]], copy=False)
+            offset += framesize
+
+        # Keep hold of the tail until the next write completes the frame.
+        if offset < length:
+            self.buffer.write(view[offset:])
+        self.write_latency.observe(time.time() - start)
 
-        while self.buffer.available >= self.framesize:
-            self.socket.send_multipart([self.hostname, self.buffer.read(self.framesize)])
-            
     def flush(self):
         while self.buffer.available > self.framesize:
-            self.socket.send_multipart([self.hostname, self.buffer.read(self.framesize)])
+            self.send_frame(self.buffer.read(self.framesize))
+
+        self.send_frame(self.buffer.read())
+
+
+class NalZeroMqOutput(ZeroMqOutput):
+    """Publishes the H.264 stream in messages aligned to NAL units.
+
+    Each message is [header, payload] where the header holds the
+    keyframe flags, the stream id, a sequence number and the capture
+    time, with the hostname and the GOP's capture time added at each
+    keyframe (see data.framing).  Sequence numbers go up by one for
+    every message, including those dropped, so subscribers can see
+    what they have missed.  The stream id is picked at random unless
+    given, so a restarted camera starts a new stream.  Capture times
+    are taken from the encoder's presentation timestamps.
+
+    Small units are batched up to framesize bytes; a unit larger than
+    that is sent on its own.  A new message is always started at an SPS
+    so keyframes open a message.
+
+    When the socket is an XPUB with XPUB_VERBOSE set, every new
+    subscription is answered by replaying the current GOP so the new
+    subscriber can start decoding at once.  Replayed messages carry
+    FLAG_REPLAY so subscribers already in sync can ignore them.
+
+    The sent_bytes and dropped_messages counters count the payload sent
+    and the messages refused by the socket.  Messages are only refused if the
+    socket has XPUB_NODROP set and a subscriber is at its high water
+    mark, in which case the rest of the GOP is dropped too.
+    """
+
+    def __init__(self, socket, hostname, framesize=8192, camera=None, cachesize=2 * 1024 * 1024,
+                 stream_id=None):
+        super(NalZeroMqOutput, self).__init__(socket, hostname, framesize)
+        self.camera = camera
+        self.stream_id = random.getrandbits(16) if stream_id is None else stream_id
+        self.sequence = 0
+        self.gop_time = None
+        self.splitter = NalSplitter()
+        self.cache = GopCache(cachesize)
+        self.xpub = socket.getsockopt(zmq.TYPE) == zmq.XPUB
+        self.dropped_messages = counter('video_dropped_messages_total', camera=hostname)
+        self.send_latency = histogram('video_send_seconds', camera=hostname)
+        self.dropping_gop = False
+
+    def write(self, s):
+        start = time.time()
+        if self.xpub:
+            self.check_subscriptions()
+
+        units = self.splitter.feed(s)
+        if self.camera is not None and self.camera.frame.complete:
+            # The encoder has finished the frame so the last unit is whole.
+            units += self.splitter.flush()
+        self.send_units(units, self.capture_time())
+        self.write_latency.observe(time.time() - start)
+
+    def flush(self):
+        self.send_units(self.splitter.flush(), self.capture_time())
+
+    def capture_time(self):
+        """Returns the wall clock time the frame being written was
+        captured, or now if the encoder gives no timestamp."""
+        now = time.time()
+        frame = self.camera.frame if self.camera is not None else None
+        if frame is None or frame.timestamp is None:
+            return now
+        # Both timestamps are microseconds on the camera's clock.
+        return now - (self.camera.timestamp - frame.timestamp) / 1e6
+
+    def send_units(self, units, timestamp):
+        batch = []
+        batchsize = 0
+        nal_mask = 0
+        for unit in units:
+            unit_type = nal_type(unit)
+            if batch and (unit_type == NAL_SPS or batchsize + len(unit) > self.framesize):
+                self.send_batch(batch, nal_mask, timestamp)
+                batch = []
+                batchsize = 0
+                nal_mask = 0
+            batch.append(unit)
+            batchsize += len(unit)
+            nal_mask |= 1 << unit_type
 
-        self.socket.send_multipart([self.hostname, self.buffer.read()])
+        if batch:
+            self.send_batch(batch, nal_mask, timestamp)
 
+    def send_batch(self, batch, nal_mask, timestamp):
+        payload = b''.join(batch)
+        flags = flags_for_mask(nal_mask)
+        if flags & FLAG_SPS:
+            self.gop_time = timestamp
+        offset = 0 if self.gop_time is None else min(max(int((timestamp - self.gop_time) * 1e6), 0), 0xffffffff)
+        header = pack_video_header(flags, self.stream_id, self.sequence, offset, self.gop_time, self.hostname)
+        self.sequence = (self.sequence + 1) & 0xffffffff
+        self.cache.add(flags, header, payload)
+
+        if self.dropping_gop and not flags & FLAG_SPS:
+            self.dropped_messages.inc()
+            return
+        start = time.time()
+        try:
+            self.socket.send_multipart([header, payload], flags=zmq.NOBLOCK, copy=False)
+            self.sent_bytes.inc(len(payload))
+            self.dropping_gop = False
+        except zmq.Again:
+            self.dropped_messages.inc()
+            self.dropping_gop = True
+        self.send_latency.observe(time.time() - start)
+
+    def check_subscriptions(self):
+        """Replays the GOP cache for any new subscribers."""
+        while True:
+            try:
+                event = self.socket.recv(zmq.NOBLOCK)
+            except zmq.Again:
+                break
+
+            if event[:1] == b'\x01':
+                replay = self.cache.replay()
+                log.info('New video subscriber, replaying %i cached messages.', len(replay))
+                try:
+                    for header, payload in replay:
+                        self.socket.send_multipart([header, payload], flags=zmq.NOBLOCK, copy=False)
+                except zmq.Again:
+                    log.warning('Video subscribers are not keeping up, abandoning replay.')
+
+
+class MjpegZeroMqOutput(object):
+    """Publishes a motion JPEG stream one whole frame per message.
+
+    Messages are single part so that subscribers may set CONFLATE and
+    only ever see the newest frame.  The encoder produces frames at the
+    camera's framerate; frames arriving sooner than 1/fps after the last
+    one published are dropped here without being buffered.  A frame is
+    taken to be complete when a write ends with the JPEG end of image
+    marker.
+    """
+
+    END_OF_IMAGE = b'\xff\xd9'
+
+    def __init__(self, socket, fps):
+        self.socket = socket
+        self.interval = 1.0 / fps
+        self.next_frame = 0
+        self.parts = []
+        self.skipping = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, tb):
+        pass
+
+    def write(self, s):
+        if not self.parts and not self.skipping:
+            # First write of a new frame.
+            now = time.time()
+            if now < self.next_frame:
+                self.skipping = True
+            else:
+                self.next_frame = max(self.next_frame + self.interval, now)
+
+        if not self.skipping:
+            self.parts.append(s)
+
+        if s[-2:] == self.END_OF_IMAGE:
+            if not self.skipping:
+                frame = self.parts[0] if len(self.parts) == 1 else b''.join(self.parts)
+                self.socket.send(frame, copy=False)
+            self.parts = []
+            self.skipping = False
+
+    def flush(self):
+        self.parts = []
+        self.skipping = False
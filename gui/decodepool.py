@@ -0,0 +1,89 @@
+#!/usr/bin/env python
+
+import io
+import wx
+import time
+import logging
+import threading
+import collections
+
+from metrics.registry import counter, histogram
+
+log = logging.getLogger(__name__)
+
+
+class DecodePool(object):
+    """Decodes and scales JPEG images on worker threads.
+
+    submit() hands over the newest image for a camera along with the
+    size it is to be shown at.  Only the latest image for each camera is
+    kept: one still waiting when a newer one arrives is dropped unseen.
+    Images from one camera are decoded one at a time, so they are never
+    shown out of order.  Decoded images are passed to
+    callback(key, width, height, rgb) on the GUI thread, so all the GUI
+    thread has left to do is copy the RGB data into a bitmap.
+
+    Only wx.Image is used off the GUI thread, as unlike wx.Bitmap it
+    holds no GUI resources.
+    """
+
+    def __init__(self, callback, workers=2):
+        self.callback = callback
+        self.lock = threading.Condition()
+        self.pending = {}
+        self.ready = collections.deque()
+        self.busy = set()
+        self.dropped = counter('decode_dropped_total')
+        self.decode_time = histogram('decode_seconds')
+        self.stopping = False
+        self.threads = [threading.Thread(target=self.run) for _ in range(workers)]
+        for thread in self.threads:
+            thread.daemon = True
+            thread.start()
+
+    def submit(self, key, jpeg, size):
+        with self.lock:
+            if key in self.pending:
+                self.dropped.inc()
+            elif key not in self.busy:
+                self.ready.append(key)
+            self.pending[key] = (jpeg, size)
+            self.lock.notify()
+
+    def stop(self):
+        with self.lock:
+            self.stopping = True
+            self.lock.notify_all()
+
+    def run(self):
+        while True:
+            with self.lock:
+                while not self.ready and not self.stopping:
+                    self.lock.wait()
+                if self.stopping:
+                    return
+                key = self.ready.popleft()
+                jpeg, size = self.pending.pop(key)
+                self.busy.add(key)
+
+            try:
+                start = time.time()
+                width, height, rgb = self.decode(jpeg, size)
+                self.decode_time.observe(time.time() - start)
+                wx.CallAfter(self.callback, key, width, height, rgb)
+            except Exception:
+                log.exception('Failed to decode image from %s.', key)
+
+            with self.lock:
+                # Images for a camera are decoded one at a time, in order.
+                self.busy.discard(key)
+                if key in self.pending:
+                    self.ready.append(key)
+                    self.lock.notify()
+
+    def decode(self, jpeg, size):
+        img = wx.ImageFromStream(io.BytesIO(jpeg), wx.BITMAP_TYPE_JPEG)
+        width, height = size
+        if (img.GetWidth(), img.GetHeight()) != (width, height):
+            img.Rescale(width, height)
+        return width, height, img.GetData()
@@ -0,0 +1,72 @@
+#!/usr/bin/env python
+
+import wx
+import math
+import logging
+
+log = logging.getLogger(__name__)
+
+
+class CameraTile(wx.Panel):
+    """Shows the latest image from one camera.
+
+    The bitmap is reused for every image of the same size and is only
+    replaced when the tile is resized.  size is read by the retrieval
+    thread to decide what size to scale images to.
+    """
+
+    def __init__(self, parent, name):
+        wx.Panel.__init__(self, parent)
+        self.SetBackgroundStyle(wx.BG_STYLE_CUSTOM)
+        self.name = name
+        self.size = (1, 1)
+        self.bitmap = wx.EmptyBitmap(1, 1)
+        self.Bind(wx.EVT_PAINT, self.on_paint)
+        self.Bind(wx.EVT_SIZE, self.on_size)
+        self.Bind(wx.EVT_LEFT_UP, self.on_click)
+
+    def on_click(self, event):
+        """Click event handler to check where was clicked and dispatch relevant event."""
+        pos = event.GetPosition()
+        log.debug('Tile for %s was clicked at %s.', self.name, pos)
+
+    def on_size(self, event):
+        width, height = self.GetClientSize()
+        self.size = (max(width, 1), max(height, 1))
+        event.Skip()
+
+    def on_paint(self, event):
+        dc = wx.PaintDC(self)
+        dc.DrawBitmap(self.bitmap, 0, 0)
+
+    def update_image(self, width, height, rgb):
+        """Copies decoded RGB data into the bitmap and redraws the tile."""
+        if self.bitmap.GetSize() != (width, height):
+            self.bitmap.Destroy()
+            self.bitmap = wx.EmptyBitmap(width, height)
+        self.bitmap.CopyFromBuffer(rgb)
+        self.Refresh(False)
+
+
+class GridPanel(wx.Panel):
+    """This panel shows a tile for each monitored camera, in a grid as
+    near square as the number of cameras allows."""
+
+    def __init__(self, parent, names, gap=2):
+        wx.Panel.__init__(self, parent)
+        self.SetBackgroundColour(wx.BLACK)
+        columns = int(math.ceil(math.sqrt(len(names))))
+        rows = int(math.ceil(len(names) / float(columns)))
+
+        sizer = wx.GridSizer(rows, columns, gap, gap)
+        self.tiles = {}
+        for name in names:
+            self.tiles[name] = CameraTile(self, name)
+            sizer.Add(self.tiles[name], 0, wx.EXPAND)
+        self.SetSizer(sizer)
+
+    def tile_size(self, name):
+        return self.tiles[name].size
+
+    def update_image(self, name, width, height, rgb):
+        self.tiles[name].update_image(width, height, rgb)
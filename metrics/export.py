@@ -0,0 +1,98 @@
+#!/usr/bin/env python
+
+import os
+import zmq
+import json
+import time
+import logging
+import threading
+
+from registry import REGISTRY
+
+log = logging.getLogger(__name__)
+
+
+def format_labels(labels, extra=None):
+    items = sorted(labels.items()) + (extra or [])
+    if not items:
+        return ''
+    return '{%s}' % ','.join('%s="%s"' % (key, str(value).replace('\\', '\\\\').replace('"', '\\"'))
+                             for key, value in items)
+
+
+def prometheus_text(samples, prefix='pimonitor_'):
+    """Formats a registry snapshot in the Prometheus text exposition format."""
+    lines = []
+    typed = set()
+    for sample in samples:
+        name = prefix + sample['name']
+        if name not in typed:
+            typed.add(name)
+            lines.append('# TYPE %s %s' % (name, sample['kind']))
+
+        labels = sample['labels']
+        if sample['kind'] == 'histogram':
+            cumulative = 0
+            for bound, count in sample['buckets']:
+                cumulative += count
+                lines.append('%s_bucket%s %i' % (name, format_labels(labels, [('le', repr(bound))]), cumulative))
+            lines.append('%s_bucket%s %i' % (name, format_labels(labels, [('le', '+Inf')]), sample['count']))
+            lines.append('%s_sum%s %r' % (name, format_labels(labels), sample['sum']))
+            lines.append('%s_count%s %i' % (name, format_labels(labels), sample['count']))
+        else:
+            lines.append('%s%s %r' % (name, format_labels(labels), sample['value']))
+    return '\n'.join(lines) + '\n'
+
+
+class MetricsExporter(threading.Thread):
+    """Publishes the metrics registry every interval seconds.
+
+    Snapshots are sent as [host, json] messages on a PUB socket bound to
+    port on bind_address, if a port is given, and written to textfile in the Prometheus
+    text format for node_exporter's textfile collector, if a filename is
+    given.  The file is replaced atomically.
+    """
+
+    def __init__(self, context, host, interval=10, port=None, textfile=None, registry=REGISTRY, bind_address='*'):
+        super(MetricsExporter, self).__init__(name='metrics')
+        self.daemon = True
+        self.context = context
+        self.host = host
+        self.interval = interval
+        self.port = port
+        self.textfile = textfile
+        self.registry = registry
+        self.bind_address = bind_address
+        self.stopping = threading.Event()
+
+    def stop(self):
+        self.stopping.set()
+        self.join()
+
+    def run(self):
+        socket = None
+        if self.port:
+            log.info('Binding metrics publish socket to port %i.', self.port)
+            socket = self.context.socket(zmq.PUB)
+            socket.setsockopt(zmq.LINGER, 0)
+            socket.bind('tcp://%s:%s' % (self.bind_address, self.port))
+
+        try:
+            while not self.stopping.wait(self.interval):
+                samples = self.registry.snapshot()
+                if socket is not None:
+                    socket.send_multipart([self.host, json.dumps({'time': time.time(), 'metrics': samples})])
+                if self.textfile:
+                    self.write_textfile(samples)
+        finally:
+            if socket is not None:
+                socket.close()
+
+    def write_textfile(self, samples):
+        temp = self.textfile + '.tmp'
+        try:
+            with open(temp, 'w') as f:
+                f.write(prometheus_text(samples))
+            os.rename(temp, self.textfile)
+        except (IOError, OSError) as e:
+            log.error('Unable to write metrics to %s: %s', self.textfile, e)
@@ -0,0 +1,127 @@
+#!/usr/bin/env python
+
+import bisect
+import threading
+import collections
+
+# Upper bounds in seconds of the default latency histogram buckets.
+LATENCY_BUCKETS = (0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0)
+
+
+class Counter(object):
+    """A count which only goes up."""
+
+    kind = 'counter'
+
+    def __init__(self, name, labels):
+        self.name = name
+        self.labels = labels
+        self.value = 0
+
+    def inc(self, amount=1):
+        self.value += amount
+
+    def sample(self):
+        return {'value': self.value}
+
+
+class Gauge(object):
+    """A value which may go up and down.  If a function is given it is
+    called for the value whenever the gauge is sampled."""
+
+    kind = 'gauge'
+
+    def __init__(self, name, labels):
+        self.name = name
+        self.labels = labels
+        self.value = 0
+        self.function = None
+
+    def set(self, value):
+        self.value = value
+
+    def set_function(self, function):
+        self.function = function
+
+    def sample(self):
+        return {'value': self.function() if self.function is not None else self.value}
+
+
+class Histogram(object):
+    """Counts observations, such as latencies, into fixed buckets."""
+
+    kind = 'histogram'
+
+    def __init__(self, name, labels, buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.labels = labels
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def sample(self):
+        return {'count': self.count, 'sum': self.sum,
+                'buckets': list(zip(self.buckets, self.counts[:-1]))}
+
+
+class Registry(object):
+    """Holds every metric of the process, by name and labels.
+
+    Metrics are created once, typically when the object they measure is
+    created, and then updated without any locking.  An update racing
+    with another thread's update of the same metric may be lost, which
+    is accepted to keep the hot paths cheap.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.metrics = collections.OrderedDict()
+
+    def get(self, metric_class, name, labels, *args):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            metric = self.metrics.get(key)
+            if metric is None:
+                metric = self.metrics[key] = metric_class(name, dict(labels), *args)
+            return metric
+
+    def counter(self, name, **labels):
+        return self.get(Counter, name, labels)
+
+    def gauge(self, name, **labels):
+        return self.get(Gauge, name, labels)
+
+    def histogram(self, name, buckets=LATENCY_BUCKETS, **labels):
+        return self.get(Histogram, name, labels, buckets)
+
+    def snapshot(self):
+        """Returns the current value of every metric as a list of dicts."""
+        with self.lock:
+            metrics = list(self.metrics.values())
+        samples = []
+        for metric in metrics:
+            sample = metric.sample()
+            sample.update({'name': metric.name, 'kind': metric.kind, 'labels': metric.labels})
+            samples.append(sample)
+        return samples
+
+
+REGISTRY = Registry()
+
+
+def counter(name, **labels):
+    return REGISTRY.counter(name, **labels)
+
+
+def gauge(name, **labels):
+    return REGISTRY.gauge(name, **labels)
+
+
+def histogram(name, buckets=LATENCY_BUCKETS, **labels):
+    return REGISTRY.histogram(name, buckets, **labels)
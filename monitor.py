@@ -3,56 +3,82 @@
 # General modules 
 import wx
 import os
-import io
 import sys
 import zmq
-import datetime
+import time
 import threading
 import socket
 import logging
+import argparse
+from subprocess import Popen, PIPE
 
 # Project modules
-from gui.imagepanel import ImagePanel
+from gui.gridpanel import GridPanel
+from gui.decodepool import DecodePool
+from data.stillserver import StillClient
+from data.refreshscheduler import RefreshScheduler
+from data.events import MOTION, MOTION_START, MOTION_END
+from recording.playback import PlaybackClient, NOT_FOUND, BUSY, FAILED
+from recording.eventstore import parse_time
+from metrics.export import MetricsExporter
 import config 
 
 log = logging.getLogger(__name__)
 
 class MonitorFrame(wx.Frame):
-    """Frame holding image panel for monitor which runs maximised."""
+    """Frame holding the camera grid for monitor which runs maximised."""
  
-    def __init__(self, hostname):
-        """Constructor"""
+    def __init__(self, hostname, playback=None):
+        """Constructor.  playback is (camera, start, duration) to play
+        back a recording rather than show the cameras live."""
         wx.Frame.__init__(self, None, title="Camera Monitor")
         
         self.hostname = hostname
+        self.playback = playback
 
         log.info('Loading network and monitor configuration files.')
         module_dir = os.path.dirname(__file__)
         self.network_config = config.load_from_file(os.path.join(module_dir, 'config/network.json'))
         self.monitor_config = config.load_from_file(os.path.join(module_dir, 'config/monitor.json'))
 
-        log.info('Creating image panel.')
-        self.panel = ImagePanel(self)
+        self.metrics_exporter = MetricsExporter(zmq.Context.instance(), hostname,
+                                                self.monitor_config['metrics_interval'],
+                                                self.network_config['monitor_stats_port'],
+                                                self.monitor_config['metrics_textfile'])
+        self.metrics_exporter.start()
+
+        log.info('Creating camera grid.')
+        self.panel = GridPanel(self, [playback[0]] if playback else self.monitor_config['camera_ip_addrs'])
+        self.decode_pool = DecodePool(self.panel.update_image, self.monitor_config['decode_workers'])
         self.ShowFullScreen(True)
 
         log.info('Starting image retrieval background thread.')
-        self.thread = threading.Thread(target=self.image_retrieval_loop)
+        if playback:
+            self.thread = threading.Thread(target=self.playback_loop)
+        elif self.monitor_config['image_source'] == 'mjpeg':
+            self.thread = threading.Thread(target=self.mjpeg_retrieval_loop)
+        else:
+            self.thread = threading.Thread(target=self.image_retrieval_loop)
         self.thread.start()
 
 
+    def show_image(self, cameraip, jpeg):
+        """Queues a still from a camera to be decoded and shown in its tile."""
+        self.decode_pool.submit(cameraip, jpeg, self.panel.tile_size(cameraip))
+
     def image_retrieval_loop(self):
-        reload_delay = self.monitor_config['image_reload_delay']
         camera_ip_addrs = self.monitor_config['camera_ip_addrs']
         xres = self.monitor_config['xres']
         yres = self.monitor_config['yres']
 
         eventport = self.network_config['event_pub_port']
         jpegport = self.network_config['jpeg_router_port']
+        still_credit = self.network_config['still_credit']
 
         context = zmq.Context()
 
-        eventsockets = []
-        jpegsockets = {}
+        eventsocketstoip = {}
+        stillclients = {}
         jpegsocketstoip = {}
 
         for cameraip in camera_ip_addrs:
@@ -60,54 +86,153 @@ class MonitorFrame(wx.Frame):
             eventsocket = context.socket(zmq.SUB)
             eventsocket.connect('tcp://%s:%s' % (cameraip, eventport))
             eventsocket.setsockopt(zmq.SUBSCRIBE, '')
-            eventsockets += [eventsocket]
+            eventsocketstoip[eventsocket] = cameraip
 
             log.info('Connecting to camera JPEG feed: %s:%i.', cameraip, jpegport)
-            jpegsocket = context.socket(zmq.REQ)
+            jpegsocket = context.socket(zmq.DEALER)
             jpegsocket.setsockopt(zmq.IDENTITY, self.hostname)
             jpegsocket.connect('tcp://%s:%s' % (cameraip, jpegport))
-            jpegsockets[cameraip] = jpegsocket
+            stillclients[cameraip] = StillClient(jpegsocket, still_credit, cameraip)
             jpegsocketstoip[jpegsocket] = cameraip
 
         poller = zmq.Poller()
-        for jpegsocket in jpegsockets.itervalues():
+        for jpegsocket in jpegsocketstoip:
             poller.register(jpegsocket, zmq.POLLIN)
 
-        for eventsocket in eventsockets:
+        for eventsocket in eventsocketstoip:
             poller.register(eventsocket, zmq.POLLIN)
 
-        ongoing_reqs = {}
-        last_reqs = dict((ip, datetime.datetime.min) for ip in camera_ip_addrs)
+        scheduler = RefreshScheduler(camera_ip_addrs,
+                                     self.monitor_config['image_reload_delay'],
+                                     self.monitor_config['motion_reload_delay'],
+                                     self.monitor_config['motion_hold'],
+                                     self.monitor_config['still_timeout'],
+                                     time.time())
 
         while True:
-            socks = dict(poller.poll(100))
-            for sock, status in socks.iteritems():
-                if sock in jpegsockets.values() and status == zmq.POLLIN: 
-                    data = sock.recv()
-                    if data:
-                        ongoing_reqs[jpegsocketstoip[sock]].write(data)
-                        sock.send('NEXT')
-                    else:
-                        stream = ongoing_reqs[jpegsocketstoip[sock]]
-                        stream.seek(0)
-                        wx.CallAfter(self.panel.update_image, stream)
-                        del ongoing_reqs[jpegsocketstoip[sock]]
-                        sock.send('ENDACK')
-                        sock.recv()
-                        log.debug('Still fully transferred and ending acknowledged.')
-
-                elif sock in eventsockets and status == zmq.POLLIN: 
-                    log.debug('Event message received on subscription.')
-                    _ = sock.recv_multipart()
-            
-            for ip in camera_ip_addrs:
-                if ip not in ongoing_reqs and datetime.datetime.now() > last_reqs[ip] + datetime.timedelta(seconds=reload_delay):
-                    last_reqs[ip] = datetime.datetime.now()
-                    ongoing_reqs[ip] = io.BytesIO()
-                    log.debug('Sending request to %s for new still with resolution (%i, %i).', ip, xres, yres)
-                    jpegsockets[ip].send('NEW %i %i' % (xres, yres)) 
+            socks = poller.poll(scheduler.next_timeout(time.time()))
+            now = time.time()
+            for sock, status in socks:
+                if sock in jpegsocketstoip:
+                    cameraip = jpegsocketstoip[sock]
+                    try:
+                        jpeg = stillclients[cameraip].handle(sock.recv_multipart())
+                    except ValueError as e:
+                        log.warning('Ignoring still reply from %s: %s', cameraip, e)
+                        continue
+                    if jpeg is not None:
+                        self.show_image(cameraip, jpeg)
+                        scheduler.completed(cameraip, now)
+                        log.debug('Still fully transferred.')
+
+                else:
+                    cameraip = eventsocketstoip[sock]
+                    try:
+                        host, event, payload = sock.recv_multipart()
+                    except ValueError as e:
+                        log.warning('Ignoring event message from %s: %s', cameraip, e)
+                        continue
+                    log.debug('Event %s received from %s.', event, cameraip)
+                    if event == MOTION_START:
+                        scheduler.motion_start(cameraip, now)
+                    elif event == MOTION_END:
+                        scheduler.motion_end(cameraip, now)
+                    elif event == MOTION:
+                        scheduler.motion(cameraip, now)
+
+            for ip in scheduler.pop_due(now):
+                log.debug('Sending request to %s for new still with resolution (%i, %i).', ip, xres, yres)
+                stillclients[ip].fetch((xres, yres))
+
+    def mjpeg_retrieval_loop(self):
+        """Shows the frames pushed on each camera's MJPEG feed.  Only the
+        newest frame from each camera is kept, so a slow monitor skips
+        frames rather than falling behind."""
+        camera_ip_addrs = self.monitor_config['camera_ip_addrs']
+        mjpegport = self.network_config['mjpeg_pub_port']
+
+        context = zmq.Context()
+        poller = zmq.Poller()
+        mjpegsocketstoip = {}
+
+        for cameraip in camera_ip_addrs:
+            log.info('Connecting to camera MJPEG feed: %s:%i.', cameraip, mjpegport)
+            mjpegsocket = context.socket(zmq.SUB)
+            mjpegsocket.setsockopt(zmq.CONFLATE, 1)
+            mjpegsocket.setsockopt(zmq.SUBSCRIBE, '')
+            mjpegsocket.connect('tcp://%s:%s' % (cameraip, mjpegport))
+            poller.register(mjpegsocket, zmq.POLLIN)
+            mjpegsocketstoip[mjpegsocket] = cameraip
+
+        while True:
+            for sock, status in poller.poll():
+                self.show_image(mjpegsocketstoip[sock], sock.recv())
+
+
+    def playback_loop(self):
+        """Plays back a camera's recording streamed from the recorder.  ffmpeg
+        decodes it to JPEG frames at the recording's own pace, and as it
+        only reads as fast as it plays, the stream from the recorder is
+        held back to match."""
+        camera, start, duration = self.playback
+        recorder_addr = self.monitor_config['recorder_addr']
+        playbackport = self.network_config['playback_port']
+        xres = self.monitor_config['xres']
+        yres = self.monitor_config['yres']
+
+        context = zmq.Context()
+        log.info('Connecting to recorder playback: %s:%i.', recorder_addr, playbackport)
+        playbacksocket = context.socket(zmq.DEALER)
+        playbacksocket.setsockopt(zmq.IDENTITY, self.hostname)
+        playbacksocket.connect('tcp://%s:%s' % (recorder_addr, playbackport))
+        client = PlaybackClient(playbacksocket, self.monitor_config['playback_credit'])
+
+        ffmpeg = Popen([self.monitor_config['ffmpeg'], '-v', 'error', '-re', '-f', 'mpegts', '-i', '-',
+                        '-vf', 'scale=%i:%i' % (xres, yres), '-f', 'image2pipe', '-c:v', 'mjpeg', '-q:v', '5', '-'],
+                       stdin=PIPE, stdout=PIPE)
+        reader = threading.Thread(target=self.show_jpegs, args=(camera, ffmpeg.stdout))
+        reader.daemon = True
+        reader.start()
+
+        client.play(camera, start, duration)
+        try:
+            while not client.finished:
+                if not playbacksocket.poll(self.monitor_config['still_timeout'] * 1000):
+                    log.warning('Recorder stopped sending the recording of %s.', camera)
+                    break
+                chunk = client.handle(playbacksocket.recv_multipart())
+                if chunk:
+                    ffmpeg.stdin.write(chunk)
+        finally:
+            client.stop()
+            ffmpeg.stdin.close()
+            ffmpeg.wait()
+            reader.join()
+
+        if client.status & NOT_FOUND:
+            log.warning('Nothing was recorded from %s at that time.', camera)
+        elif client.status & BUSY:
+            log.warning('The recorder is too busy to play back %s.', camera)
+        elif client.status & FAILED:
+            log.error('The recorder was unable to read the recording of %s.', camera)
+        else:
+            log.info('Played back %i bytes of %s.', client.received, camera)
+
+    def show_jpegs(self, camera, pipe):
+        """Shows the JPEG frames read from a pipe in a camera's tile."""
+        pending = b''
+        while True:
+            data = os.read(pipe.fileno(), 65536)
+            if not data:
+                break
+            pending += data
+            end = pending.find(b'\xff\xd9')
+            while end >= 0:
+                self.show_image(camera, pending[:end + 2])
+                pending = pending[end + 2:]
+                end = pending.find(b'\xff\xd9')
+
 
- 
 if __name__ == "__main__":
     # Setup logging    
     root = logging.getLogger()
@@ -119,10 +244,22 @@ if __name__ == "__main__":
     ch.setFormatter(formatter)
     root.addHandler(ch)
 
+    parser = argparse.ArgumentParser(description='Show the cameras live, or play back a recording.')
+    parser.add_argument('--playback', nargs=3, metavar=('CAMERA', 'START', 'DURATION'),
+                        help='play back a recording, e.g. cctvdoor 2015-06-01T08:14:30 60')
+    args = parser.parse_args()
+
+    playback = None
+    if args.playback:
+        try:
+            playback = (args.playback[0], parse_time(args.playback[1]), float(args.playback[2]))
+        except ValueError as e:
+            parser.error(str(e))
+
     hostname = socket.gethostname()
 
     app = wx.App(False)
-    frame = MonitorFrame(hostname)
+    frame = MonitorFrame(hostname, playback)
     app.MainLoop()
 
 
@@ -0,0 +1,83 @@
+#!/usr/bin/env python
+
+import numpy as np
+
+# Size in pixels of the macroblocks the motion vectors are given for.
+BLOCK_SIZE = 16
+
+
+def magnitude_limit(magnitude_threshold):
+    """Returns the squared magnitude at and above which a vector counts
+    as over the threshold.
+
+    A vector counts when its magnitude, truncated to an integer, is
+    greater than the threshold, that is floor(sqrt(x*x + y*y)) > t,
+    which holds exactly when x*x + y*y >= (floor(t) + 1) ** 2.
+    """
+    return (int(np.floor(magnitude_threshold)) + 1) ** 2
+
+
+def region_mask(shape, include_regions=None, exclude_regions=None):
+    """Returns a boolean array of shape (rows, columns) marking the blocks
+    to analyse.  Regions are [x, y, width, height] in pixels; a block is
+    included if it overlaps any include region (or there are none) and
+    no exclude region."""
+    def blocks(mask, region, value):
+        x, y, width, height = region
+        mask[y // BLOCK_SIZE:-(-(y + height) // BLOCK_SIZE),
+             x // BLOCK_SIZE:-(-(x + width) // BLOCK_SIZE)] = value
+
+    if include_regions:
+        mask = np.zeros(shape, dtype=np.bool_)
+        for region in include_regions:
+            blocks(mask, region, True)
+    else:
+        mask = np.ones(shape, dtype=np.bool_)
+
+    for region in exclude_regions or []:
+        blocks(mask, region, False)
+    return mask
+
+
+class MotionKernel(object):
+    """Finds the blocks of a motion vector frame whose magnitude is over
+    a threshold, comparing squared integer magnitudes so that no float or
+    sqrt is needed.  Scratch arrays are allocated for the first frame and
+    reused for every frame after it, as is the region mask.
+    """
+
+    def __init__(self, magnitude_threshold, include_regions=None, exclude_regions=None):
+        self.limit = magnitude_limit(magnitude_threshold)
+        self.include_regions = include_regions
+        self.exclude_regions = exclude_regions
+        self.shape = None
+
+    def allocate(self, shape):
+        self.shape = shape
+        self.xx = np.empty(shape, dtype=np.int32)
+        self.yy = np.empty(shape, dtype=np.int32)
+        self.active = np.empty(shape, dtype=np.bool_)
+        if self.include_regions or self.exclude_regions:
+            self.mask = region_mask(shape, self.include_regions, self.exclude_regions)
+        else:
+            self.mask = None
+
+    def active_blocks(self, a):
+        """Returns a boolean array, valid until the next call, marking the
+        blocks of the motion array a which are over the threshold."""
+        if a.shape != self.shape:
+            self.allocate(a.shape)
+
+        np.copyto(self.xx, a['x'])
+        np.copyto(self.yy, a['y'])
+        np.multiply(self.xx, self.xx, out=self.xx)
+        np.multiply(self.yy, self.yy, out=self.yy)
+        np.add(self.xx, self.yy, out=self.xx)
+        np.greater_equal(self.xx, self.limit, out=self.active)
+        if self.mask is not None:
+            np.logical_and(self.active, self.mask, out=self.active)
+        return self.active
+
+    def count(self, a):
+        """Returns the number of blocks of a which are over the threshold."""
+        return int(np.count_nonzero(self.active_blocks(a)))
@@ -1,28 +1,142 @@
 #!/usr/bin/env python
 
+import time
 import logging
 import numpy as np
 import picamera
 from picamera.array import PiMotionAnalysis
 
+from kernel import MotionKernel
+from data.events import MotionEpisode, ActivitySummary, MOTION_START, MOTION_END, ACTIVITY_GRID
+from metrics.registry import counter, histogram
+
 log = logging.getLogger(__name__)
 
+class MotionEpisodeTracker(object):
+    """Coalesces per-frame motion into episodes.
+
+    An episode starts on a frame with more than start_threshold active
+    blocks.  It is kept going by any frame with more than end_threshold
+    active blocks and ends once there has been no such frame for
+    min_gap seconds.  update() returns the event to publish, if any,
+    along with the episode so far.
+    """
+
+    def __init__(self, start_threshold, end_threshold, min_gap):
+        self.start_threshold = start_threshold
+        self.end_threshold = end_threshold
+        self.min_gap = min_gap
+        self.episode = None
+
+    def update(self, blocks, active, now):
+        if self.episode is None:
+            if blocks > self.start_threshold:
+                self.episode = MotionEpisode(now)
+                self.add_frame(blocks, active, now)
+                return MOTION_START, self.episode
+        elif blocks > self.end_threshold:
+            self.add_frame(blocks, active, now)
+        elif now - self.episode.end >= self.min_gap:
+            episode = self.episode
+            self.episode = None
+            return MOTION_END, episode
+        return None, None
+
+    def add_frame(self, blocks, active, now):
+        rows = np.flatnonzero(active.any(axis=1))
+        cols = np.flatnonzero(active.any(axis=0))
+        if len(rows):
+            self.episode.include((rows[0], cols[0], rows[-1], cols[-1]))
+        self.episode.peak_blocks = max(self.episode.peak_blocks, blocks)
+        self.episode.frames += 1
+        self.episode.end = now
+
+
+class ActivitySummariser(object):
+    """Summarises per-frame motion over periods of interval seconds,
+    aligned to the clock, on a coarse grid of grid x grid cells.
+
+    The active blocks of each frame are summed into the grid cells, and
+    update() returns an ActivitySummary of the period just finished when
+    a frame starts the next one.
+    """
+
+    def __init__(self, interval, grid=ACTIVITY_GRID):
+        self.interval = interval
+        self.grid = grid
+        self.shape = None
+        self.start = None
+
+    def allocate(self, shape):
+        self.shape = shape
+        self.row_edges = np.arange(self.grid) * shape[0] // self.grid
+        self.col_edges = np.arange(self.grid) * shape[1] // self.grid
+        self.cell_blocks = self.cell_sums(np.ones(shape, dtype=np.bool_))
+        self.counts = np.zeros((self.grid, self.grid), dtype=np.int64)
+
+    def cell_sums(self, active):
+        rows = np.add.reduceat(active, self.row_edges, axis=0, dtype=np.int32)
+        return np.add.reduceat(rows, self.col_edges, axis=1, dtype=np.int32)
+
+    def update(self, blocks, active, now):
+        if active.shape != self.shape:
+            self.allocate(active.shape)
+            self.start = None
+
+        period = now - now % self.interval
+        summary = None
+        if self.start is not None and period != self.start:
+            summary = self.summary()
+        if self.start is None or summary is not None:
+            self.start = period
+            self.frames = 0
+            self.peak_blocks = 0
+            self.counts.fill(0)
+
+        self.counts += self.cell_sums(active)
+        self.frames += 1
+        self.peak_blocks = max(self.peak_blocks, blocks)
+        return summary
+
+    def summary(self):
+        grid = np.minimum(self.counts * 255 // (self.cell_blocks * self.frames), 255)
+        return ActivitySummary(self.start, self.interval, self.frames, self.peak_blocks,
+                               [int(value) for value in grid.flat])
+
+
 class VectorThresholdMotionDetect(PiMotionAnalysis):
 
-    def __init__(self, event_callback, magnitude_threshold, block_threshold, eventsocket, camera, size=None):
+    def __init__(self, event_callback, magnitude_threshold, block_threshold, eventsocket, camera, size=None,
+                 include_regions=None, exclude_regions=None, block_threshold_end=None, min_gap=0,
+                 activity_callback=None, activity_interval=1):
         super(VectorThresholdMotionDetect, self).__init__(camera, size)
         self.event_callback = event_callback
         self.magnitude_threshold = magnitude_threshold
         self.block_threshold = block_threshold
         self.eventsocket = eventsocket
+        self.kernel = MotionKernel(magnitude_threshold, include_regions, exclude_regions)
+        self.tracker = MotionEpisodeTracker(block_threshold,
+                                            block_threshold if block_threshold_end is None else block_threshold_end,
+                                            min_gap)
+        self.activity_callback = activity_callback
+        self.activity = ActivitySummariser(activity_interval) if activity_callback and activity_interval else None
+        self.analysis_time = histogram('motion_analysis_seconds')
+        self.events = counter('motion_events_total')
 
     def analyse(self, a):
-        magnitude_series = np.sqrt(np.square(a['x'].astype(np.float)) + 
-                                   np.square(a['y'].astype(np.float))).clip(0, 255).astype(np.uint8)
-
-        blocksoverthreshold = (magnitude_series > self.magnitude_threshold).sum()
+        start = time.time()
+        active = self.kernel.active_blocks(a)
+        blocksoverthreshold = int(np.count_nonzero(active))
         log.debug('Motion analysed. %i blocks over threshold %i.', blocksoverthreshold, self.block_threshold)
-        if blocksoverthreshold > self.block_threshold:
-            self.event_callback(self.eventsocket)
 
+        event, episode = self.tracker.update(blocksoverthreshold, active, start)
+        if event is not None:
+            self.events.inc()
+            self.event_callback(self.eventsocket, event, episode)
+
+        if self.activity is not None:
+            summary = self.activity.update(blocksoverthreshold, active, start)
+            if summary is not None:
+                self.activity_callback(self.eventsocket, summary)
+        self.analysis_time.observe(time.time() - start)
 
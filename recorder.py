@@ -4,26 +4,40 @@
 import sys
 import os
 import zmq
+import struct
 import logging
 import socket
-import datetime
-import errno
-from subprocess import Popen, PIPE
+import time
+import argparse
 
 # Project modules
 import config
+from data.framing import parse_video_message
+from recording.segmenter import SegmentWriter, SegmentFinaliser
+from recording.ingest import IngestWorker
+from recording.streamtracker import StreamTracker
+from data.relay import RelaySubscriber
+from recording.retention import RetentionManager
+from recording.thumbnails import ThumbnailGenerator
+from recording.playback import PlaybackServer
+from recording.cluster import ClusterMembership
+from recording.prebuffer import MotionTrigger
+from recording.eventstore import EventStore, parse_event_time
+from data.events import event_time, decode_activity, MOTION, MOTION_START, MOTION_END, ACTIVITY
+from metrics.export import MetricsExporter
 
 log = logging.getLogger(__name__)
 
-def main():
-    hostname = socket.gethostname()
-    log.info('Starting recording client on %s.', hostname)
-
+def main(config_dir=None):
     module_dir = os.path.dirname(__file__)
+    config_dir = config_dir or os.path.join(module_dir, 'config')
+
+    network_config = config.load_from_file(os.path.join(config_dir, 'network.json'))
+    camera_config = config.load_from_file(os.path.join(config_dir, 'camera.json'))
+    recorder_config = config.load_from_file(os.path.join(config_dir, 'recorder.json'))
 
-    network_config = config.load_from_file(os.path.join(module_dir, 'config/network.json'))
-    camera_config = config.load_from_file(os.path.join(module_dir, 'config/camera.json'))
-    recorder_config = config.load_from_file(os.path.join(module_dir, 'config/recorder.json'))
+    hostname = str(recorder_config['recorder_name'] or socket.gethostname())
+    log.info('Starting recording client on %s.', hostname)
 
     eventport = network_config['event_pub_port']
     videoport = network_config['h264_pub_port']
@@ -35,111 +49,280 @@ def main():
     recording_folder = recorder_config['recording_folder']
     event_log = recorder_config['event_log']
     event_log_format = recorder_config['event_log_format']
+    event_store_file = recorder_config['event_store']
+    event_flush_interval = recorder_config['event_flush_interval']
+    ingest_queue_size = recorder_config['ingest_queue_size']
+    stats_interval = recorder_config['stats_interval']
+    relay_addr = recorder_config['relay_addr']
+    preallocate_size = recorder_config['segment_preallocate_bytes']
+    bind_address = recorder_config['bind_address']
+    cluster_peers = recorder_config['cluster_peers']
+    clusterport = network_config['cluster_port']
 
     context = zmq.Context()
+    metrics_exporter = MetricsExporter(context, hostname,
+                                       recorder_config['metrics_interval'],
+                                       network_config['recorder_stats_port'],
+                                       recorder_config['metrics_textfile'],
+                                       bind_address=bind_address)
+    metrics_exporter.start()
 
-    eventsockets = []
-    videosockets = []
+    eventsockets = set()
+    videosockets = set()
+    camera_sockets = {}
+    relay_subscribers = {}
+    poller = zmq.Poller()
 
-    for cameraip in cameraips:
-        log.info('Connecting to camera event feed: %s:%i.', cameraip, eventport)
+    if relay_addr:
+        # Every camera's events and video come through the relay.
+        relay_eventport = network_config['relay_event_port']
+        relay_videoport = network_config['relay_video_port']
+        log.info('Connecting to relayed event feed: %s:%i.', relay_addr, relay_eventport)
         eventsocket = context.socket(zmq.SUB)
-        eventsocket.connect('tcp://%s:%s' % (cameraip, eventport))
+        eventsocket.connect('tcp://%s:%s' % (relay_addr, relay_eventport))
         eventsocket.setsockopt(zmq.SUBSCRIBE, '')
-        eventsockets += [eventsocket]
-
-        log.info('Connecting to camera video feed: %s:%i.', cameraip, videoport)
-        videosocket = context.socket(zmq.SUB)
-        videosocket.connect('tcp://%s:%s' % (cameraip, videoport))
-        videosocket.setsockopt(zmq.SUBSCRIBE, '')
-        videosockets += [videosocket]
+        eventsockets.add(eventsocket)
+        poller.register(eventsocket, zmq.POLLIN)
 
-    files = {}
-    
-    poller = zmq.Poller()
-    for videosocket in videosockets:
+        log.info('Connecting to relayed video feed: %s:%i.', relay_addr, relay_videoport)
+        videosocket = context.socket(zmq.DEALER)
+        videosocket.connect('tcp://%s:%s' % (relay_addr, relay_videoport))
+        relay_subscribers[videosocket] = RelaySubscriber(videosocket, hostname, recorder_config['relay_window'])
+        videosockets.add(videosocket)
         poller.register(videosocket, zmq.POLLIN)
 
-    for eventsocket in eventsockets:
-        poller.register(eventsocket, zmq.POLLIN)
+    cluster = None
+    if cluster_peers and not relay_addr:
+        # Cameras are shared out between the recorders as they come and go.
+        log.info('Binding cluster heartbeat socket to port %i.', clusterport)
+        heartbeatpubsocket = context.socket(zmq.PUB)
+        heartbeatpubsocket.bind('tcp://%s:%s' % (bind_address, clusterport))
+        heartbeatsubsocket = context.socket(zmq.SUB)
+        heartbeatsubsocket.setsockopt(zmq.SUBSCRIBE, '')
+        for peer in cluster_peers:
+            log.info('Connecting to recorder heartbeats: %s:%i.', peer, clusterport)
+            heartbeatsubsocket.connect('tcp://%s:%s' % (peer, clusterport))
+        poller.register(heartbeatsubsocket, zmq.POLLIN)
+        cluster = ClusterMembership(hostname, heartbeatpubsocket, heartbeatsubsocket, cameraips,
+                                    recorder_config['heartbeat_interval'], recorder_config['heartbeat_timeout'])
+    elif cluster_peers:
+        log.warning('Cameras cannot be shared between recorders through a relay, recording every camera.')
+
+    if not relay_addr and cluster is None:
+        for cameraip in cameraips:
+            camera_sockets[cameraip] = connect_camera(context, poller, cameraip, eventport, videoport)
+            eventsockets.add(camera_sockets[cameraip][0])
+            videosockets.add(camera_sockets[cameraip][1])
+
+    # One tracker for each stream on each socket, as a relay carries many.
+    trackers = {}
+
+    event_store = EventStore(event_store_file, event_flush_interval, event_log, event_log_format)
+    event_store.start()
+
+    retention = RetentionManager(recording_folder,
+                                 recorder_config['retention_max_bytes'],
+                                 recorder_config['retention_max_days'],
+                                 recorder_config['retention_interval'])
+    retention.start()
+
+    thumbnail_interval = recorder_config['thumbnail_interval']
+    thumbnails = ThumbnailGenerator(recorder_config['ffmpeg'],
+                                    recorder_config['thumbnail_size'],
+                                    recorder_config['thumbnail_columns'],
+                                    recorder_config['thumbnail_workers'],
+                                    recorder_config['thumbnail_queue_size'])
+    thumbnails.start()
+
+    playback_server = PlaybackServer(context, recording_folder,
+                                     network_config['playback_port'],
+                                     bind_address,
+                                     recorder_config['playback_chunk_size'],
+                                     recorder_config['playback_max_streams'],
+                                     recorder_config['playback_timeout'],
+                                     recorder_config['playback_max_credit'])
+    playback_server.start()
+
+    finaliser = SegmentFinaliser()
+    # Segments are indexed for retention once their thumbnails are made,
+    # so the size of every file kept beside them is counted.
+    thumbnails.listeners.append(retention.add)
+    finaliser.listeners.append(thumbnails.add)
+    finaliser.start()
+    workers = {}
+    feeds = {}
+    next_stats = time.time() + stats_interval
 
     try:
         while True:
-            socks = dict(poller.poll(5000))
+            if cluster is not None and cluster.update(time.time()):
+                assigned = cluster.assigned
+                for cameraip in set(camera_sockets) - assigned:
+                    eventsocket, videosocket = camera_sockets.pop(cameraip)
+                    eventsockets.discard(eventsocket)
+                    videosockets.discard(videosocket)
+                    for key in [key for key in trackers if key[0] is videosocket]:
+                        host = trackers.pop(key).host
+                        if host in workers:
+                            workers[host].close_segment()
+                    disconnect_camera(poller, cameraip, eventsocket, videosocket)
+                for cameraip in assigned - set(camera_sockets):
+                    camera_sockets[cameraip] = connect_camera(context, poller, cameraip, eventport, videoport)
+                    eventsockets.add(camera_sockets[cameraip][0])
+                    videosockets.add(camera_sockets[cameraip][1])
+
+            socks = dict(poller.poll(1000 if cluster is None else cluster.interval * 1000))
             for sock, status in socks.iteritems():
-                if sock in videosockets and status == zmq.POLLIN: 
-                    host, data = sock.recv_multipart()
-                
-                    if host not in files:
-                        # We're lacking a current output pipe for this host.
-                        starttime = datetime.datetime.now()
-                        date_folder = os.path.join(recording_folder, starttime.date().isoformat())
-                        
-                        try:
-                            os.makedirs(date_folder)
-                        except OSError as exception:
-                            if exception.errno != errno.EEXIST:
-                                raise
-                        
-                        vidfile = os.path.join(date_folder, '%s-%s.mp4' % (host, starttime.strftime("%Y%m%d-%H%M%S")))
-                    
-                        vidproc = Popen(['ffmpeg', '-f', 'h264', '-i', '-', '-codec', 'copy', '-r', '%i' % framerate, vidfile], stdin=PIPE)
-                    else:
-                        # Retrieve the video output pipe
-                        vidproc, vidfile, starttime = files[host] 
+                if cluster is not None and sock is cluster.subsocket:
+                    cluster.receive(sock.recv_multipart(), time.time())
+
+                elif sock in videosockets and status == zmq.POLLIN: 
+                    parts = sock.recv_multipart()
+                    if sock in relay_subscribers:
+                        parts = relay_subscribers[sock].handle(parts)
+                        if parts is None:
+                            continue
 
-                    # Write the data we received on our subscription
                     try:
-                        vidproc.stdin.write(data)
-                    except IOError as e:
-                        if e.errno == errno.EPIPE or e.errno == errno.EINVAL:
-                            # Stop loop on "Invalid pipe" or "Invalid argument".
-                            # No sense in continuing with broken pipe.
-                            break
-                        else:
-                            # Raise any other error.
-                            raise
-
-                    # If the video is now longer than the prescribed duration, we should close it and clean it.
-                    if datetime.datetime.now() > starttime + datetime.timedelta(seconds=max_duration):
-                        closeout_video(files, host)
+                        message = parse_video_message(parts)
+                    except ValueError as e:
+                        log.warning('Ignoring video message: %s', e)
+                        continue
+
+                    lost, captured = 0, None
+                    if message.stream_id is None:
+                        # The original framings send the hostname every time.
+                        host = message.host
                     else:
-                        files[host] = (vidproc, vidfile, starttime)
+                        key = (sock, message.stream_id)
+                        if key not in trackers:
+                            trackers[key] = StreamTracker()
+                        lost, captured = trackers[key].receive(message, time.time())
+                        host = trackers[key].host
+                        if host is None:
+                            # Nothing is known of the stream before its first keyframe.
+                            continue
+
+                    if host not in workers:
+                        log.info('Receiving video from %s.', host)
+                        writer = SegmentWriter(host, recording_folder, max_duration, framerate, finaliser,
+                                               preallocate_size, thumbnail_interval)
+                        workers[host] = IngestWorker(writer, ingest_queue_size)
+                        workers[host].start()
+                        feeds[host] = create_feed(workers[host], recorder_config)
+
+                    if lost:
+                        feeds[host].lost()
+                    feeds[host].put(message.payload, message.flags, captured=captured)
 
                 elif sock in eventsockets and status == zmq.POLLIN:
-                    host, event, time = sock.recv_multipart()
-                    event_data = {'host': host, 'event': event, 'time': time}
+                    try:
+                        host, event, payload = sock.recv_multipart()
+                    except ValueError as e:
+                        log.warning('Ignoring event message: %s', e)
+                        continue
+
+                    try:
+                        if event == ACTIVITY:
+                            # Too frequent for the event store, kept beside the video instead.
+                            if host in workers:
+                                workers[host].activity(decode_activity(payload))
+                            continue
+
+                        timestamp = event_time(event, payload)
+                        if timestamp is None:
+                            # Older cameras send the time of each motion event.
+                            timestamp, payload = parse_event_time(payload), None
+                    except (ValueError, struct.error) as e:
+                        log.warning('Ignoring %s event from %s: %s', event, host, e)
+                        continue
+                    event_store.add(host, event, timestamp, payload)
+
+                    trigger = feeds.get(host)
+                    if isinstance(trigger, MotionTrigger):
+                        if event == MOTION_START:
+                            trigger.motion_start()
+                        elif event == MOTION_END:
+                            trigger.motion_end()
+                        elif event == MOTION:
+                            trigger.motion()
 
-                    # Write the event data to the log file.
-                    with open(event_log, 'a+') as event_log_file:
-                        event_log_file.write((event_log_format % event_data) + '\n')
+            for relay_subscriber in relay_subscribers.itervalues():
+                relay_subscriber.tick()
 
-                else:
-                    # We've not received any data for a while, close off any files past their duration.
-                    check_all_closeout_videos(files, max_duration)
-                
-    except Exception as ex:
-        check_all_closeout_videos(files, max_duration)
-        raise
+            if time.time() >= next_stats:
+                next_stats = time.time() + stats_interval
+                log_ingest_stats(workers)
 
+    finally:
+        for relay_subscriber in relay_subscribers.itervalues():
+            relay_subscriber.close()
+        for worker in workers.itervalues():
+            worker.stop()
+        finaliser.stop()
+        thumbnails.stop()
+        playback_server.stop()
+        retention.stop()
+        event_store.stop()
+        metrics_exporter.stop()
 
-def closeout_video(files, host):
-    """Closeout the video file for the specified host.
+
+def connect_camera(context, poller, cameraip, eventport, videoport):
+    """Subscribe to a camera's event and video feeds.
     """
-    vidproc, vidfile, starttime = files[host]
-    vidproc.stdin.close()
-    vidproc.wait()
-    del files[host]
-    assert os.path.isfile(vidfile), 'FFMPEG was unable to create the MP4 output file.'
-    log.info('Closed out video file: %s', vidfile)
-    
-
-def check_all_closeout_videos(files, max_duration):
-    """Close any videos which have exceeded the max duration.
+    log.info('Connecting to camera event feed: %s:%i.', cameraip, eventport)
+    eventsocket = context.socket(zmq.SUB)
+    eventsocket.connect('tcp://%s:%s' % (cameraip, eventport))
+    eventsocket.setsockopt(zmq.SUBSCRIBE, '')
+    poller.register(eventsocket, zmq.POLLIN)
+
+    log.info('Connecting to camera video feed: %s:%i.', cameraip, videoport)
+    videosocket = context.socket(zmq.SUB)
+    videosocket.connect('tcp://%s:%s' % (cameraip, videoport))
+    videosocket.setsockopt(zmq.SUBSCRIBE, '')
+    poller.register(videosocket, zmq.POLLIN)
+    return eventsocket, videosocket
+
+
+def disconnect_camera(poller, cameraip, eventsocket, videosocket):
+    """Stop receiving a camera's feeds.
     """
-    for host, (vidproc, vidfile, starttime) in files.iteritems():
-        if datetime.datetime.now() > starttime + datetime.timedelta(seconds=max_duration):
-            closeout_video(files, host)
+    log.info('Disconnecting from camera %s.', cameraip)
+    for sock in (eventsocket, videosocket):
+        poller.unregister(sock)
+        sock.close(linger=0)
+
+
+def camera_setting(recorder_config, host, key):
+    """Look up a recorder setting, allowing it to be overridden for the
+    camera in camera_overrides.
+    """
+    return recorder_config['camera_overrides'].get(host, {}).get(key, recorder_config[key])
+
+
+def create_feed(worker, recorder_config):
+    """Create what the camera's video is fed into: the ingest worker
+    itself, or a motion trigger in front of it.
+    """
+    host = worker.writer.host
+    if not camera_setting(recorder_config, host, 'trigger_mode'):
+        return worker
+
+    log.info('Recording %s on motion only.', host)
+    return MotionTrigger(worker,
+                         camera_setting(recorder_config, host, 'pre_event_seconds'),
+                         camera_setting(recorder_config, host, 'post_event_seconds'),
+                         camera_setting(recorder_config, host, 'pre_event_max_bytes'))
+
+
+def log_ingest_stats(workers):
+    """Log the ingest counters of every camera.
+    """
+    for worker in workers.itervalues():
+        log.info('Ingest %(host)s: queue %(queue_depth)i, received %(received)i, '
+                 'dropped %(dropped_messages)i messages / %(dropped_bytes)i bytes / %(dropped_gops)i GOPs, '
+                 'write errors %(write_errors)i, write latency avg %(write_latency_avg).4fs '
+                 'max %(write_latency_max).4fs.', worker.stats())
 
 
 if __name__ == '__main__':
@@ -153,7 +336,11 @@ if __name__ == '__main__':
     ch.setFormatter(formatter)
     root.addHandler(ch)
 
+    parser = argparse.ArgumentParser(description='Recording client.')
+    parser.add_argument('--config-dir', help='folder holding the configuration files')
+    args = parser.parse_args()
+
     # Start the recorder.
-    main()
+    main(args.config_dir)
 
 
@@ -0,0 +1,109 @@
+#!/usr/bin/env python
+
+import os
+import struct
+import datetime
+import numpy as np
+
+from data.events import ACTIVITY_GRID
+from keyframeindex import SEGMENT_NAME
+
+# Each record is the start time and length of a period, the frames
+# analysed, the peak block count and the activity of each grid cell.
+ACTIVITY_RECORD = struct.Struct('<dfHH%iB' % (ACTIVITY_GRID * ACTIVITY_GRID))
+
+ACTIVITY_DTYPE = np.dtype([('time', '<f8'),
+                           ('duration', '<f4'),
+                           ('frames', '<u2'),
+                           ('peak_blocks', '<u2'),
+                           ('grid', 'u1', (ACTIVITY_GRID, ACTIVITY_GRID))])
+
+
+def activity_path(segment_path):
+    """Returns the sidecar activity file for a segment file."""
+    return os.path.splitext(segment_path)[0] + '.act'
+
+
+def pack_activity(summary):
+    """Returns the activity file record for an ActivitySummary."""
+    return ACTIVITY_RECORD.pack(summary.start, summary.duration, summary.frames,
+                                summary.peak_blocks, *summary.grid)
+
+
+def read_activity(path):
+    """Returns the records of an activity file as a read only array,
+    mapped rather than read into memory."""
+    count = os.path.getsize(path) // ACTIVITY_DTYPE.itemsize
+    if not count:
+        return np.zeros(0, dtype=ACTIVITY_DTYPE)
+    return np.memmap(path, dtype=ACTIVITY_DTYPE, mode='r', shape=(count,))
+
+
+def region_cells(region, resolution, grid=ACTIVITY_GRID):
+    """Returns the (first row, first column, end row, end column) of the
+    grid cells overlapping a region given as [x, y, width, height] in
+    pixels of a frame of the given (width, height)."""
+    x, y, width, height = region
+    frame_width, frame_height = resolution
+    return (max(0, y * grid // frame_height), max(0, x * grid // frame_width),
+            min(grid, -(-(y + height) * grid // frame_height)), min(grid, -(-(x + width) * grid // frame_width)))
+
+
+def find_activity(recording_folder, host, start, end):
+    """Returns the activity files of host's segments which may hold
+    records between start and end, in seconds since the epoch."""
+    paths = []
+    day = datetime.date.fromtimestamp(start) - datetime.timedelta(days=1)
+    last_day = datetime.date.fromtimestamp(end)
+    while day <= last_day:
+        date_folder = os.path.join(recording_folder, day.isoformat())
+        day += datetime.timedelta(days=1)
+        if not os.path.isdir(date_folder):
+            continue
+
+        for name in os.listdir(date_folder):
+            match = SEGMENT_NAME.match(name)
+            if match and match.group('host') == host:
+                path = activity_path(os.path.join(date_folder, name))
+                if os.path.exists(path):
+                    paths.append(path)
+    return sorted(paths)
+
+
+def activity_ranges(recording_folder, host, start, end, threshold, cells=None, min_gap=0):
+    """Returns (start, end, peak) for each stretch of time between start
+    and end in which the activity in the grid cells, as given by
+    region_cells(), was over threshold, between 0 and 1.  Stretches less
+    than min_gap seconds apart are joined.  Peak is the highest activity
+    of the stretch."""
+    row0, col0, row1, col1 = cells or (0, 0, ACTIVITY_GRID, ACTIVITY_GRID)
+    limit = threshold * 255
+    times = []
+    ends = []
+    scores = []
+    for path in find_activity(recording_folder, host, start, end):
+        records = read_activity(path)
+        records = records[(records['time'] + records['duration'] > start) & (records['time'] < end)]
+        if not len(records):
+            continue
+        score = records['grid'][:, row0:row1, col0:col1].reshape(len(records), -1).max(axis=1)
+        active = score > limit
+        times.append(records['time'][active])
+        ends.append(records['time'][active] + records['duration'][active])
+        scores.append(score[active])
+
+    if not times:
+        return []
+    times = np.concatenate(times)
+    ends = np.concatenate(ends)
+    scores = np.concatenate(scores)
+    if not len(times):
+        return []
+    order = np.argsort(times, kind='mergesort')
+    times, ends, scores = times[order], ends[order], scores[order]
+
+    # A stretch starts wherever a period begins after all those before it have ended.
+    finished = np.maximum.accumulate(ends)
+    first = np.flatnonzero(np.concatenate([[True], times[1:] > finished[:-1] + min_gap]))
+    return [(float(range_start), float(range_end), peak / 255.0) for range_start, range_end, peak in
+            zip(times[first], np.maximum.reduceat(ends, first), np.maximum.reduceat(scores, first))]
@@ -0,0 +1,136 @@
+#!/usr/bin/env python
+
+import time
+import bisect
+import hashlib
+import logging
+
+from metrics.registry import gauge
+
+log = logging.getLogger(__name__)
+
+HEARTBEAT = b'HEARTBEAT'
+
+# A recorder is joining while it listens for the others, and active
+# once it records its share of the cameras.
+JOINING = b'joining'
+ACTIVE = b'active'
+
+
+def hash_key(text):
+    return int(hashlib.md5(text).hexdigest()[:16], 16)
+
+
+class HashRing(object):
+    """Consistent hashing of keys onto nodes.  Each node is placed at
+    replicas points around the ring and a key belongs to the node at the
+    next point after its own hash, so adding or removing a node only
+    moves the keys of that node."""
+
+    def __init__(self, nodes, replicas=100):
+        points = sorted((hash_key('%s#%i' % (node, i)), node) for node in nodes for i in range(replicas))
+        self.hashes = [point for point, node in points]
+        self.nodes = [node for point, node in points]
+
+    def owner(self, key):
+        if not self.nodes:
+            return None
+        return self.nodes[bisect.bisect(self.hashes, hash_key(key)) % len(self.nodes)]
+
+
+class ClusterMembership(object):
+    """Shares the cameras out between the recorders of a cluster.
+
+    Every recorder publishes a heartbeat every interval seconds on its
+    pubsocket, and hears the others' on subsocket.  Recorders heard from
+    within timeout seconds, and this one, are placed on a HashRing and
+    each records the cameras which hash to it.  When a recorder stops,
+    its cameras move to the survivors once timeout has passed; when one
+    is added it takes a share from each of the others.
+
+    A recorder spends its first timeout seconds joining: it listens
+    without recording, and the others leave it out of the ring, so it
+    never claims cameras before knowing who else is there.  Once it
+    announces itself active the others hand over its cameras, so a
+    camera is only ever recorded twice for about one heartbeat.
+
+    The cameras this recorder should be recording are kept in assigned.
+    update() is cheap enough to call on every wake up, as they are only
+    worked out again when a recorder joins or leaves, which is checked
+    for on each heartbeat, or when this one finishes joining.
+    """
+
+    def __init__(self, name, pubsocket, subsocket, cameras, interval=1.0, timeout=3.0, now=None):
+        self.name = name
+        self.pubsocket = pubsocket
+        self.subsocket = subsocket
+        self.cameras = cameras
+        self.interval = interval
+        self.timeout = timeout
+        now = time.time() if now is None else now
+        self.joined_at = now + timeout
+        self.next_heartbeat = now
+        self.last_seen = {}
+        self.members = None
+        self.ring = HashRing([])
+        self.assigned = set()
+        # Set when the members may have changed since they were placed.
+        self.stale = True
+        gauge('cluster_members').set_function(lambda: len(self.members or []))
+
+    @property
+    def state(self):
+        return JOINING if self.members is None else ACTIVE
+
+    def update(self, now):
+        """Sends a heartbeat when one is due and works out the cameras
+        to record again if the cluster has changed.  Returns True if
+        assigned has changed."""
+        if now < self.next_heartbeat:
+            return self.reassign(now)
+
+        self.expire(now)
+        changed = self.reassign(now)
+        self.next_heartbeat = now + self.interval
+        self.pubsocket.send_multipart([HEARTBEAT, self.name, self.state])
+        return changed
+
+    def receive(self, parts, now):
+        """Handles a message received on the heartbeat socket."""
+        if len(parts) != 3 or parts[0] != HEARTBEAT:
+            return
+        name, state = parts[1:]
+        if name == self.name:
+            return
+        if state == ACTIVE:
+            if name not in self.last_seen:
+                self.stale = True
+            self.last_seen[name] = now
+        elif self.last_seen.pop(name, None) is not None:
+            self.stale = True
+
+    def expire(self, now):
+        """Forgets the recorders not heard from within timeout."""
+        for name, seen in list(self.last_seen.items()):
+            if now > seen + self.timeout:
+                del self.last_seen[name]
+                self.stale = True
+
+    def reassign(self, now):
+        if not self.stale or now < self.joined_at:
+            return False
+        self.stale = False
+
+        members = sorted([self.name] + list(self.last_seen))
+        if members == self.members:
+            return False
+        log.info('Recorders in the cluster: %s.', ', '.join(members))
+        self.members = members
+        self.ring = HashRing(members)
+        # Tell the others straight away.
+        self.next_heartbeat = now
+
+        assigned = set(camera for camera in self.cameras if self.ring.owner(camera) == self.name)
+        changed = assigned != self.assigned
+        self.assigned = assigned
+        return changed
@@ -0,0 +1,71 @@
+#!/usr/bin/env python
+
+import os
+import ctypes
+import ctypes.util
+import logging
+import platform
+
+log = logging.getLogger(__name__)
+
+# ioprio_set is not wrapped by libc, so it is called by syscall number.
+IOPRIO_SET_SYSCALLS = {'x86_64': 251, 'i386': 289, 'i686': 289, 'armv6l': 314, 'armv7l': 314, 'aarch64': 30}
+IOPRIO_WHO_PROCESS = 1
+IOPRIO_CLASS_IDLE = 3
+IOPRIO_CLASS_SHIFT = 13
+
+# Reserve the space without changing the file's size.
+FALLOC_FL_KEEP_SIZE = 0x01
+
+_libc = None
+
+
+def libc():
+    global _libc
+    if _libc is None:
+        _libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+    return _libc
+
+
+def set_idle_io_priority():
+    """Puts the calling thread in the idle I/O scheduling class, so its
+    disk access only gets time the rest of the system leaves unused.
+    Returns False if this is not possible here."""
+    number = IOPRIO_SET_SYSCALLS.get(platform.machine())
+    if number is None:
+        log.warning('Unable to set I/O priority on %s.', platform.machine())
+        return False
+
+    # A pid of 0 is the calling thread.
+    if libc().syscall(number, IOPRIO_WHO_PROCESS, 0, IOPRIO_CLASS_IDLE << IOPRIO_CLASS_SHIFT) != 0:
+        log.warning('Unable to set I/O priority: %s', os.strerror(ctypes.get_errno()))
+        return False
+    return True
+
+
+def preallocate(f, size):
+    """Reserves size bytes of disk for an open file, keeping its apparent
+    size, so that it is laid out contiguously as it is written.  Returns
+    False if the filesystem does not support this."""
+    result = libc().fallocate64(f.fileno(), FALLOC_FL_KEEP_SIZE,
+                                ctypes.c_int64(0), ctypes.c_int64(size))
+    if result != 0:
+        log.debug('Unable to preallocate %i bytes: %s', size, os.strerror(ctypes.get_errno()))
+        return False
+    return True
+
+
+def pread(fd, size, offset):
+    """Reads up to size bytes at offset in a file descriptor, without
+    moving its file position."""
+    if hasattr(os, 'pread'):
+        return os.pread(fd, size, offset)
+
+    pread64 = libc().pread64
+    pread64.restype = ctypes.c_ssize_t
+    buf = ctypes.create_string_buffer(size)
+    count = pread64(fd, buf, ctypes.c_size_t(size), ctypes.c_int64(offset))
+    if count < 0:
+        error = ctypes.get_errno()
+        raise OSError(error, os.strerror(error))
+    return buf.raw[:count]
@@ -0,0 +1,130 @@
+#!/usr/bin/env python
+
+import os
+import time
+import sqlite3
+import logging
+import datetime
+import threading
+import Queue
+
+log = logging.getLogger(__name__)
+
+SCHEMA = ('CREATE TABLE IF NOT EXISTS events ('
+          'time REAL NOT NULL, host TEXT NOT NULL, event TEXT NOT NULL, data BLOB)')
+INDEX = 'CREATE INDEX IF NOT EXISTS events_host_time ON events (host, time)'
+
+
+def parse_event_time(text):
+    """Converts an isoformat timestamp, as sent by the cameras, into
+    seconds since the epoch."""
+    fmt = '%Y-%m-%dT%H:%M:%S.%f' if '.' in text else '%Y-%m-%dT%H:%M:%S'
+    moment = datetime.datetime.strptime(text, fmt)
+    return time.mktime(moment.timetuple()) + moment.microsecond / 1e6
+
+
+def parse_time(text):
+    """Converts an ISO date, or date and time to the minute or second,
+    into seconds since the epoch.  Raises ValueError if it is not one."""
+    for fmt in ('%Y-%m-%dT%H:%M:%S', '%Y-%m-%dT%H:%M', '%Y-%m-%d'):
+        try:
+            return time.mktime(datetime.datetime.strptime(text, fmt).timetuple())
+        except ValueError:
+            pass
+    raise ValueError('Invalid time: %s' % text)
+
+
+def connect(filename):
+    """Opens the event database, creating the table and index if needed."""
+    connection = sqlite3.connect(filename)
+    connection.execute('PRAGMA journal_mode=WAL')
+    connection.execute('PRAGMA synchronous=NORMAL')
+    connection.execute(SCHEMA)
+    connection.execute(INDEX)
+    connection.commit()
+    return connection
+
+
+def query(filename, host, start, end):
+    """Returns (time, host, event, data) for every event from host with
+    start <= time < end, oldest first."""
+    connection = connect(filename)
+    try:
+        return connection.execute('SELECT time, host, event, data FROM events '
+                                  'WHERE host = ? AND time >= ? AND time < ? ORDER BY time',
+                                  (host, start, end)).fetchall()
+    finally:
+        connection.close()
+
+
+class EventStore(threading.Thread):
+    """Background writer which batches camera events into a time indexed
+    SQLite database, committing every flush_interval seconds.
+
+    If text_log is given each event is also appended to that file using
+    text_format, buffered and synced on the same schedule.
+    """
+
+    def __init__(self, filename, flush_interval=5.0, text_log=None, text_format=None):
+        super(EventStore, self).__init__(name='event-store')
+        self.daemon = True
+        self.filename = filename
+        self.flush_interval = flush_interval
+        self.text_log = text_log
+        self.text_format = text_format
+        self.queue = Queue.Queue()
+
+    def add(self, host, event, timestamp, data=None):
+        """Queues an event, timestamp being seconds since the epoch."""
+        self.queue.put((timestamp, host, event, data))
+
+    def stop(self):
+        self.queue.put(None)
+        self.join()
+
+    def run(self):
+        connection = connect(self.filename)
+        text_file = open(self.text_log, 'a') if self.text_log else None
+        log.info('Storing events in %s.', self.filename)
+
+        pending = []
+        running = True
+        next_flush = time.time() + self.flush_interval
+        while running:
+            try:
+                item = self.queue.get(timeout=max(next_flush - time.time(), 0))
+                if item is None:
+                    running = False
+                else:
+                    pending.append(item)
+            except Queue.Empty:
+                pass
+
+            if pending and (not running or time.time() >= next_flush):
+                self.flush(connection, text_file, pending)
+                pending = []
+            if time.time() >= next_flush:
+                next_flush = time.time() + self.flush_interval
+
+        connection.close()
+        if text_file is not None:
+            text_file.close()
+
+    def flush(self, connection, text_file, events):
+        try:
+            connection.executemany('INSERT INTO events (time, host, event, data) VALUES (?, ?, ?, ?)',
+                                   [(timestamp, host, event, None if data is None else sqlite3.Binary(data))
+                                    for timestamp, host, event, data in events])
+            connection.commit()
+        except sqlite3.Error as e:
+            log.error('Unable to store %i events: %s', len(events), e)
+
+        if text_file is not None:
+            try:
+                for timestamp, host, event, data in events:
+                    event_time = datetime.datetime.fromtimestamp(timestamp).isoformat()
+                    text_file.write((self.text_format % {'host': host, 'event': event, 'time': event_time}) + '\n')
+                text_file.flush()
+                os.fsync(text_file.fileno())
+            except (IOError, OSError) as e:
+                log.error('Unable to write events to %s: %s', self.text_log, e)
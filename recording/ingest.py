@@ -0,0 +1,198 @@
+#!/usr/bin/env python
+
+import time
+import logging
+import threading
+import Queue
+
+from data.framing import is_gop_start
+from metrics.registry import counter, gauge, histogram
+
+log = logging.getLogger(__name__)
+
+# Control entries for the ingest queue.
+CLOSE = 'close'
+STOP = 'stop'
+ACTIVITY = 'activity'
+
+
+class IngestWorker(threading.Thread):
+    """Writes one camera's video through its SegmentWriter on a thread of
+    its own, fed from a bounded queue by the recorder's poll loop.
+
+    When the queue is full the rest of the current GOP is dropped and
+    queueing resumes at the next keyframe, so a slow disk costs whole
+    GOPs rather than leaving undecodable holes mid-GOP.  A failed write
+    only affects this camera: the segment is abandoned and recording
+    resumes at the next keyframe, as it does after any other error.  The same happens after lost(), when
+    messages have been lost before reaching the recorder.
+
+    Each message may carry its capture time, which is used in place of
+    its arrival time to timestamp the video.
+    """
+
+    def __init__(self, writer, max_queue=256, idle_timeout=5):
+        super(IngestWorker, self).__init__(name='ingest-%s' % writer.host)
+        self.daemon = True
+        self.writer = writer
+        self.queue = Queue.Queue(max_queue)
+        self.idle_timeout = idle_timeout
+        self.dropping = False
+        self.resyncing = False
+        self.close_pending = False
+
+        host = writer.host
+        self.received = counter('ingest_received_total', camera=host)
+        self.dropped_messages = counter('ingest_dropped_messages_total', camera=host)
+        self.dropped_bytes = counter('ingest_dropped_bytes_total', camera=host)
+        self.dropped_gops = counter('ingest_dropped_gops_total', camera=host)
+        self.write_errors = counter('ingest_write_errors_total', camera=host)
+        self.write_latency = histogram('ingest_write_seconds', camera=host)
+        self.write_time_max = 0.0
+        gauge('ingest_queue_depth', camera=host).set_function(self.queue.qsize)
+
+    def put(self, data, flags=None, received=None, captured=None):
+        """Queues a message payload from the video feed, without blocking."""
+        received = time.time() if received is None else received
+        self.received.inc()
+        if self.close_pending:
+            self.close_segment()
+        resumed = False
+        if self.dropping or self.resyncing:
+            if not is_gop_start(data, flags):
+                if self.dropping:
+                    self.dropped_messages.inc()
+                    self.dropped_bytes.inc(len(data))
+                return
+            resumed = True
+            self.resyncing = False
+
+        try:
+            self.queue.put_nowait((data, flags, received, captured, resumed))
+            self.dropping = False
+        except Queue.Full:
+            if not self.dropping:
+                log.warning('Ingest queue for %s is full, dropping to the next keyframe.', self.writer.host)
+                self.dropped_gops.inc()
+            self.dropping = True
+            self.dropped_messages.inc()
+            self.dropped_bytes.inc(len(data))
+
+    def lost(self):
+        """Skips to the next keyframe after messages have been lost."""
+        self.resyncing = True
+
+    def put_batch(self, messages):
+        """Queues a list of (data, flags, received, captured) messages,
+        which must start on a keyframe, as a single entry."""
+        if not messages:
+            return
+
+        if self.close_pending:
+            self.close_segment()
+
+        try:
+            self.queue.put_nowait(messages)
+            self.dropping = False
+        except Queue.Full:
+            log.warning('Ingest queue for %s is full, dropping %i buffered messages.',
+                        self.writer.host, len(messages))
+            self.dropping = True
+            self.dropped_gops.inc()
+            self.dropped_messages.inc(len(messages))
+            self.dropped_bytes.inc(sum(len(message[0]) for message in messages))
+
+    def activity(self, summary):
+        """Queues a summary of the camera's motion activity to be kept
+        beside the open segment.  It is dropped if the queue is full."""
+        try:
+            self.queue.put_nowait((ACTIVITY, summary))
+        except Queue.Full:
+            pass
+
+    def close_segment(self):
+        """Asks the worker to close the open segment once it has written
+        everything queued so far.  If the queue is full the request is
+        queued ahead of the next message instead."""
+        try:
+            self.queue.put_nowait(CLOSE)
+            self.close_pending = False
+        except Queue.Full:
+            self.close_pending = True
+
+    def stop(self):
+        self.queue.put(STOP)
+        self.join()
+
+    def stats(self):
+        """Returns a snapshot of the worker's counters."""
+        write_latency = self.write_latency
+        return {'host': self.writer.host,
+                'queue_depth': self.queue.qsize(),
+                'received': self.received.value,
+                'dropped_messages': self.dropped_messages.value,
+                'dropped_bytes': self.dropped_bytes.value,
+                'dropped_gops': self.dropped_gops.value,
+                'write_errors': self.write_errors.value,
+                'write_latency_avg': write_latency.sum / write_latency.count if write_latency.count else 0.0,
+                'write_latency_max': self.write_time_max}
+
+    def run(self):
+        while True:
+            try:
+                item = self.queue.get(timeout=self.idle_timeout)
+            except Queue.Empty:
+                item = None
+
+            if item is STOP:
+                break
+            try:
+                self.handle(item)
+            except Exception:
+                # Anything else is a bug, or data the writer cannot make
+                # sense of, so start again rather than stop recording.
+                log.exception('Unable to record video for %s, resuming at the next keyframe.', self.writer.host)
+                self.write_errors.inc()
+                self.writer.abandon()
+
+        self.writer.close()
+
+    def handle(self, item):
+        if item is None:
+            # Nothing from the camera for a while, close off the file if it is past its duration.
+            if self.writer.expired():
+                self.writer.close()
+        elif item is CLOSE:
+            self.writer.close()
+        elif item[0] is ACTIVITY:
+            self.write_activity(item[1])
+        elif isinstance(item, list):
+            self.writer.discontinuity()
+            for data, flags, received, captured in item:
+                self.write(data, flags, received, captured)
+        else:
+            data, flags, received, captured, resumed = item
+            if resumed:
+                # Messages were dropped ahead of this one.
+                self.writer.discontinuity()
+            self.write(data, flags, received, captured)
+
+    def write_activity(self, summary):
+        try:
+            self.writer.write_activity(summary)
+        except (IOError, OSError) as e:
+            log.error('Unable to write activity for %s: %s', self.writer.host, e)
+            self.write_errors.inc()
+
+    def write(self, data, flags, received, captured):
+        start = time.time()
+        try:
+            self.writer.write(data, flags, received, captured)
+        except (IOError, OSError) as e:
+            log.error('Unable to write video for %s: %s', self.writer.host, e)
+            self.write_errors.inc()
+            self.writer.abandon()
+
+        elapsed = time.time() - start
+        self.write_latency.observe(elapsed)
+        self.write_time_max = max(self.write_time_max, elapsed)
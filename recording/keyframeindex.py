@@ -0,0 +1,116 @@
+#!/usr/bin/env python
+
+import os
+import re
+import struct
+import datetime
+
+# Each record is the wall clock time, byte offset and flags of an entry.
+INDEX_RECORD = struct.Struct('<dQI')
+
+KEYFRAME = 0x01   # A keyframe, with the PAT and PMT, starts at offset.
+END = 0x02        # Offset is the end of the completed segment.
+
+# Segments started within the same second as another are given a counter.
+SEGMENT_NAME = re.compile(r'^(?P<host>.+)-(?P<start>\d{8}-\d{6})(?:-\d+)?\.ts$')
+
+
+def index_path(segment_path):
+    """Returns the sidecar index file for a segment file."""
+    return os.path.splitext(segment_path)[0] + '.idx'
+
+
+def read_index(path):
+    """Returns the (time, offset, flags) records of an index file."""
+    with open(path, 'rb') as index_file:
+        data = index_file.read()
+    count = len(data) // INDEX_RECORD.size
+    return [INDEX_RECORD.unpack_from(data, i * INDEX_RECORD.size) for i in range(count)]
+
+
+def find_segments(recording_folder, host, start, end):
+    """Returns (segment_path, records) for each indexed segment of host
+    which overlaps the times start to end, in seconds since the epoch,
+    in time order."""
+    segments = []
+    day = datetime.date.fromtimestamp(start) - datetime.timedelta(days=1)
+    last_day = datetime.date.fromtimestamp(end)
+    while day <= last_day:
+        date_folder = os.path.join(recording_folder, day.isoformat())
+        day += datetime.timedelta(days=1)
+        if not os.path.isdir(date_folder):
+            continue
+
+        for name in os.listdir(date_folder):
+            match = SEGMENT_NAME.match(name)
+            if not match or match.group('host') != host:
+                continue
+
+            path = os.path.join(date_folder, name)
+            if not os.path.exists(index_path(path)):
+                continue
+
+            records = read_index(index_path(path))
+            if not records or records[0][0] >= end:
+                continue
+
+            segments.append((records[0][0], path, records))
+
+    segments.sort()
+
+    covering = []
+    for i, (segment_start, path, records) in enumerate(segments):
+        if records[-1][2] & END:
+            segment_end = records[-1][0]
+        elif i + 1 < len(segments):
+            segment_end = segments[i + 1][0]
+        else:
+            # Still being recorded, or cut short.
+            segment_end = float('inf')
+
+        if segment_end > start:
+            covering.append((path, records))
+    return covering
+
+
+def clip_ranges(recording_folder, host, start, end):
+    """Returns (segment_path, first_byte, end_byte) ranges which hold the
+    video of host from the last keyframe at or before start to the first
+    keyframe at or after end.  end_byte is None where the range runs to
+    the end of the file."""
+    ranges = []
+    for path, records in find_segments(recording_folder, host, start, end):
+        keyframes = [(time, offset) for time, offset, flags in records if flags & KEYFRAME]
+        if not keyframes:
+            continue
+
+        first_byte = keyframes[0][1]
+        for time, offset in keyframes:
+            if time > start:
+                break
+            first_byte = offset
+
+        end_byte = None
+        for time, offset in keyframes:
+            if time >= end:
+                end_byte = offset
+                break
+
+        if end_byte is None or end_byte > first_byte:
+            ranges.append((path, first_byte, end_byte))
+    return ranges
+
+
+def write_clip(ranges, output, blocksize=65536):
+    """Copies the byte ranges from clip_ranges() to the file object output."""
+    for path, first_byte, end_byte in ranges:
+        with open(path, 'rb') as segment_file:
+            segment_file.seek(first_byte)
+            remaining = None if end_byte is None else end_byte - first_byte
+            while remaining is None or remaining > 0:
+                data = segment_file.read(blocksize if remaining is None else min(blocksize, remaining))
+                if not data:
+                    break
+                output.write(data)
+                if remaining is not None:
+                    remaining -= len(data)
@@ -0,0 +1,146 @@
+#!/usr/bin/env python
+
+import struct
+
+from data.h264 import nal_type, NAL_AUD
+
+PACKET_SIZE = 188
+PAYLOAD_SIZE = 184
+
+PAT_PID = 0x0000
+PMT_PID = 0x1000
+VIDEO_PID = 0x0100
+
+STREAM_TYPE_H264 = 0x1b
+CLOCK_RATE = 90000
+
+ACCESS_UNIT_DELIMITER = b'\x00\x00\x00\x01\x09\xf0'
+
+
+def _crc32_table():
+    table = []
+    for byte in range(256):
+        crc = byte << 24
+        for _ in range(8):
+            crc = ((crc << 1) ^ 0x04c11db7) if crc & 0x80000000 else (crc << 1)
+        table.append(crc & 0xffffffff)
+    return table
+
+_CRC32_TABLE = _crc32_table()
+
+
+def crc32_mpeg(data):
+    """Returns the MPEG-2 CRC32 of data, as used by PSI sections."""
+    crc = 0xffffffff
+    for byte in bytearray(data):
+        crc = ((crc << 8) & 0xffffffff) ^ _CRC32_TABLE[((crc >> 24) ^ byte) & 0xff]
+    return crc
+
+
+def encode_timestamp(prefix, timestamp):
+    """Encodes a 33 bit PES timestamp with its four bit prefix."""
+    timestamp &= 0x1ffffffff
+    return struct.pack('>BHH',
+                       (prefix << 4) | ((timestamp >> 29) & 0x0e) | 1,
+                       ((timestamp >> 14) & 0xfffe) | 1,
+                       ((timestamp << 1) & 0xfffe) | 1)
+
+
+def encode_pcr(pcr):
+    """Encodes a 33 bit program clock reference base with no extension."""
+    pcr &= 0x1ffffffff
+    return struct.pack('>IH', pcr >> 1, ((pcr & 1) << 15) | 0x7e00)
+
+
+def _psi_packet(pid, section):
+    section += struct.pack('>I', crc32_mpeg(section))
+    payload = b'\x00' + section
+    header = struct.pack('>BHB', 0x47, 0x4000 | pid, 0x10)
+    return header + payload + b'\xff' * (PAYLOAD_SIZE - len(payload))
+
+
+def _pat_section():
+    return struct.pack('>BHHBBBHH', 0x00, 0xb000 | 13, 1, 0xc1, 0, 0, 1, 0xe000 | PMT_PID)
+
+
+def _pmt_section():
+    return struct.pack('>BHHBBBHHBHH', 0x02, 0xb000 | 18, 1, 0xc1, 0, 0,
+                       0xe000 | VIDEO_PID, 0xf000,
+                       STREAM_TYPE_H264, 0xe000 | VIDEO_PID, 0xf000)
+
+PAT_PACKET = _psi_packet(PAT_PID, _pat_section())
+PMT_PACKET = _psi_packet(PMT_PID, _pmt_section())
+
+
+class TsMuxer(object):
+    """Packs H.264 access units into a single program MPEG transport stream.
+
+    The Pi's encoder produces no B frames, so every access unit is given
+    a PTS only (DTS equal to PTS) and the PCR is carried on the video PID
+    a fixed delay ahead of it.  The PAT and PMT are repeated before every
+    keyframe so that the stream can be read from any keyframe onwards.
+    """
+
+    PCR_DELAY = CLOCK_RATE // 10
+
+    def __init__(self):
+        self.continuity = {PAT_PID: 0, PMT_PID: 0, VIDEO_PID: 0}
+
+    def _psi(self, packet, pid):
+        cc = self.continuity[pid]
+        self.continuity[pid] = (cc + 1) & 0x0f
+        return packet[:3] + struct.pack('B', 0x10 | cc) + packet[4:]
+
+    def tables(self):
+        """Returns a PAT and PMT packet."""
+        return self._psi(PAT_PACKET, PAT_PID) + self._psi(PMT_PACKET, PMT_PID)
+
+    def mux(self, units, pts, keyframe):
+        """Returns the transport packets carrying one access unit, given
+        as a list of NAL units, with the 90kHz timestamp pts."""
+        out = bytearray()
+        if keyframe:
+            out += self.tables()
+
+        payload = bytearray(b'\x00\x00\x01\xe0\x00\x00\x80\x80\x05')
+        payload += encode_timestamp(0x2, pts)
+        if nal_type(units[0]) != NAL_AUD:
+            payload += ACCESS_UNIT_DELIMITER
+        for unit in units:
+            payload += unit
+        payload = memoryview(payload)
+
+        cc = self.continuity[VIDEO_PID]
+        pos = 0
+        first = True
+        while pos < len(payload):
+            adaptation = b''
+            if first:
+                flags = 0x10 | (0x40 if keyframe else 0)
+                adaptation = struct.pack('B', flags) + encode_pcr(pts - self.PCR_DELAY)
+
+            room = PAYLOAD_SIZE - (len(adaptation) + 1 if adaptation else 0)
+            remaining = len(payload) - pos
+            if remaining < room:
+                # Stuff the adaptation field so the packet is full.
+                stuffing = room - remaining
+                if not adaptation:
+                    adaptation = b'\x00' + b'\xff' * (stuffing - 2) if stuffing > 1 else b''
+                    room = PAYLOAD_SIZE - (len(adaptation) + 1)
+                else:
+                    adaptation += b'\xff' * stuffing
+                    room = remaining
+
+            header = struct.pack('>BHB', 0x47, (0x4000 if first else 0) | VIDEO_PID,
+                                 (0x30 if room < PAYLOAD_SIZE else 0x10) | cc)
+            out += header
+            if room < PAYLOAD_SIZE:
+                out += struct.pack('B', len(adaptation))
+                out += adaptation
+            out += payload[pos:pos + room]
+            pos += room
+            cc = (cc + 1) & 0x0f
+            first = False
+
+        self.continuity[VIDEO_PID] = cc
+        return bytes(out)
@@ -0,0 +1,257 @@
+#!/usr/bin/env python
+
+import os
+import zmq
+import time
+import struct
+import logging
+import threading
+
+from keyframeindex import clip_ranges
+from diskio import pread
+from metrics.registry import counter, gauge, histogram
+
+log = logging.getLogger(__name__)
+
+# Playback id, offset of the chunk in the stream and flags.
+PLAYBACK_HEADER = struct.Struct('!IQB')
+
+END = 0x01          # The last chunk of the stream, which may be empty.
+NOT_FOUND = 0x02    # Nothing was recorded for the time asked for.
+BUSY = 0x04         # The recorder is already serving as many streams as it can.
+FAILED = 0x08       # The recording could not be read.
+
+
+class Playback(object):
+    """A stream of recorded video being sent to one viewer, read from
+    the byte ranges of one or more segment files."""
+
+    def __init__(self, address, playback_id, ranges, credit, now):
+        self.address = address
+        self.playback_id = playback_id
+        self.ranges = list(ranges)
+        self.credit = credit
+        self.last_seen = now
+        self.offset = 0
+        self.fd = None
+        self.position = 0
+        self.end = None
+
+    def read(self, size):
+        """Returns up to size bytes of the stream, or None at its end."""
+        while True:
+            if self.fd is None:
+                if not self.ranges:
+                    return None
+                path, self.position, self.end = self.ranges.pop(0)
+                self.fd = os.open(path, os.O_RDONLY)
+
+            if self.end is not None:
+                size = min(size, self.end - self.position)
+            data = pread(self.fd, size, self.position) if size > 0 else b''
+            if data:
+                self.position += len(data)
+                self.offset += len(data)
+                return data
+            self.close()
+
+    def close(self):
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+
+
+class PlaybackServer(threading.Thread):
+    """Serves recorded video from the recording folder on a ROUTER socket
+    bound to port, on a thread of its own.
+
+    Viewers use PlaybackClient: 'PLAY <id> <host> <start> <duration>
+    <credit>' asks for the video of camera host from start, in seconds
+    since the epoch, for duration seconds.  It is sent as [header, chunk]
+    messages holding the segment files' bytes from the keyframe at or
+    before start, as found from their keyframe indexes, so the chunks
+    joined are an MPEG-TS stream.  The header holds the playback id, the
+    offset of the chunk in the stream and flags, END on the last chunk
+    along with NOT_FOUND, BUSY or FAILED if there is a problem.
+
+    At most credit chunks of chunk_size bytes are sent ahead of the
+    viewer, and 'CREDIT <id> <n>' lets n more be sent, so no more than
+    that is ever read ahead for a stream.  Chunks are read as they are
+    sent with pread(), keeping one file open per stream.  'STOP <id>'
+    ends a stream early, and streams which have not been given credit
+    for timeout seconds are dropped.  No more than max_streams are
+    served at once, and no viewer is given more than max_credit chunks
+    ahead, whatever it asks for, so one stream cannot hold up the rest.
+    """
+
+    def __init__(self, context, recording_folder, port, bind_address='*', chunk_size=65536,
+                 max_streams=16, timeout=30, max_credit=32):
+        super(PlaybackServer, self).__init__(name='playback')
+        self.daemon = True
+        self.context = context
+        self.recording_folder = recording_folder
+        self.port = port
+        self.bind_address = bind_address
+        self.chunk_size = chunk_size
+        self.max_streams = max_streams
+        self.timeout = timeout
+        self.max_credit = max_credit
+        self.playbacks = {}
+        self.stopping = threading.Event()
+        self.requests = counter('playback_requests_total')
+        self.sent_bytes = counter('playback_sent_bytes_total')
+        self.read_time = histogram('playback_read_seconds')
+        gauge('playback_streams').set_function(lambda: len(self.playbacks))
+
+    def stop(self):
+        self.stopping.set()
+        self.join()
+
+    def run(self):
+        log.info('Binding playback router socket to port %i.', self.port)
+        self.socket = self.context.socket(zmq.ROUTER)
+        self.socket.setsockopt(zmq.LINGER, 0)
+        self.socket.bind('tcp://%s:%s' % (self.bind_address, self.port))
+        next_expire = time.time() + 1
+
+        try:
+            while not self.stopping.is_set():
+                if self.socket.poll(1000):
+                    parts = self.socket.recv_multipart()
+                    if len(parts) == 2:
+                        try:
+                            self.handle(parts[0], parts[1].split(' '), time.time())
+                        except (IndexError, ValueError) as e:
+                            log.warning('Ignoring malformed playback request from %r: %s', parts[0], e)
+                    else:
+                        log.warning('Ignoring malformed playback request of %i parts.', len(parts))
+
+                now = time.time()
+                if now >= next_expire:
+                    next_expire = now + 1
+                    self.expire(now)
+        finally:
+            for playback in self.playbacks.values():
+                playback.close()
+            self.socket.close()
+
+    def handle(self, address, req, now):
+        if req[0] == 'PLAY':
+            playback_id, host = int(req[1]), req[2]
+            start, duration, credit = float(req[3]), float(req[4]), int(req[5])
+            self.requests.inc()
+            self.remove((address, playback_id))
+            if len(self.playbacks) >= self.max_streams:
+                log.warning('Already serving %i streams, turning down %r.', len(self.playbacks), address)
+                self.send_end(address, playback_id, 0, BUSY)
+                return
+
+            ranges = clip_ranges(self.recording_folder, host, start, start + duration)
+            if not ranges:
+                log.info('No recordings of %s to play back for %r.', host, address)
+                self.send_end(address, playback_id, 0, NOT_FOUND)
+                return
+
+            log.info('Playing back %s from %s for %gs to %r.', host,
+                     time.strftime('%Y-%m-%dT%H:%M:%S', time.localtime(start)), duration, address)
+            playback = Playback(address, playback_id, ranges, self.clamp_credit(credit), now)
+            self.playbacks[(address, playback_id)] = playback
+            self.send(playback)
+
+        elif req[0] == 'CREDIT':
+            playback = self.playbacks.get((address, int(req[1])))
+            if playback is not None:
+                playback.credit = self.clamp_credit(playback.credit + int(req[2]))
+                playback.last_seen = now
+                self.send(playback)
+
+        elif req[0] == 'STOP':
+            self.remove((address, int(req[1])))
+
+    def clamp_credit(self, credit):
+        return max(0, min(credit, self.max_credit))
+
+    def send(self, playback):
+        while playback.credit > 0:
+            start = time.time()
+            try:
+                data = playback.read(self.chunk_size)
+            except (IOError, OSError) as e:
+                log.error('Unable to read recording for playback: %s', e)
+                self.send_end(playback.address, playback.playback_id, playback.offset, FAILED)
+                self.remove((playback.address, playback.playback_id))
+                return
+            self.read_time.observe(time.time() - start)
+
+            if data is None:
+                self.send_end(playback.address, playback.playback_id, playback.offset, 0)
+                self.remove((playback.address, playback.playback_id))
+                return
+
+            header = PLAYBACK_HEADER.pack(playback.playback_id, playback.offset - len(data), 0)
+            self.socket.send_multipart([playback.address, header, data], copy=False)
+            self.sent_bytes.inc(len(data))
+            playback.credit -= 1
+
+    def send_end(self, address, playback_id, offset, flags):
+        self.socket.send_multipart([address, PLAYBACK_HEADER.pack(playback_id, offset, END | flags), b''])
+
+    def remove(self, key):
+        playback = self.playbacks.pop(key, None)
+        if playback is not None:
+            playback.close()
+
+    def expire(self, now):
+        """Drops the streams of viewers which have gone quiet."""
+        for key, playback in list(self.playbacks.items()):
+            if now > playback.last_seen + self.timeout:
+                log.warning('Nothing heard from %r for %is, stopping playback.', playback.address, self.timeout)
+                self.remove(key)
+
+
+class PlaybackClient(object):
+    """Plays back recorded video from a PlaybackServer over a DEALER
+    socket.
+
+    play() starts a stream, and each message received on the socket is
+    passed to handle(), which returns the next chunk of the stream, or
+    None for a message left over from an earlier stream.  A credit is
+    returned for every chunk handled, so whoever handles them sets the
+    pace.  Once the last chunk has been handled finished is True, and
+    status holds the flags it came with.
+    """
+
+    def __init__(self, socket, credit=8):
+        self.socket = socket
+        self.credit = credit
+        self.playback_id = 0
+        self.finished = True
+        self.status = 0
+        self.received = 0
+
+    def play(self, host, start, duration):
+        self.stop()
+        self.playback_id = (self.playback_id + 1) & 0xffffffff
+        self.finished = False
+        self.status = 0
+        self.received = 0
+        self.socket.send('PLAY %i %s %r %r %i' % (self.playback_id, host, start, duration, self.credit))
+
+    def handle(self, parts):
+        header, chunk = parts
+        playback_id, offset, flags = PLAYBACK_HEADER.unpack(header)
+        if self.finished or playback_id != self.playback_id:
+            return None
+
+        self.received += len(chunk)
+        if flags & END:
+            self.finished = True
+            self.status = flags
+        else:
+            self.socket.send('CREDIT %i 1' % playback_id)
+        return chunk
+
+    def stop(self):
+        if not self.finished:
+            self.socket.send('STOP %i' % self.playback_id)
+            self.finished = True
@@ -0,0 +1,132 @@
+#!/usr/bin/env python
+
+import time
+import logging
+import collections
+
+from data.framing import is_gop_start, FLAG_SPS, FLAG_REPLAY
+
+log = logging.getLogger(__name__)
+
+
+class GopRing(object):
+    """Holds the most recent whole GOPs of a camera's stream in memory.
+
+    GOPs are dropped from the front once the ones after them still cover
+    max_seconds, or whenever the ring holds more than max_bytes, so the
+    ring always starts on a keyframe.  After lost() the newest GOP is
+    dropped, as it has a hole in it, and nothing more is taken until the
+    next keyframe.
+    """
+
+    def __init__(self, max_seconds, max_bytes):
+        self.max_seconds = max_seconds
+        self.max_bytes = max_bytes
+        self.gops = collections.deque()
+        self.size = 0
+        self.resyncing = False
+
+    def add(self, data, flags, received, captured=None):
+        if self.resyncing:
+            if not is_gop_start(data, flags):
+                return
+            self.resyncing = False
+
+        if flags is not None and flags & FLAG_REPLAY:
+            # A replayed GOP is only of use to start an empty ring.
+            if self.gops or not flags & FLAG_SPS:
+                return
+            self.gops.append([])
+        elif is_gop_start(data, flags):
+            self.gops.append([])
+        elif not self.gops:
+            return
+
+        self.gops[-1].append((data, flags, received, captured))
+        self.size += len(data)
+        self.trim(received)
+
+    def lost(self):
+        if self.gops:
+            gop = self.gops.pop()
+            self.size -= sum(len(message[0]) for message in gop)
+        self.resyncing = True
+
+    def trim(self, now):
+        while self.gops and self.size > self.max_bytes:
+            self.drop_oldest()
+        while len(self.gops) > 1 and self.gops[1][0][2] <= now - self.max_seconds:
+            self.drop_oldest()
+
+    def drop_oldest(self):
+        gop = self.gops.popleft()
+        self.size -= sum(len(message[0]) for message in gop)
+
+    def drain(self):
+        """Returns every buffered message, oldest first, and empties the ring."""
+        messages = [message for gop in self.gops for message in gop]
+        self.gops.clear()
+        self.size = 0
+        return messages
+
+
+class MotionTrigger(object):
+    """Records a camera only around motion.
+
+    Video is held in a GopRing of pre_event_seconds until a motion event
+    arrives.  The ring is then handed to the camera's ingest worker,
+    followed by the live stream, until post_event_seconds pass without
+    further motion.  Each episode is closed off as its own segment.
+    Takes video through put() in the same way as an IngestWorker.
+
+    Cameras which report motion episodes keep recording armed from
+    motion_start() until motion_end(), after which the post event time
+    runs.  Single motion events from older cameras use motion().
+    """
+
+    def __init__(self, worker, pre_event_seconds, post_event_seconds, max_bytes):
+        self.worker = worker
+        self.ring = GopRing(pre_event_seconds, max_bytes)
+        self.post_event_seconds = post_event_seconds
+        self.armed_until = None
+        self.in_episode = False
+
+    def put(self, data, flags=None, captured=None):
+        now = time.time()
+        if self.armed_until is not None and not self.in_episode and now > self.armed_until:
+            log.info('No motion from %s for %is, stopping recording.', self.worker.writer.host, self.post_event_seconds)
+            self.armed_until = None
+            self.worker.close_segment()
+
+        if self.armed_until is None:
+            self.ring.add(data, flags, now, captured)
+        else:
+            self.worker.put(data, flags, now, captured)
+
+    def lost(self):
+        """Skips to the next keyframe after messages have been lost."""
+        if self.armed_until is None:
+            self.ring.lost()
+        else:
+            self.worker.lost()
+
+    def motion(self, now=None):
+        """Starts or extends recording on a motion event."""
+        now = time.time() if now is None else now
+        if self.armed_until is None:
+            messages = self.ring.drain()
+            log.info('Motion from %s, recording with %.1fs of buffered video.', self.worker.writer.host,
+                     now - messages[0][2] if messages else 0.0)
+            self.worker.put_batch(messages)
+        self.armed_until = now + self.post_event_seconds
+
+    def motion_start(self, now=None):
+        """Starts recording for the length of a motion episode."""
+        self.motion(now)
+        self.in_episode = True
+
+    def motion_end(self, now=None):
+        """Runs on for post_event_seconds after a motion episode ends."""
+        self.in_episode = False
+        if self.armed_until is not None:
+            self.armed_until = (time.time() if now is None else now) + self.post_event_seconds
@@ -0,0 +1,203 @@
+#!/usr/bin/env python
+
+import os
+import re
+import time
+import errno
+import heapq
+import bisect
+import logging
+import threading
+import Queue
+
+from keyframeindex import SEGMENT_NAME
+from diskio import set_idle_io_priority
+from metrics.registry import counter, gauge
+
+log = logging.getLogger(__name__)
+
+DATE_FOLDER = re.compile(r'^\d{4}-\d{2}-\d{2}$')
+SECONDS_PER_DAY = 86400
+
+
+def segment_start(name):
+    """Returns the start time of a segment from its file name, or None
+    if it is not a segment."""
+    match = SEGMENT_NAME.match(name)
+    if not match:
+        return None
+    return time.mktime(time.strptime(match.group('start'), '%Y%m%d-%H%M%S'))
+
+
+def companion_names(names, segment_name):
+    """Returns the names, from a sorted folder listing, of a segment and
+    the files kept beside it: its keyframe index and anything else
+    named after it."""
+    stem = os.path.splitext(segment_name)[0] + '.'
+    first = bisect.bisect_left(names, stem)
+    last = first
+    while last < len(names) and names[last].startswith(stem):
+        last += 1
+    return names[first:last]
+
+
+def files_size(folder, names):
+    size = 0
+    for name in names:
+        try:
+            size += os.path.getsize(os.path.join(folder, name))
+        except OSError:
+            pass
+    return size
+
+
+class RetentionManager(threading.Thread):
+    """Keeps the recording folder within a disk budget by deleting the
+    oldest segments, along with their companion files.
+
+    An index of every closed segment's start time and size, its own and
+    its companions', is built by scanning the folder once at start up
+    and then kept up to date by passing each closed segment to add(),
+    which only queues it.  Segments are deleted oldest first while the
+    total is over max_bytes or the oldest started more than max_days
+    ago, either being 0 for no limit.  Day folders left empty are
+    removed.
+
+    Scanning and deleting happen on this thread, at idle I/O priority,
+    so neither ever holds up ingest.
+    """
+
+    def __init__(self, recording_folder, max_bytes=0, max_days=0, interval=60):
+        super(RetentionManager, self).__init__(name='retention')
+        self.daemon = True
+        self.recording_folder = recording_folder
+        self.max_bytes = max_bytes
+        self.max_days = max_days
+        self.interval = interval
+        self.queue = Queue.Queue()
+        self.stopping = threading.Event()
+        self.started_at = time.time()
+        self.segments = []
+        self.used = 0
+
+        gauge('retention_used_bytes').set_function(lambda: self.used)
+        gauge('retention_segments').set_function(lambda: len(self.segments))
+        self.deleted_segments = counter('retention_deleted_segments_total')
+        self.deleted_bytes = counter('retention_deleted_bytes_total')
+
+    def add(self, segment):
+        """Adds a closed segment to the index, without blocking."""
+        self.queue.put(segment.path)
+
+    def stop(self):
+        self.stopping.set()
+        self.queue.put(None)
+        self.join()
+
+    def run(self):
+        set_idle_io_priority()
+        self.scan()
+        self.prune(time.time())
+
+        while not self.stopping.is_set():
+            try:
+                path = self.queue.get(timeout=self.interval)
+                if path is None:
+                    break
+                self.index(path)
+            except Queue.Empty:
+                pass
+            self.prune(time.time())
+
+    def scan(self):
+        """Indexes the segments already in the recording folder.  Those
+        started since the recorder did come in through add()."""
+        started = time.time()
+        cutoff = int(self.started_at)
+        try:
+            folders = sorted(name for name in os.listdir(self.recording_folder) if DATE_FOLDER.match(name))
+        except OSError as e:
+            if e.errno != errno.ENOENT:
+                log.error('Unable to scan recordings in %s: %s', self.recording_folder, e)
+            return
+
+        for folder_name in folders:
+            if self.stopping.is_set():
+                return
+            folder = os.path.join(self.recording_folder, folder_name)
+            try:
+                names = sorted(os.listdir(folder))
+            except OSError as e:
+                log.error('Unable to scan recordings in %s: %s', folder, e)
+                continue
+
+            for name in names:
+                start = segment_start(name)
+                if start is not None and start < cutoff:
+                    self.push(start, os.path.join(folder, name),
+                              files_size(folder, companion_names(names, name)))
+
+        log.info('Indexed %i recorded segments using %i bytes in %.1fs.',
+                 len(self.segments), self.used, time.time() - started)
+
+    def index(self, path):
+        folder, name = os.path.split(path)
+        start = segment_start(name)
+        if start is None:
+            return
+        try:
+            names = sorted(os.listdir(folder))
+        except OSError as e:
+            log.error('Unable to index segment %s: %s', path, e)
+            return
+        self.push(start, path, files_size(folder, companion_names(names, name)))
+
+    def push(self, start, path, size):
+        heapq.heappush(self.segments, (start, path, size))
+        self.used += size
+
+    def over_budget(self, start, now):
+        if self.max_bytes and self.used > self.max_bytes:
+            return True
+        return bool(self.max_days) and start < now - self.max_days * SECONDS_PER_DAY
+
+    def prune(self, now):
+        """Deletes the oldest segments until the recordings are within
+        budget."""
+        while self.segments and not self.stopping.is_set():
+            start, path, size = self.segments[0]
+            if not self.over_budget(start, now):
+                break
+            heapq.heappop(self.segments)
+            self.used -= size
+            self.delete(path)
+
+    def delete(self, path):
+        folder, name = os.path.split(path)
+        try:
+            names = sorted(os.listdir(folder))
+        except OSError as e:
+            log.error('Unable to delete segment %s: %s', path, e)
+            return
+
+        deleted = 0
+        removed = companion_names(names, name)
+        for companion in removed:
+            companion_path = os.path.join(folder, companion)
+            try:
+                size = os.path.getsize(companion_path)
+                os.remove(companion_path)
+                deleted += size
+            except OSError as e:
+                log.error('Unable to delete %s: %s', companion_path, e)
+
+        log.info('Deleted old video file %s, freeing %i bytes.', path, deleted)
+        self.deleted_segments.inc()
+        self.deleted_bytes.inc(deleted)
+
+        if len(removed) == len(names):
+            try:
+                os.rmdir(folder)
+                log.info('Removed empty recording folder %s.', folder)
+            except OSError:
+                pass
@@ -0,0 +1,329 @@
+#!/usr/bin/env python
+
+import os
+import time
+import errno
+import logging
+import datetime
+import threading
+import Queue
+
+from data.h264 import NalSplitter, AccessUnitSplitter, is_keyframe
+from data.framing import FLAG_REPLAY
+from mpegts import TsMuxer, CLOCK_RATE
+from keyframeindex import index_path, INDEX_RECORD, KEYFRAME, END
+from activity import activity_path, pack_activity
+from thumbnails import spool_path
+from diskio import preallocate
+
+log = logging.getLogger(__name__)
+
+
+class Segment(object):
+    """A single recording file, with its sidecar keyframe index and
+    motion activity, and what is known about it so far.
+
+    The file must not already exist, so a segment still being closed out
+    is never overwritten; OSError with EEXIST is raised if it does.  If
+    preallocate_size is given that much disk is reserved for the file up
+    front, and whatever is left unused is released when it is closed.
+    """
+
+    def __init__(self, host, path, start_time, preallocate_size=0):
+        self.host = host
+        self.path = path
+        self.index_path = index_path(path)
+        self.start_time = start_time
+        self.end_time = start_time
+        self.size = 0
+        self.file = os.fdopen(os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o666), 'wb')
+        self.index = open(self.index_path, 'wb')
+        # Only opened once the camera sends some activity.
+        self.activity = None
+        # Keyframes kept for thumbnails are spooled to disk, opened with the first.
+        self.thumbnails = None
+        self.thumbnail_times = []
+        self.preallocated = preallocate_size and preallocate(self.file, preallocate_size)
+
+    def write(self, data, timestamp, keyframe):
+        if keyframe:
+            # Both flushed, once a keyframe, so the open segment can be
+            # found by clips and playback up to its latest keyframe.
+            self.file.flush()
+            self.index.write(INDEX_RECORD.pack(timestamp, self.size, KEYFRAME))
+            self.index.flush()
+        self.file.write(data)
+        self.size += len(data)
+        self.end_time = timestamp
+
+    def write_activity(self, summary):
+        if self.activity is None:
+            self.activity = open(activity_path(self.path), 'wb')
+        self.activity.write(pack_activity(summary))
+
+    def write_thumbnail(self, timestamp, data):
+        if self.thumbnails is None:
+            self.thumbnails = open(spool_path(self.path), 'wb')
+        self.thumbnails.write(data)
+        self.thumbnail_times.append(timestamp)
+
+    def finish(self):
+        """Marks the end of the segment in the index."""
+        self.index.write(INDEX_RECORD.pack(self.end_time, self.size, END))
+
+    def close(self):
+        if self.preallocated:
+            self.file.flush()
+            os.ftruncate(self.file.fileno(), self.size)
+        for segment_file in (self.file, self.index, self.activity):
+            if segment_file is None:
+                continue
+            segment_file.flush()
+            os.fsync(segment_file.fileno())
+            segment_file.close()
+        if self.thumbnails is not None:
+            # Only needed until the thumbnails are made, so not synced.
+            self.thumbnails.close()
+
+
+class SegmentFinaliser(threading.Thread):
+    """Background thread which syncs and closes finished segment files,
+    so that ingest never waits on the disk to finish a file.
+
+    Callables added to listeners are called with each segment once it
+    has been closed.
+    """
+
+    def __init__(self):
+        super(SegmentFinaliser, self).__init__(name='segment-finaliser')
+        self.daemon = True
+        self.queue = Queue.Queue()
+        self.listeners = []
+
+    def finalise(self, segment):
+        self.queue.put(segment)
+
+    def stop(self):
+        self.queue.put(None)
+        self.join()
+
+    def run(self):
+        while True:
+            segment = self.queue.get()
+            if segment is None:
+                break
+
+            try:
+                segment.close()
+            except (IOError, OSError) as e:
+                log.error('Unable to close out video file %s: %s', segment.path, e)
+                continue
+
+            log.info('Closed out video file: %s', segment.path)
+            for listener in self.listeners:
+                try:
+                    listener(segment)
+                except Exception:
+                    log.exception('Segment listener failed for %s.', segment.path)
+
+
+class SegmentWriter(object):
+    """Records one camera's H.264 stream as MPEG-TS segment files.
+
+    Incoming data, in any framing, is split into access units.  A
+    segment only ever starts on a keyframe, and once a segment is longer
+    than max_duration the next keyframe starts a new one, so there is no
+    gap between files.  Finished segments are handed to the finaliser.
+
+    Frames are timestamped with their capture time where the camera
+    sends one, or else from their arrival time, smoothed onto the
+    camera's frame rate.  The PTS of each frame is its wall clock time
+    on the 90kHz clock, and one muxer carries on across segments, so
+    consecutive segments can be joined byte for byte.
+
+    Each segment has preallocate_size bytes of disk reserved for it when
+    it is opened, to keep the files on disk contiguous.
+
+    The first keyframe of each segment, and then one at least every
+    thumbnail_interval seconds, is spooled to a file beside the segment
+    for a ThumbnailGenerator to decode once the segment is finished.
+    """
+
+    # Arrival time error, in seconds, beyond which the frame clock jumps.
+    RESYNC_THRESHOLD = 1.0
+    # Fraction of the arrival time error corrected on each frame.
+    CLOCK_CORRECTION = 0.05
+
+    def __init__(self, host, recording_folder, max_duration, framerate, finaliser, preallocate_size=0,
+                 thumbnail_interval=0):
+        self.host = host
+        self.recording_folder = recording_folder
+        self.max_duration = max_duration
+        self.frame_duration = 1.0 / framerate
+        self.finaliser = finaliser
+        self.preallocate_size = preallocate_size
+        self.thumbnail_interval = thumbnail_interval
+        self.next_thumbnail = None
+        self.nal_splitter = NalSplitter()
+        self.au_splitter = AccessUnitSplitter()
+        self.muxer = TsMuxer()
+        self.segment = None
+        self.timestamp = None
+        self.resync = False
+        # Capture times of the unit held by the NAL splitter and of the
+        # first unit of the open access unit.
+        self.held_captured = None
+        self.au_captured = None
+
+    @property
+    def synced(self):
+        """True while a segment is open, that is since a keyframe."""
+        return self.segment is not None
+
+    def write(self, data, flags=None, now=None, captured=None):
+        """Adds a message payload from the video feed, which arrived at
+        now and was captured at captured, if known."""
+        if flags is not None and flags & FLAG_REPLAY and self.synced:
+            # Already in sync, this is a replay for another subscriber.
+            return
+
+        now = time.time() if now is None else now
+        units = self.nal_splitter.feed(data)
+        for i, unit in enumerate(units):
+            # The first unit may be the one held back from the last message.
+            unit_captured = self.held_captured if i == 0 and self.held_captured is not None else captured
+            self.feed_unit(unit, now, unit_captured)
+        self.held_captured = captured
+
+    def feed_unit(self, unit, now, captured):
+        units = self.au_splitter.feed(unit)
+        if units:
+            self.write_access_unit(units, now, self.au_captured)
+            self.au_captured = captured
+        elif self.au_captured is None:
+            self.au_captured = captured
+
+    def write_access_unit(self, units, now, captured=None):
+        keyframe = is_keyframe(units)
+        timestamp = self.frame_time(now) if captured is None else self.capture_time(captured)
+
+        if self.segment is not None and keyframe and \
+           timestamp >= self.segment.start_time + self.max_duration:
+            self.close_segment()
+
+        if self.segment is None or self.resync:
+            if not keyframe:
+                # Wait for a keyframe before starting or resuming a file.
+                return
+            self.resync = False
+            if self.segment is None:
+                self.open_segment(timestamp)
+                self.next_thumbnail = timestamp
+
+        if keyframe and self.thumbnail_interval and timestamp >= self.next_thumbnail:
+            self.segment.write_thumbnail(timestamp, b''.join(units))
+            self.next_thumbnail = timestamp + self.thumbnail_interval
+
+        pts = int(round(timestamp * CLOCK_RATE))
+        self.segment.write(self.muxer.mux(units, pts, keyframe), timestamp, keyframe)
+
+    def write_activity(self, summary):
+        """Keeps a summary of the camera's motion activity beside the open
+        segment.  There is nowhere to keep it while no segment is open."""
+        if self.segment is not None:
+            self.segment.write_activity(summary)
+
+    def frame_time(self, now):
+        """Returns the timestamp for a frame arriving at now."""
+        if self.timestamp is None:
+            self.timestamp = now
+            return now
+
+        expected = self.timestamp + self.frame_duration
+        error = now - expected
+        if error > self.RESYNC_THRESHOLD:
+            # Frames have been missing, jump forward.
+            self.timestamp = now
+        else:
+            self.timestamp = max(expected + error * self.CLOCK_CORRECTION,
+                                 self.timestamp + self.frame_duration / 2)
+        return self.timestamp
+
+    def capture_time(self, captured):
+        """Returns the timestamp for a frame captured at captured, kept
+        increasing if the camera's clock steps back."""
+        if self.timestamp is not None and captured <= self.timestamp:
+            captured = self.timestamp + self.frame_duration / 2
+        self.timestamp = captured
+        return captured
+
+    def discontinuity(self):
+        """Discards any partly received frame after data has been lost.
+        Writing resumes at the next keyframe, in the same segment."""
+        self.nal_splitter = NalSplitter()
+        self.au_splitter = AccessUnitSplitter()
+        self.held_captured = None
+        self.au_captured = None
+        self.resync = True
+
+    def abandon(self):
+        """Gives up on the open segment after a failed write.  The next
+        segment will wait for a keyframe."""
+        self.discontinuity()
+        self.close_segment()
+
+    def open_segment(self, start_time):
+        start = datetime.datetime.fromtimestamp(start_time)
+        date_folder = os.path.join(self.recording_folder, start.date().isoformat())
+
+        try:
+            os.makedirs(date_folder)
+        except OSError as exception:
+            if exception.errno != errno.EEXIST:
+                raise
+
+        name = '%s-%s' % (self.host, start.strftime("%Y%m%d-%H%M%S"))
+        suffix = ''
+        # A segment restarted within the same second gets a counter, as
+        # the last one may still be being closed out.
+        for attempt in range(1, 100):
+            path = os.path.join(date_folder, name + suffix + '.ts')
+            try:
+                self.segment = Segment(self.host, path, start_time, self.preallocate_size)
+                break
+            except OSError as exception:
+                if exception.errno != errno.EEXIST:
+                    raise
+                suffix = '-%i' % attempt
+        else:
+            raise OSError(errno.EEXIST, 'Too many segments started in one second', path)
+        log.info('Starting video file: %s', path)
+
+    def close_segment(self):
+        if self.segment is not None:
+            try:
+                self.segment.finish()
+            except (IOError, OSError) as e:
+                log.error('Unable to complete index for %s: %s', self.segment.path, e)
+            self.finaliser.finalise(self.segment)
+            self.segment = None
+
+    def expired(self, now=None):
+        """True if the open segment has run past max_duration."""
+        now = time.time() if now is None else now
+        return self.segment is not None and now > self.segment.start_time + self.max_duration
+
+    def close(self):
+        """Writes out whatever is buffered and closes the open segment.
+        The next segment will wait for a keyframe."""
+        now = time.time() if self.timestamp is None else self.timestamp + self.frame_duration
+        for unit in self.nal_splitter.flush():
+            self.feed_unit(unit, now, self.held_captured)
+        units = self.au_splitter.flush()
+        if units:
+            self.write_access_unit(units, now, self.au_captured)
+
+        self.close_segment()
+        self.timestamp = None
+        self.held_captured = None
+        self.au_captured = None
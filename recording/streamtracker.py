@@ -0,0 +1,64 @@
+#!/usr/bin/env python
+
+import logging
+
+from data.framing import FLAG_SPS, FLAG_REPLAY
+from metrics.registry import counter, histogram
+
+log = logging.getLogger(__name__)
+
+
+class StreamTracker(object):
+    """Follows the video messages of one camera stream, that is one
+    stream id on one socket.  A restarted camera starts a new stream.
+
+    Cameras number their messages, so a jump in the sequence numbers
+    shows how many were lost on the way, whether dropped by the camera,
+    a relay or a PUB socket at its high water mark.  Replayed messages
+    repeat old numbers and are not checked.
+
+    The hostname and the capture time of each GOP arrive on the messages
+    starting it, so a camera's messages are only attributed to it from
+    its first keyframe.  The time from capture to arrival is recorded
+    for each camera, which relies on the clocks of camera and recorder
+    being kept in step, by NTP for example.
+    """
+
+    def __init__(self):
+        self.host = None
+        self.expected = None
+        self.gop_time = None
+
+    def receive(self, message, now):
+        """Takes a versioned video message arriving at now, and returns
+        the number of messages lost ahead of it and its capture time, or
+        None if it is not known."""
+        lost = 0
+        if not message.flags & FLAG_REPLAY:
+            if self.expected is not None:
+                lost = (message.sequence - self.expected) & 0xffffffff
+            self.expected = (message.sequence + 1) & 0xffffffff
+            if lost:
+                # The capture time of the GOP may have been lost too.
+                self.gop_time = None
+
+        if message.flags & FLAG_SPS:
+            if message.host != self.host:
+                self.set_host(message.host)
+            self.gop_time = message.gop_time
+
+        captured = None if self.gop_time is None else self.gop_time + message.offset / 1e6
+        if self.host is not None:
+            if lost:
+                log.warning('Lost %i video messages from %s.', lost, self.host)
+                self.gaps.inc()
+                self.lost_messages.inc(lost)
+            if captured is not None and not message.flags & FLAG_REPLAY:
+                self.latency.observe(now - captured)
+        return lost, captured
+
+    def set_host(self, host):
+        self.host = host
+        self.gaps = counter('video_gaps_total', camera=host)
+        self.lost_messages = counter('video_lost_messages_total', camera=host)
+        self.latency = histogram('video_latency_seconds', camera=host)
@@ -0,0 +1,180 @@
+#!/usr/bin/env python
+
+import os
+import json
+import time
+import errno
+import logging
+import datetime
+import threading
+import Queue
+from subprocess import Popen
+
+from keyframeindex import SEGMENT_NAME
+from diskio import set_idle_io_priority
+from metrics.registry import counter, histogram
+
+log = logging.getLogger(__name__)
+
+# Lowest CPU priority for ffmpeg.
+NICENESS = 19
+
+
+def sheet_path(segment_path):
+    """Returns the thumbnail sprite sheet for a segment file."""
+    return os.path.splitext(segment_path)[0] + '.jpg'
+
+
+def sheet_index_path(segment_path):
+    """Returns the index of the thumbnail sprite sheet for a segment file."""
+    return os.path.splitext(segment_path)[0] + '.json'
+
+
+def spool_path(segment_path):
+    """Returns the file a segment's keyframes are spooled to until its
+    thumbnails are made."""
+    return os.path.splitext(segment_path)[0] + '.thm'
+
+
+def lower_priority():
+    """Runs in the ffmpeg process before it starts, so it only gets the
+    CPU and disk that ingest leaves unused."""
+    os.nice(NICENESS)
+    set_idle_io_priority()
+
+
+class ThumbnailGenerator(object):
+    """Makes a sprite sheet of keyframe thumbnails for each finished
+    segment, on a pool of worker threads.
+
+    While recording, SegmentWriter spools a keyframe every so often to
+    <segment>.thm, noting its time in segment.thumbnail_times, so they
+    are not held in memory.  Once the segment is closed add() queues it,
+    and a worker has a niced ffmpeg at idle I/O priority decode only
+    those frames, scale them to size and tile them columns wide into
+    <segment>.jpg.  The time of each thumbnail, in the order they are
+    tiled, goes in <segment>.json, and the spool file is deleted.  At
+    most max_queue segments wait for a worker, any beyond that have no
+    thumbnails made.
+
+    Callables added to listeners are called with each segment once its
+    thumbnails have been made or skipped, so that its companion files
+    are all in place.
+    """
+
+    def __init__(self, ffmpeg='ffmpeg', size=(160, 90), columns=10, workers=1, max_queue=4):
+        self.ffmpeg = ffmpeg
+        self.size = tuple(size)
+        self.columns = columns
+        self.queue = Queue.Queue(max_queue)
+        self.listeners = []
+        self.workers = [threading.Thread(target=self.run, name='thumbnails-%i' % i) for i in range(workers)]
+        for worker in self.workers:
+            worker.daemon = True
+        self.sheets = counter('thumbnail_sheets_total')
+        self.skipped = counter('thumbnail_skipped_segments_total')
+        self.failures = counter('thumbnail_failures_total')
+        self.generate_time = histogram('thumbnail_seconds')
+
+    def start(self):
+        for worker in self.workers:
+            worker.start()
+
+    def stop(self):
+        for worker in self.workers:
+            self.queue.put(None)
+        for worker in self.workers:
+            worker.join()
+
+    def add(self, segment):
+        """Queues the thumbnails of a closed segment, without blocking."""
+        if not segment.thumbnail_times:
+            self.notify(segment)
+            return
+        try:
+            self.queue.put_nowait(segment)
+        except Queue.Full:
+            log.warning('Thumbnails are falling behind, none made for %s.', segment.path)
+            self.skipped.inc()
+            remove_spool(segment.path)
+            self.notify(segment)
+
+    def run(self):
+        while True:
+            segment = self.queue.get()
+            if segment is None:
+                break
+
+            start = time.time()
+            try:
+                self.generate(segment.path, segment.thumbnail_times)
+                self.sheets.inc()
+            except (IOError, OSError) as e:
+                log.error('Unable to make thumbnails for %s: %s', segment.path, e)
+                self.failures.inc()
+            remove_spool(segment.path)
+            self.generate_time.observe(time.time() - start)
+            self.notify(segment)
+
+    def notify(self, segment):
+        for listener in self.listeners:
+            try:
+                listener(segment)
+            except Exception:
+                log.exception('Thumbnail listener failed for %s.', segment.path)
+
+    def generate(self, path, times):
+        columns = min(self.columns, len(times))
+        rows = -(-len(times) // columns)
+        width, height = self.size
+        status = Popen([self.ffmpeg, '-v', 'error', '-nostdin', '-y', '-f', 'h264', '-i', spool_path(path),
+                        '-vf', 'scale=%i:%i,tile=%ix%i' % (width, height, columns, rows),
+                        '-frames:v', '1', '-q:v', '5', sheet_path(path)],
+                       preexec_fn=lower_priority).wait()
+        if status != 0:
+            raise OSError(errno.EIO, 'ffmpeg exited with status %i' % status)
+
+        with open(sheet_index_path(path), 'w') as index_file:
+            json.dump({'width': width, 'height': height, 'columns': columns, 'times': times}, index_file)
+
+
+def remove_spool(segment_path):
+    try:
+        os.remove(spool_path(segment_path))
+    except OSError as e:
+        if e.errno != errno.ENOENT:
+            log.warning('Unable to remove thumbnail spool for %s: %s', segment_path, e)
+
+
+def find_thumbnails(recording_folder, host, start, end):
+    """Returns (time, sheet_path, x, y, width, height) for each thumbnail
+    of host between start and end, in seconds since the epoch, giving
+    where it is found in its sprite sheet, in time order."""
+    thumbnails = []
+    day = datetime.date.fromtimestamp(start) - datetime.timedelta(days=1)
+    last_day = datetime.date.fromtimestamp(end)
+    while day <= last_day:
+        date_folder = os.path.join(recording_folder, day.isoformat())
+        day += datetime.timedelta(days=1)
+        if not os.path.isdir(date_folder):
+            continue
+
+        for name in os.listdir(date_folder):
+            match = SEGMENT_NAME.match(name)
+            if not match or match.group('host') != host:
+                continue
+
+            path = os.path.join(date_folder, name)
+            try:
+                with open(sheet_index_path(path)) as index_file:
+                    index = json.load(index_file)
+            except (IOError, ValueError):
+                continue
+
+            width, height, columns = index['width'], index['height'], index['columns']
+            for i, timestamp in enumerate(index['times']):
+                if start <= timestamp < end:
+                    thumbnails.append((timestamp, sheet_path(path),
+                                       (i % columns) * width, (i // columns) * height, width, height))
+    thumbnails.sort()
+    return thumbnails
@@ -0,0 +1,135 @@
+#!/usr/bin/env python
+
+# General modules
+import sys
+import os
+import zmq
+import logging
+import socket
+import time
+import argparse
+
+# Project modules
+import config
+from data.relay import Relay
+from metrics.export import MetricsExporter
+
+log = logging.getLogger(__name__)
+
+def main(config_dir=None):
+    hostname = socket.gethostname()
+    log.info('Starting relay on %s.', hostname)
+
+    module_dir = os.path.dirname(__file__)
+    config_dir = config_dir or os.path.join(module_dir, 'config')
+
+    network_config = config.load_from_file(os.path.join(config_dir, 'network.json'))
+    relay_config = config.load_from_file(os.path.join(config_dir, 'relay.json'))
+
+    eventport = network_config['event_pub_port']
+    videoport = network_config['h264_pub_port']
+    relay_eventport = network_config['relay_event_port']
+    relay_videoport = network_config['relay_video_port']
+
+    if network_config['video_framing'] != 'nal':
+        log.error('The relay needs the nal video framing, not %s.', network_config['video_framing'])
+        sys.exit(1)
+
+    cameraips = relay_config['camera_ip_addrs']
+    bind_address = relay_config['bind_address']
+    stats_interval = relay_config['stats_interval']
+
+    context = zmq.Context()
+    metrics_exporter = MetricsExporter(context, hostname,
+                                       relay_config['metrics_interval'],
+                                       network_config['relay_stats_port'],
+                                       relay_config['metrics_textfile'],
+                                       bind_address=bind_address)
+    metrics_exporter.start()
+
+    log.info('Binding relayed event publish socket to port %i.', relay_eventport)
+    eventpubsocket = context.socket(zmq.PUB)
+    eventpubsocket.bind('tcp://%s:%s' % (bind_address, relay_eventport))
+
+    log.info('Binding relayed video router socket to port %i.', relay_videoport)
+    videoroutersocket = context.socket(zmq.ROUTER)
+    # Each consumer's window bounds what is queued for it.
+    videoroutersocket.setsockopt(zmq.SNDHWM, 0)
+    videoroutersocket.bind('tcp://%s:%s' % (bind_address, relay_videoport))
+
+    eventsockets = []
+    videosockets = []
+
+    for cameraip in cameraips:
+        log.info('Connecting to camera event feed: %s:%i.', cameraip, eventport)
+        eventsocket = context.socket(zmq.SUB)
+        eventsocket.connect('tcp://%s:%s' % (cameraip, eventport))
+        eventsocket.setsockopt(zmq.SUBSCRIBE, '')
+        eventsockets += [eventsocket]
+
+        log.info('Connecting to camera video feed: %s:%i.', cameraip, videoport)
+        videosocket = context.socket(zmq.SUB)
+        videosocket.connect('tcp://%s:%s' % (cameraip, videoport))
+        videosocket.setsockopt(zmq.SUBSCRIBE, '')
+        videosockets += [videosocket]
+
+    poller = zmq.Poller()
+    poller.register(videoroutersocket, zmq.POLLIN)
+    for sock in videosockets + eventsockets:
+        poller.register(sock, zmq.POLLIN)
+
+    relay = Relay(videoroutersocket, network_config['gop_cache_size'], relay_config['consumer_timeout'])
+    next_expire = time.time() + 1
+    next_stats = time.time() + stats_interval
+
+    try:
+        while True:
+            socks = dict(poller.poll(1000))
+            for sock, status in socks.iteritems():
+                if sock in videosockets:
+                    relay.publish(sock, sock.recv_multipart())
+
+                elif sock in eventsockets:
+                    eventpubsocket.send_multipart(sock.recv_multipart())
+
+                elif sock is videoroutersocket:
+                    relay.handle(sock.recv_multipart())
+
+            now = time.time()
+            if now >= next_expire:
+                next_expire = now + 1
+                relay.expire(now)
+
+            if now >= next_stats:
+                next_stats = now + stats_interval
+                log_consumer_lag(relay)
+
+    finally:
+        metrics_exporter.stop()
+
+
+def log_consumer_lag(relay):
+    """Log how far behind each consumer is.
+    """
+    for consumer in relay.consumers.itervalues():
+        log.info('Consumer %s: %i messages behind, %i skipped.',
+                 consumer.name, consumer.lag, consumer.dropped.value)
+
+
+if __name__ == '__main__':
+
+    # Setting up logging.
+    root = logging.getLogger()
+    root.setLevel(logging.DEBUG)
+    ch = logging.StreamHandler(sys.stdout)
+    ch.setLevel(logging.DEBUG)
+    formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    ch.setFormatter(formatter)
+    root.addHandler(ch)
+
+    parser = argparse.ArgumentParser(description='Relay camera feeds to recorders.')
+    parser.add_argument('--config-dir', help='folder holding the configuration files')
+    args = parser.parse_args()
+
+    # Start the relay.
+    main(args.config_dir)
@@ -0,0 +1,53 @@
+#!/usr/bin/env python
+"""Lists the times a camera saw motion over a threshold, optionally in
+one region of the picture, using the activity summaries kept beside
+each segment, so no video is decoded.  For example, to find activity
+near the door in the top left of the picture on a given day:
+
+    python -m tools.activity cctvdoor 2015-06-02 2015-06-03 --region 0 0 640 540
+
+The threshold is the fraction of a grid cell's blocks in motion,
+averaged over each second, and regions are x y width height in pixels
+of the camera's resolution in camera.json.
+"""
+
+import os
+import sys
+import datetime
+import argparse
+
+import config
+from recording.activity import activity_ranges, region_cells
+from recording.eventstore import parse_time
+
+
+def main():
+    module_dir = os.path.join(os.path.dirname(__file__), '..')
+    recorder_config = config.load_from_file(os.path.join(module_dir, 'config/recorder.json'))
+    camera_config = config.load_from_file(os.path.join(module_dir, 'config/camera.json'))
+
+    parser = argparse.ArgumentParser(description='Find the times a camera saw motion.')
+    parser.add_argument('host', help='camera hostname')
+    parser.add_argument('start', type=parse_time, help='start time, e.g. 2015-06-01T08:00')
+    parser.add_argument('end', type=parse_time, help='end time, e.g. 2015-06-08')
+    parser.add_argument('--threshold', type=float, default=0.1, help='activity between 0 and 1')
+    parser.add_argument('--region', type=int, nargs=4, metavar=('X', 'Y', 'WIDTH', 'HEIGHT'),
+                        help='only look at this part of the picture')
+    parser.add_argument('--resolution', type=int, nargs=2,
+                        default=[camera_config['resolution_x'], camera_config['resolution_y']],
+                        help='camera resolution the region is given in')
+    parser.add_argument('--gap', type=float, default=5, help='join times less than this many seconds apart')
+    parser.add_argument('--folder', default=recorder_config['recording_folder'], help='recording folder')
+    args = parser.parse_args()
+
+    cells = region_cells(args.region, args.resolution) if args.region else None
+    for start, end, peak in activity_ranges(args.folder, args.host, args.start, args.end,
+                                            args.threshold, cells, args.gap):
+        sys.stdout.write('%s %s %6.0fs peak %3.0f%%\n' % (
+                         datetime.datetime.fromtimestamp(start).isoformat(),
+                         datetime.datetime.fromtimestamp(end).isoformat(),
+                         end - start, 100 * peak))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,65 @@
+#!/usr/bin/env python
+"""Cuts a clip of a camera's recording between two times, using the
+keyframe index kept beside each segment, so only the bytes covering the
+clip are read.  The clip runs from the keyframe at or before the start
+to the keyframe at or after the end.  For example:
+
+    python -m tools.clip cctvdoor 2015-06-01T08:14:30 2015-06-01T08:15:00 door.ts
+
+Clips are MPEG-TS; any other output extension is remuxed by ffmpeg with
+stream copy, e.g. door.mp4.
+"""
+
+import os
+import sys
+import logging
+import argparse
+from subprocess import Popen, PIPE
+
+import config
+from recording.keyframeindex import clip_ranges, write_clip
+from recording.eventstore import parse_time
+
+log = logging.getLogger(__name__)
+
+
+def main():
+    module_dir = os.path.join(os.path.dirname(__file__), '..')
+    recorder_config = config.load_from_file(os.path.join(module_dir, 'config/recorder.json'))
+
+    parser = argparse.ArgumentParser(description='Cut a clip from the recordings of a camera.')
+    parser.add_argument('host', help='camera hostname')
+    parser.add_argument('start', type=parse_time, help='start time, e.g. 2015-06-01T08:14:30')
+    parser.add_argument('end', type=parse_time, help='end time, e.g. 2015-06-01T08:15:00')
+    parser.add_argument('output', help='clip file, .ts or any container ffmpeg can write')
+    parser.add_argument('--folder', default=recorder_config['recording_folder'], help='recording folder')
+    parser.add_argument('--ffmpeg', default=recorder_config['ffmpeg'], help='ffmpeg used to remux the clip')
+    args = parser.parse_args()
+
+    ranges = clip_ranges(args.folder, args.host, args.start, args.end)
+    if not ranges:
+        log.error('No recordings of %s found for that time.', args.host)
+        sys.exit(1)
+
+    for path, first_byte, end_byte in ranges:
+        log.info('Taking %s from byte %i to %s.', path, first_byte, 'end' if end_byte is None else end_byte)
+
+    if args.output.endswith('.ts'):
+        with open(args.output, 'wb') as output:
+            write_clip(ranges, output)
+    else:
+        ffmpeg = Popen([args.ffmpeg, '-loglevel', 'error', '-y', '-f', 'mpegts', '-i', '-',
+                        '-codec', 'copy', args.output], stdin=PIPE)
+        write_clip(ranges, ffmpeg.stdin)
+        ffmpeg.stdin.close()
+        sys.exit(ffmpeg.wait())
+
+
+if __name__ == '__main__':
+    root = logging.getLogger()
+    root.setLevel(logging.INFO)
+    ch = logging.StreamHandler(sys.stderr)
+    ch.setFormatter(logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s'))
+    root.addHandler(ch)
+
+    main()
@@ -0,0 +1,35 @@
+#!/usr/bin/env python
+"""Lists the events recorded for a camera between two times, using the
+recorder's event store.  For example:
+
+    python -m tools.events cctvdoor 2015-06-01T08:00 2015-06-01T09:30
+"""
+
+import os
+import sys
+import datetime
+import argparse
+
+import config
+from recording.eventstore import query, parse_time
+
+
+def main():
+    module_dir = os.path.join(os.path.dirname(__file__), '..')
+    recorder_config = config.load_from_file(os.path.join(module_dir, 'config/recorder.json'))
+
+    parser = argparse.ArgumentParser(description='List recorded camera events.')
+    parser.add_argument('host', help='camera hostname')
+    parser.add_argument('start', type=parse_time, help='start time, e.g. 2015-06-01T08:00')
+    parser.add_argument('end', type=parse_time, help='end time, e.g. 2015-06-01T09:30')
+    parser.add_argument('--store', default=recorder_config['event_store'], help='event database')
+    args = parser.parse_args()
+
+    event_log_format = recorder_config['event_log_format']
+    for timestamp, host, event, data in query(args.store, args.host, args.start, args.end):
+        event_time = datetime.datetime.fromtimestamp(timestamp).isoformat()
+        sys.stdout.write((event_log_format % {'host': host, 'event': event, 'time': event_time}) + '\n')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,100 @@
+#!/usr/bin/env python
+"""Plays an H.264 elementary stream file into a video publish socket
+in place of a camera, so that recorders can be tested without camera
+hardware.  For example:
+
+    python -m tools.h264publish sample.h264 --host testcam --loop
+"""
+
+import os
+import sys
+import time
+import zmq
+import logging
+import argparse
+
+import config
+from data.h264 import NalSplitter, AccessUnitSplitter
+from data.zmqoutput import ZeroMqOutput, NalZeroMqOutput
+
+log = logging.getLogger(__name__)
+
+
+def access_units(filename, blocksize=65536):
+    """Yields each access unit of an H.264 file as a string."""
+    nal_splitter = NalSplitter()
+    au_splitter = AccessUnitSplitter()
+    with open(filename, 'rb') as h264file:
+        while True:
+            data = h264file.read(blocksize)
+            units = nal_splitter.feed(data) if data else nal_splitter.flush()
+            for unit in units:
+                completed = au_splitter.feed(unit)
+                if completed:
+                    yield b''.join(completed)
+            if not data:
+                break
+
+    completed = au_splitter.flush()
+    if completed:
+        yield b''.join(completed)
+
+
+def main():
+    module_dir = os.path.join(os.path.dirname(__file__), '..')
+    network_config = config.load_from_file(os.path.join(module_dir, 'config/network.json'))
+    camera_config = config.load_from_file(os.path.join(module_dir, 'config/camera.json'))
+
+    parser = argparse.ArgumentParser(description='Publish an H.264 file as a camera video feed.')
+    parser.add_argument('filename', help='H.264 elementary stream (Annex-B) to play')
+    parser.add_argument('--host', default='h264publish', help='camera hostname to publish as')
+    parser.add_argument('--port', type=int, default=network_config['h264_pub_port'])
+    parser.add_argument('--fps', type=float, default=camera_config['framerate'])
+    parser.add_argument('--framing', choices=['fixed', 'nal'], default=network_config['video_framing'])
+    parser.add_argument('--loop', action='store_true', help='replay the file until interrupted')
+    args = parser.parse_args()
+
+    context = zmq.Context()
+    if args.framing == 'nal':
+        videosocket = context.socket(zmq.XPUB)
+        videosocket.setsockopt(zmq.XPUB_VERBOSE, 1)
+        output = NalZeroMqOutput(videosocket, args.host, network_config['nal_batch_size'],
+                                 cachesize=network_config['gop_cache_size'])
+    else:
+        videosocket = context.socket(zmq.PUB)
+        output = ZeroMqOutput(videosocket, args.host, network_config['net_frame_size'])
+
+    log.info('Publishing %s as %s on port %i at %.1f fps.', args.filename, args.host, args.port, args.fps)
+    videosocket.bind('tcp://*:%s' % args.port)
+
+    interval = 1.0 / args.fps
+    due = time.time()
+    frames = 0
+    with output:
+        while True:
+            for access_unit in access_units(args.filename):
+                output.write(access_unit)
+                if args.framing == 'nal':
+                    # Every write is a whole frame, so send the last unit now.
+                    output.flush()
+                frames += 1
+
+                due += interval
+                delay = due - time.time()
+                if delay > 0:
+                    time.sleep(delay)
+
+            log.info('Published %i frames.', frames)
+            if not args.loop:
+                break
+
+
+if __name__ == '__main__':
+    root = logging.getLogger()
+    root.setLevel(logging.INFO)
+    ch = logging.StreamHandler(sys.stdout)
+    formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    ch.setFormatter(formatter)
+    root.addHandler(ch)
+
+    main()
@@ -0,0 +1,93 @@
+#!/usr/bin/env python
+"""Shows the metrics published by cameras, recorders and monitors as
+they arrive.  Each endpoint is host:port, with the port defaulting to
+the camera stats port.  For example:
+
+    python -m tools.stattail cctvdoor cctvrecorder:5880 --match ingest
+
+Counters are shown with their rate since the previous snapshot and
+histograms with their count, mean and the bucket holding the 95th
+percentile.
+"""
+
+import os
+import sys
+import zmq
+import json
+import time
+import argparse
+
+import config
+
+
+def labels_text(labels):
+    return ','.join('%s=%s' % item for item in sorted(labels.items()))
+
+
+def percentile_bound(sample, fraction):
+    """Returns the upper bound of the bucket holding the given fraction
+    of observations, or None if it is past the last bucket."""
+    target = sample['count'] * fraction
+    cumulative = 0
+    for bound, count in sample['buckets']:
+        cumulative += count
+        if cumulative >= target:
+            return bound
+    return None
+
+
+def format_sample(sample, previous, elapsed):
+    if sample['kind'] == 'histogram':
+        if not sample['count']:
+            return 'count 0'
+        bound = percentile_bound(sample, 0.95)
+        return 'count %i, mean %.6f, p95 %s' % (sample['count'], sample['sum'] / sample['count'],
+                                                 '<= %g' % bound if bound is not None else 'over range')
+    if sample['kind'] == 'counter' and previous is not None and elapsed:
+        return '%s (%.1f/s)' % (sample['value'], (sample['value'] - previous['value']) / elapsed)
+    return '%s' % sample['value']
+
+
+def main():
+    module_dir = os.path.join(os.path.dirname(__file__), '..')
+    network_config = config.load_from_file(os.path.join(module_dir, 'config/network.json'))
+
+    parser = argparse.ArgumentParser(description='Tail the metrics published by pimonitor processes.')
+    parser.add_argument('endpoints', nargs='+', help='host or host:port to subscribe to')
+    parser.add_argument('--match', default='', help='only show metrics whose name contains this')
+    args = parser.parse_args()
+
+    context = zmq.Context()
+    socket = context.socket(zmq.SUB)
+    socket.setsockopt(zmq.SUBSCRIBE, '')
+    for endpoint in args.endpoints:
+        host, _, port = endpoint.partition(':')
+        socket.connect('tcp://%s:%s' % (host, port or network_config['camera_stats_port']))
+
+    previous = {}
+    try:
+        while True:
+            host, payload = socket.recv_multipart()
+            snapshot = json.loads(payload)
+            last_time, last_samples = previous.get(host, (None, {}))
+            elapsed = snapshot['time'] - last_time if last_time is not None else None
+
+            samples = {}
+            lines = []
+            for sample in snapshot['metrics']:
+                key = (sample['name'], labels_text(sample['labels']))
+                samples[key] = sample
+                if args.match in sample['name']:
+                    lines.append('  %-36s %-24s %s' % (key[0], key[1],
+                                                       format_sample(sample, last_samples.get(key), elapsed)))
+            previous[host] = (snapshot['time'], samples)
+
+            sys.stdout.write('%s %s\n%s\n' % (host, time.strftime('%H:%M:%S', time.localtime(snapshot['time'])),
+                                              '\n'.join(lines)))
+            sys.stdout.flush()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
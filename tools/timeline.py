@@ -0,0 +1,78 @@
+#!/usr/bin/env python
+"""Writes an HTML page showing a camera's recordings between two times
+as a timeline of keyframe thumbnails, using the sprite sheets kept
+beside each segment, so no video is decoded.  For example:
+
+    python -m tools.timeline cctvdoor 2015-06-01 2015-06-02 door.html
+
+Each thumbnail is labelled with its time, ready to cut a clip from with
+tools.clip.
+"""
+
+import os
+import sys
+import cgi
+import logging
+import datetime
+import argparse
+
+import config
+from recording.thumbnails import find_thumbnails
+from recording.eventstore import parse_time
+
+log = logging.getLogger(__name__)
+
+PAGE = '''<!DOCTYPE html>
+<html><head><meta charset="utf-8"><title>%(title)s</title>
+<style>
+body { font-family: sans-serif; }
+.thumbnail { display: inline-block; margin: 2px; font-size: 11px; text-align: center; }
+.thumbnail div { background-repeat: no-repeat; }
+</style></head>
+<body><h1>%(title)s</h1>
+%(thumbnails)s
+</body></html>
+'''
+
+THUMBNAIL = ('<div class="thumbnail"><div style="width: %ipx; height: %ipx; '
+             'background-image: url(\'%s\'); background-position: -%ipx -%ipx"></div>%s</div>')
+
+
+def main():
+    module_dir = os.path.join(os.path.dirname(__file__), '..')
+    recorder_config = config.load_from_file(os.path.join(module_dir, 'config/recorder.json'))
+
+    parser = argparse.ArgumentParser(description='Show the recordings of a camera as thumbnails.')
+    parser.add_argument('host', help='camera hostname')
+    parser.add_argument('start', type=parse_time, help='start time, e.g. 2015-06-01')
+    parser.add_argument('end', type=parse_time, help='end time, e.g. 2015-06-02')
+    parser.add_argument('output', help='HTML file to write')
+    parser.add_argument('--folder', default=recorder_config['recording_folder'], help='recording folder')
+    args = parser.parse_args()
+
+    thumbnails = find_thumbnails(args.folder, args.host, args.start, args.end)
+    if not thumbnails:
+        log.error('No thumbnails of %s found for that time.', args.host)
+        sys.exit(1)
+
+    output_folder = os.path.dirname(os.path.abspath(args.output))
+    items = []
+    for timestamp, path, x, y, width, height in thumbnails:
+        items.append(THUMBNAIL % (width, height, cgi.escape(os.path.relpath(path, output_folder), True), x, y,
+                                  datetime.datetime.fromtimestamp(timestamp).strftime('%Y-%m-%dT%H:%M:%S')))
+
+    title = '%s %s to %s' % (args.host, datetime.datetime.fromtimestamp(args.start).isoformat(),
+                             datetime.datetime.fromtimestamp(args.end).isoformat())
+    with open(args.output, 'w') as output:
+        output.write(PAGE % {'title': cgi.escape(title), 'thumbnails': '\n'.join(items)})
+    log.info('Wrote %i thumbnails to %s.', len(thumbnails), args.output)
+
+
+if __name__ == '__main__':
+    root = logging.getLogger()
+    root.setLevel(logging.INFO)
+    ch = logging.StreamHandler(sys.stderr)
+    ch.setFormatter(logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s'))
+    root.addHandler(ch)
+
+    main()